@@ -0,0 +1,71 @@
+"""
+User features of growing depth over a synthetic knowledge graph, counted exactly or through sketches.
+
+Usage:
+    python -m benchmarks.deep_features [--users 2000] [--items 4000] [--depths 1 2 3] [--width 16384]
+                                       [--candidates 512] [--fol 10] [--sol 10]
+
+For every depth the (item, feature) pairs a materialized item matrix would hold are counted, then the features
+of every user are extracted with exact counts of every feature and with count-min sketches and exact counts of
+the candidates only; the seconds, peak rss and agreement of the two selections are printed.
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.synthetic import make_dataset
+from external.models.kgflex import KnowledgeGraph, SketchFeatureMapper, Profiler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex features of any depth')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=4000)
+    parser.add_argument('--entities', type=int, default=1000)
+    parser.add_argument('--objects', type=int, default=10000)
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--width', type=int, default=2 ** 14, help='columns of the count-min sketches')
+    parser.add_argument('--candidates', type=int, default=512, help='features of a user counted exactly')
+    parser.add_argument('--fol', type=int, default=10)
+    parser.add_argument('--sol', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.users, args.items, args.entities, args.objects, depth=max(args.depths),
+                           seed=args.seed)
+    clients = list(dataset['i_train'])
+    for depth in args.depths:
+        graph = KnowledgeGraph.KnowledgeGraph(dataset['feature_map'], dataset['predicate_mapping'],
+                                              dataset['triples'], dataset['private_items'], depth)
+        pairs, distinct = 0, set()
+        for start in range(0, args.items, 256):
+            _, keys = graph.expand(np.arange(start, min(start + 256, args.items)))
+            pairs += len(keys)
+            distinct.update(np.unique(keys).tolist())
+
+        profiler = Profiler.Profiler()
+        selections = dict()
+        for name, candidates in (('exact', -1), ('sketch', args.candidates)):
+            profiler.phase(name)
+            mapper = SketchFeatureMapper.SketchFeatureMapper(dataset['i_train'], graph, args.seed, args.width,
+                                                             candidates)
+            mapper.compute_and_export_features(clients, args.fol, args.sol)
+            selections[name] = mapper
+        profiler.stop()
+
+        exact, sketch = selections['exact'], selections['sketch']
+        agreement = []
+        for row in range(len(clients)):
+            a = set(exact.features[exact.indptr[row]:exact.indptr[row + 1]].tolist())
+            b = set(sketch.features[sketch.indptr[row]:sketch.indptr[row + 1]].tolist())
+            if a | b:
+                agreement.append(len(a & b) / len(a | b))
+        print(f'depth {depth}: {pairs} item feature pairs, {len(distinct)} features, '
+              f'{len(np.unique(sketch.features))} model features')
+        for phase in profiler.phases:
+            print(f'    {phase["phase"]:<8} {phase["seconds"]:9.2f} s  peak {phase["peak_rss_mb"]:9.1f} MiB')
+        print(f'    selection agreement (jaccard) {np.mean(agreement):.4f}')
+
+
+if __name__ == '__main__':
+    main()
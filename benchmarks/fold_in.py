@@ -0,0 +1,78 @@
+"""
+Latency and accuracy of the fold-in of new users in a trained KGFlex model.
+
+Usage:
+    python -m benchmarks.fold_in [--users 2000] [--items 4000] [--new 0.1] [--epochs 50] [--steps 10]
+
+The model is trained on the first users of a synthetic dataset, the other ones are folded in afterwards;
+the fold-in milliseconds of each user and HR@k / nDCG@k of trained and folded in users are printed.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_dataset
+from benchmarks.pipeline import Pipeline
+from external.models.kgflex import Client, ClientModel
+
+
+def accuracy(recommendations, test, k):
+    """ HR@k and nDCG@k of lists of recommended items against sets of test items """
+    discount = 1 / np.log2(np.arange(2, k + 2))
+    hits, ndcg = [], []
+    for recommended, relevant in zip(recommendations, test):
+        if not relevant:
+            continue
+        hit = np.array([i in relevant for i in recommended], dtype=float)
+        hits.append(hit.any())
+        ndcg.append((hit * discount[:len(hit)]).sum() / discount[:min(len(relevant), k)].sum())
+    return float(np.mean(hits)), float(np.mean(ndcg))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex fold-in of new users')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=4000)
+    parser.add_argument('--new', type=float, default=0.1, help='fraction of users folded in after training')
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--steps', type=int, default=10, help='local training steps of a folded in user')
+    parser.add_argument('--lr', type=float, default=0.05)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.users, args.items, seed=args.seed)
+    n_trained = args.users - int(args.users * args.new)
+    trained = dict(dataset, i_train={u: dataset['i_train'][u] for u in range(n_trained)},
+                   private_users={u: u for u in range(n_trained)})
+    pipeline = Pipeline(trained, lr=args.lr, seed=args.seed)
+    pipeline.train(args.epochs)
+
+    store = pipeline.client_store
+    milliseconds, recommendations = [], []
+    for u in range(n_trained, args.users):
+        start = time.perf_counter()
+        items = list(dataset['i_train'][u])
+        row = pipeline.server.fold_in(items, pipeline.feature_depth, pipeline.fol, pipeline.sol, args.steps,
+                                      args.seed)
+        milliseconds.append((time.perf_counter() - start) * 1000)
+
+        client = Client.Client(u, ClientModel.ClientModel(store, row), items, None, pipeline.item_features_mask,
+                               pipeline.sampler, args.seed)
+        mask = np.ones(args.items, dtype=bool)
+        mask[items] = False
+        recommendations.append([i for i, _ in client.predict(pipeline.server_model, dataset['private_items'],
+                                                              mask, args.k)])
+
+    folded_hr, folded_ndcg = accuracy(recommendations, [dataset['i_test'][u] for u in range(n_trained, args.users)],
+                                      args.k)
+    metrics = pipeline.evaluate(args.k)
+    print(f'fold-in of {len(milliseconds)} users: p50 {np.percentile(milliseconds, 50):.2f} ms, '
+          f'p99 {np.percentile(milliseconds, 99):.2f} ms')
+    print(f'trained users      HR@{args.k} {metrics["hr"]:.4f} nDCG@{args.k} {metrics["ndcg"]:.4f}')
+    print(f'folded in users    HR@{args.k} {folded_hr:.4f} nDCG@{args.k} {folded_ndcg:.4f}')
+
+
+if __name__ == '__main__':
+    main()
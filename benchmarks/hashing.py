@@ -0,0 +1,57 @@
+"""
+Accuracy and server memory of the hashed feature mode of KGFlex against the number of buckets.
+
+Usage:
+    python -m benchmarks.hashing [--users 2000] [--items 4000] [--buckets 0 256 1024 4096 16384] [--epochs 50]
+
+For every bucket count (0: one server feature per model feature) the model is built and trained on the same
+synthetic dataset; the server features and MiB, the model features sharing a bucket and HR@k / nDCG@k are
+printed.
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.synthetic import make_dataset
+from benchmarks.pipeline import Pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex feature hashing')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=4000)
+    parser.add_argument('--buckets', type=int, nargs='+', default=[0, 256, 1024, 4096, 16384])
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--embedding', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.05)
+    parser.add_argument('--fol', type=int, default=-1)
+    parser.add_argument('--sol', type=int, default=-1)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.users, args.items, seed=args.seed)
+    rows = []
+    for buckets in args.buckets:
+        pipeline = Pipeline(dataset, args.embedding, args.lr, fol=args.fol, sol=args.sol, seed=args.seed,
+                            buckets=buckets)
+        pipeline.train(args.epochs)
+        metrics = pipeline.evaluate(args.k)
+        server = pipeline.server_model
+        n_features = len(pipeline.model_features_mapping)
+        shared = 0.0
+        if pipeline.feature_hashing is not None:
+            load = np.bincount(pipeline.feature_hashing.bucket, minlength=buckets)
+            shared = float((load[pipeline.feature_hashing.bucket] > 1).mean())
+        rows.append((buckets, n_features, len(server.feature_bias),
+                     (server.feature_vecs.nbytes + server.feature_bias.nbytes) / 2 ** 20, shared, metrics['hr'],
+                     metrics['ndcg']))
+
+    print(f'{"buckets":>8} {"features":>9} {"server":>8} {"MiB":>8} {"shared":>7} {"HR@" + str(args.k):>8} '
+          f'{"nDCG@" + str(args.k):>8}')
+    for buckets, n_features, n_server, mib, shared, hr, ndcg in rows:
+        print(f'{buckets:>8} {n_features:>9} {n_server:>8} {mib:>8.3f} {shared:>7.3f} {hr:>8.4f} {ndcg:>8.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Append-only item ingestion in a trained KGFlex model.
+
+Usage:
+    python -m benchmarks.ingestion [--users 2000] [--items 4000] [--new 4000] [--batch 100] [--epochs 20]
+
+New items, with the knowledge-graph features of random catalog items, are appended in batches; the
+milliseconds of each batch and the top-k latency of the inverted index before and after are printed.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.synthetic import make_dataset
+from benchmarks.pipeline import Pipeline
+
+
+def top_k_milliseconds(pipeline, users, k):
+    """ mean milliseconds of the index top-k of the given users """
+    store, index = pipeline.client_store, pipeline.server.index
+    mask = np.ones(index.n_items, dtype=bool)
+    start = time.perf_counter()
+    for u in users:
+        _, slots = store.slots([pipeline.clients[u].model.row])
+        features = store.features[slots]
+        scores = store.weights[slots] * ((store.vecs[slots] * pipeline.server_model.feature_vecs[features]).sum(axis=1)
+                                         + pipeline.server_model.feature_bias[features])
+        index.top_k(features, scores, mask, k)
+    return (time.perf_counter() - start) * 1000 / len(users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex item ingestion')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=4000)
+    parser.add_argument('--new', type=int, default=4000, help='number of appended items')
+    parser.add_argument('--batch', type=int, default=100, help='items appended together')
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.users, args.items, seed=args.seed)
+    pipeline = Pipeline(dataset, predictor='index', seed=args.seed)
+    pipeline.train(args.epochs)
+    users = np.random.RandomState(args.seed).randint(args.users, size=min(args.users, 200))
+    before = top_k_milliseconds(pipeline, users, args.k)
+
+    # new items carry the features of random catalog items
+    item_features = dataset['feature_map'].groupby('itemId')
+    features = {item: list(zip(rows.predicate, rows.object)) for item, rows in item_features}
+    twins = np.random.RandomState(args.seed).choice(list(features), args.new)
+    milliseconds = []
+    for start in range(0, args.new, args.batch):
+        batch = twins[start:start + args.batch]
+        begin = time.perf_counter()
+        encoded = [[pipeline.model_features_mapping[f] for f in features[t] if f in pipeline.model_features_mapping]
+                   for t in batch]
+        ids = pipeline.item_store.append(encoded)
+        pipeline.server.index.refresh()
+        milliseconds.append((time.perf_counter() - begin) * 1000)
+        dataset['private_items'].update({i: f'new-{i}' for i in ids.tolist()})
+    after = top_k_milliseconds(pipeline, users, args.k)
+
+    print(f'{args.new} items appended in batches of {args.batch}: p50 {np.percentile(milliseconds, 50):.2f} ms, '
+          f'p99 {np.percentile(milliseconds, 99):.2f} ms, {args.new / sum(milliseconds) * 1000:.0f} items/s')
+    print(f'index top-{args.k}: {before:.2f} ms per user with {args.items} items, '
+          f'{after:.2f} ms with {pipeline.item_store.n_items} items')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+KGFlex pipeline of the benchmarks: the model built by external/models/kgflex/KGFlex.py, without the Elliot
+experiment machinery, on a dataset of benchmarks/synthetic.py.
+"""
+import math
+import time
+
+import numpy as np
+
+from external.models.kgflex.ItemFeatures import ItemFeatures
+from external.models.kgflex.UserFeatureMapper import UserFeatureMapper
+from external.models.kgflex import Client, ClientModel, ClientStore, Server, ServerModel, RoundEngine, Sampler, \
+    FeatureIndex, Profiler, ItemStore, FeatureHashing
+
+
+class Pipeline:
+    """ class Pipeline: KGFlex features, clients and server of a dataset """
+
+    def __init__(self, dataset, embedding=10, lr=0.01, q=0.1, fol=-1, sol=-1, parallel_ufm=1, dtype='float32',
+                 predictor='block', neg_sampling='uniform', seed=42, profiler=None, buckets=0):
+        """
+        :param dataset: dict of benchmarks/synthetic.py
+        :param buckets: number of hashed server features, 0 for one server feature per model feature
+        :param profiler: profiler of the construction phases, a new one if missing
+        """
+        np.random.seed(seed)
+        self.dataset = dataset
+        self.q = q
+        self.fol, self.sol, self.seed = fol, sol, seed
+        self.dtype = np.dtype(dtype)
+        self.profiler = profiler or Profiler.Profiler()
+        i_train = dataset['i_train']
+
+        self.profiler.phase('item features')
+        self.item_features = ItemFeatures(dataset['feature_map'], dataset['private_items'])
+
+        self.profiler.phase('user features')
+        self.user_feature_mapper = UserFeatureMapper(i_train, self.item_features, dataset['predicate_mapping'], seed)
+        client_ids = list(i_train.keys())
+        self.user_feature_mapper.compute_and_export_features(client_ids, parallel_ufm, fol, sol)
+
+        self.profiler.phase('model setup')
+        codes, first = np.unique(self.user_feature_mapper.features, return_index=True)
+        model_codes = codes[np.argsort(first)]
+        code_to_model = np.full(self.item_features.n_features, -1, dtype=np.int64)
+        code_to_model[model_codes] = np.arange(len(model_codes))
+        item_features = self.item_features.features
+        model_features_mapping = {item_features[code]: model_id for model_id, code in enumerate(model_codes)}
+        self.feature_depth = self.user_feature_mapper.feature_depth[model_codes]
+        self.model_features_mapping = model_features_mapping
+        mask = self.item_features.mask(model_codes)
+        store_indptr, store_features, store_weights = self.user_feature_mapper.indptr, \
+            code_to_model[self.user_feature_mapper.features], self.user_feature_mapper.gains
+        self.feature_hashing = FeatureHashing.FeatureHashing(list(model_features_mapping), buckets, seed) \
+            if buckets > 0 else None
+        if self.feature_hashing is not None:
+            mask = self.feature_hashing.mask(mask)
+            store_indptr, store_features, store_weights = self.feature_hashing.clients(store_indptr, store_features,
+                                                                                       store_weights)
+            self.feature_depth = self.feature_hashing.bucket_depth(self.feature_depth)
+        self.item_store = ItemStore.ItemStore(mask, self.dtype)
+        self.item_features_mask = self.item_store.matrix
+
+        self.server_model = ServerModel.ServerModel(model_features_mapping if self.feature_hashing is None
+                                                    else range(buckets), embedding, seed, self.dtype)
+        self.sampler = Sampler.Sampler([list(i_train[c]) for c in client_ids], self.item_features_mask.shape[0],
+                                       neg_sampling)
+        self.client_store = ClientStore.ClientStore(store_indptr, store_features, store_weights, embedding, seed,
+                                                    self.dtype)
+        self.clients = [Client.Client(c, ClientModel.ClientModel(self.client_store, row), i_train[c], None,
+                                      self.item_features_mask, self.sampler, seed)
+                        for row, c in enumerate(client_ids)]
+        self.round_engine = RoundEngine.RoundEngine(self.item_features_mask, self.client_store, None, self.dtype)
+        self.server = Server.Server(lr, self.server_model, self.round_engine,
+                                    FeatureIndex.FeatureIndex(self.item_features_mask, self.dtype)
+                                    if predictor == 'index' else None, self.sampler)
+        self.profiler.stop()
+
+    def model_bytes(self):
+        """ bytes of the server and client arrays """
+        return sum(a.nbytes for a in (self.server_model.feature_vecs, self.server_model.feature_bias,
+                                      self.client_store.weights, self.client_store.vecs))
+
+    def train(self, epochs):
+        """
+        Batch rounds on a fraction q of the clients.
+        :return: seconds of each round
+        """
+        times = []
+        for _ in range(epochs):
+            selected = list(np.random.choice(self.clients, math.ceil(self.q * len(self.clients)), replace=False))
+            start = time.perf_counter()
+            self.server.train_model_batch(selected)
+            times.append(time.perf_counter() - start)
+        return times
+
+    def evaluate(self, k=10):
+        """
+        Top-k of every user among the items it has not rated, against the test items.
+        :return: dict hr, ndcg and predict seconds
+        """
+        private_users, private_items = self.dataset['private_users'], self.dataset['private_items']
+        n_users, n_items = len(self.clients), self.item_features_mask.shape[0]
+        mask = np.ones((n_users, n_items), dtype=bool)
+        for c in self.clients:
+            mask[c.user_id, list(self.dataset['i_train'][c.user_id])] = False
+
+        start = time.perf_counter()
+        predictions = self.server.predict(self.clients, private_users, private_items, mask, k)
+        seconds = time.perf_counter() - start
+
+        discount = 1 / np.log2(np.arange(2, k + 2))
+        hits, ndcg = [], []
+        for c in self.clients:
+            recommended = predictions[private_users[c.user_id]]
+            test = {private_items[i] for i in self.dataset['i_test'][c.user_id]}
+            if not test:
+                continue
+            relevant = np.array([i in test for i, _ in recommended], dtype=float)
+            hits.append(relevant.any())
+            ndcg.append((relevant * discount[:len(relevant)]).sum() / discount[:min(len(test), k)].sum())
+        return {'hr': float(np.mean(hits)), 'ndcg': float(np.mean(ndcg)), 'predict_s': seconds}
@@ -0,0 +1,38 @@
+"""
+Speed and accuracy of KGFlex trained in float32 and in float64 on the same synthetic dataset.
+
+Usage:
+    python -m benchmarks.precision [--users 2000] [--items 4000] [--epochs 20] [--embedding 10]
+"""
+import argparse
+
+import numpy as np
+
+from benchmarks.synthetic import make_dataset
+from benchmarks.pipeline import Pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex float32 vs float64')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=4000)
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--embedding', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.01)
+    parser.add_argument('--q', type=float, default=0.1)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.users, args.items, seed=args.seed)
+    print(f'{"dtype":>8} {"round ms":>10} {"predict s":>10} {"model MB":>10} {"HR@k":>8} {"nDCG@k":>8}')
+    for dtype in ('float64', 'float32'):
+        pipeline = Pipeline(dataset, args.embedding, args.lr, args.q, dtype=dtype, seed=args.seed)
+        times = pipeline.train(args.epochs)
+        metrics = pipeline.evaluate(args.k)
+        print(f'{dtype:>8} {np.median(times) * 1000:>10.2f} {metrics["predict_s"]:>10.3f} '
+              f'{pipeline.model_bytes() / 2 ** 20:>10.2f} {metrics["hr"]:>8.4f} {metrics["ndcg"]:>8.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Scaling of the KGFlex stages on synthetic knowledge graphs of growing size.
+
+Usage:
+    python -m benchmarks.scaling [--scales 1 2 4 8] [--users 1000] [--items 2000] [--depth 2] [--compare OLD.tsv]
+
+Users, items, entities and objects grow with the scale. Every size runs in a new process: its dataset is
+generated and written in the layout of the data folder, then loaded, and the stages are profiled.
+The seconds, throughput and peak rss of every (size, stage) are written in OUTPUT/scaling_TIME.tsv, with the
+settings and accuracy in OUTPUT/scaling_TIME.json; --compare prints the ratios against a previous tsv.
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import make_dataset, write, read
+from benchmarks.pipeline import Pipeline
+from external.models.kgflex import Profiler
+
+# stage: throughput unit
+STAGES = {'loading': 'rows/s', 'item features': 'rows/s', 'user features': 'users/s', 'model setup': 'users/s',
+          'training epoch': 'samples/s', 'prediction': 'users/s'}
+
+
+def run(config, results):
+    """ run the stages on the dataset of a size, in a process of its own, and put the rows in results """
+    profiler = Profiler.Profiler()
+    folder = tempfile.mkdtemp(prefix='kgflex_scaling_')
+    try:
+        dataset = make_dataset(config['users'], config['items'], config['entities'], config['objects'],
+                               depth=config['depth'], item_exponent=config['item_exponent'],
+                               feature_exponent=config['feature_exponent'], seed=config['seed'])
+        write(dataset, folder)
+        del dataset
+
+        profiler.phase('loading')
+        dataset = read(folder)
+        profiler.stop()
+        pipeline = Pipeline(dataset, config['embedding'], config['lr'], config['q'], parallel_ufm=config['workers'],
+                            dtype=config['dtype'], seed=config['seed'], profiler=profiler)
+        profiler.phase('training epoch')
+        pipeline.train(1)
+        profiler.phase('prediction')
+        metrics = pipeline.evaluate()
+        profiler.stop()
+    finally:
+        shutil.rmtree(folder)
+
+    n_rows = len(dataset['feature_map'])
+    n_interactions = sum(len(i) for i in dataset['i_train'].values()) + \
+        sum(len(i) for i in dataset['i_test'].values())
+    work = {'loading': n_rows + n_interactions, 'item features': n_rows, 'user features': config['users'],
+            'model setup': config['users'], 'training epoch': pipeline.server.round_stats[-1]['samples'],
+            'prediction': config['users']}
+    size = {'scale': config['scale'], 'users': config['users'], 'items': config['items'],
+            'interactions': n_interactions, 'feature_rows': n_rows,
+            'model_features': int(pipeline.item_features_mask.shape[1])}
+
+    rows = []
+    for phase in profiler.phases:
+        seconds = metrics['predict_s'] if phase['phase'] == 'prediction' else phase['seconds']
+        rows.append(dict(size, stage=phase['phase'], seconds=seconds,
+                         throughput=work[phase['phase']] / seconds if seconds > 0 else 0.0,
+                         unit=STAGES[phase['phase']], peak_rss_mb=phase['peak_rss_mb']))
+    results.put((rows, dict(size, hr=metrics['hr'], ndcg=metrics['ndcg'])))
+
+
+def compare(previous, current):
+    """ time and memory ratio of every (users, items, stage) against a previous run """
+    merged = pd.merge(previous, current, on=['users', 'items', 'stage'], suffixes=('_old', '_new'))
+    merged['time_ratio'] = merged.seconds_new / merged.seconds_old
+    merged['rss_ratio'] = merged.peak_rss_mb_new / merged.peak_rss_mb_old
+    print(merged[['users', 'items', 'stage', 'seconds_old', 'seconds_new', 'time_ratio', 'rss_ratio']]
+          .to_string(index=False, float_format='%.3f'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex scaling on synthetic knowledge graphs')
+    parser.add_argument('--scales', type=float, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--users', type=int, default=1000, help='users at scale 1')
+    parser.add_argument('--items', type=int, default=2000, help='items at scale 1')
+    parser.add_argument('--entities', type=int, default=500, help='first hop entities at scale 1')
+    parser.add_argument('--objects', type=int, default=5000, help='second hop objects at scale 1')
+    parser.add_argument('--depth', type=int, default=2, choices=(1, 2))
+    parser.add_argument('--item-exponent', type=float, default=0.8)
+    parser.add_argument('--feature-exponent', type=float, default=1.1)
+    parser.add_argument('--embedding', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.01)
+    parser.add_argument('--q', type=float, default=0.1)
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--workers', type=int, default=1, help='processes of the user features extraction')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default=os.path.join('benchmarks', 'results'))
+    parser.add_argument('--compare', default=None, help='tsv of a previous run')
+    args = parser.parse_args()
+
+    rows, summaries = [], []
+    for scale in args.scales:
+        config = dict(vars(args), scale=scale, users=int(args.users * scale), items=int(args.items * scale),
+                      entities=int(args.entities * scale), objects=int(args.objects * scale))
+        results = Queue()
+        process = Process(target=run, args=(config, results))
+        process.start()
+        point_rows, summary = results.get()
+        process.join()
+        rows += point_rows
+        summaries.append(summary)
+        for r in point_rows:
+            print(f'{r["users"]:>8} users {r["items"]:>8} items  {r["stage"]:<15} {r["seconds"]:>9.3f}s '
+                  f'{r["throughput"]:>12.1f} {r["unit"]:<10} peak {r["peak_rss_mb"]:>8.1f} MiB')
+
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, f'scaling_{time.strftime("%Y%m%d-%H%M%S")}')
+    current = pd.DataFrame(rows)
+    current.to_csv(f'{path}.tsv', sep='\t', index=False)
+    with open(f'{path}.json', 'w') as file:
+        json.dump({'settings': vars(args), 'sizes': summaries, 'stages': rows}, file, indent=2,
+                  default=lambda o: o.item() if isinstance(o, np.generic) else str(o))
+    print(f'results written in {path}.tsv')
+
+    if args.compare:
+        compare(pd.read_csv(args.compare, sep='\t'), current)
+
+
+if __name__ == '__main__':
+    main()
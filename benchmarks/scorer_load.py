@@ -0,0 +1,79 @@
+"""
+Load generator for the KGFlex scoring service.
+
+Usage:
+    python -m benchmarks.scorer_load CHECKPOINT_FOLDER [--clients 8] [--seconds 10] [--batch 1] [--k 10]
+    python -m benchmarks.scorer_load CHECKPOINT_FOLDER --url http://127.0.0.1:8080
+
+Without --url the service is started in process on an ephemeral port. Each client thread keeps sending
+requests for random users; throughput and client-side latencies are printed with the service counters.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+from kgflex_scorer import Scorer, serve
+
+
+def client(url, users, batch, k, deadline, latencies, seed):
+    generator = random.Random(seed)
+    while time.perf_counter() < deadline:
+        chosen = [generator.choice(users) for _ in range(batch)]
+        if batch == 1:
+            request = Request(f'{url}/topk?user={chosen[0]}&k={k}')
+        else:
+            request = Request(f'{url}/topk', data=json.dumps({'users': chosen, 'k': k}).encode(),
+                              headers={'Content-Type': 'application/json'})
+        start = time.perf_counter()
+        with urlopen(request) as response:
+            response.read()
+        latencies.append(time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex scoring service load generator')
+    parser.add_argument('checkpoint', help='folder of a KGFlex checkpoint')
+    parser.add_argument('--url', default=None, help='running service, started in process if missing')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent client threads')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--batch', type=int, default=1, help='users in a request')
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    scorer = Scorer(args.checkpoint)
+    users = list(scorer.users)
+    server = None
+    url = args.url
+    if url is None:
+        server = serve(scorer, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    latencies = []
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=client, args=(url, users, args.batch, args.k, deadline, latencies, seed))
+               for seed in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = np.array(latencies)
+    print(f'{len(latencies)} requests of {args.batch} users from {args.clients} clients in {args.seconds:.1f}s: '
+          f'{len(latencies) / args.seconds:.1f} requests/s, {len(latencies) * args.batch / args.seconds:.1f} users/s')
+    if len(latencies):
+        print(f'client latency: p50 {np.percentile(latencies, 50) * 1000:.2f} ms, '
+              f'p99 {np.percentile(latencies, 99) * 1000:.2f} ms')
+    with urlopen(f'{url}/stats') as response:
+        print(f'service counters: {json.loads(response.read())}')
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Online updates of the user features of a trained KGFlex model while new interactions stream in.
+
+Usage:
+    python -m benchmarks.streaming [--users 2000] [--items 4000] [--streamed 0.3] [--epochs 50] [--drift 0.1]
+                                   [--min-growth 10]
+
+The model is trained on the first training items of every user, the other ones stream in afterwards one at a
+time, in random order. Each interaction updates the feature counts of its user, who is marked for a new selection
+only when needed; the marked users are selected again, once each, at the end of the stream. The microseconds of
+the updates and of the selections, the number of selections and HR@k / nDCG@k before and after the stream are
+printed, next to the cost of counting the features of the user from scratch.
+"""
+import argparse
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from benchmarks.synthetic import make_dataset
+from benchmarks.pipeline import Pipeline
+from external.models.kgflex import FeatureStream
+from external.models.kgflex.UserFeatureMapper import select_features
+
+
+def main():
+    parser = argparse.ArgumentParser(description='KGFlex streaming user features')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=4000)
+    parser.add_argument('--streamed', type=float, default=0.3, help='fraction of training items streamed in')
+    parser.add_argument('--epochs', type=int, default=50)
+    parser.add_argument('--steps', type=int, default=10, help='local training steps of a user whose features change')
+    parser.add_argument('--fol', type=int, default=-1)
+    parser.add_argument('--sol', type=int, default=-1)
+    parser.add_argument('--tolerance', type=float, default=0.0)
+    parser.add_argument('--drift', type=float, default=0.1)
+    parser.add_argument('--min-growth', type=int, default=10)
+    parser.add_argument('--lr', type=float, default=0.05)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    dataset = make_dataset(args.users, args.items, seed=args.seed)
+    rs = np.random.RandomState(args.seed)
+    initial, stream = dict(), []
+    for u, items in dataset['i_train'].items():
+        items = list(items)
+        n_initial = max(1, len(items) - int(len(items) * args.streamed))
+        initial[u] = {i: 1 for i in items[:n_initial]}
+        stream += [(u, i) for i in items[n_initial:]]
+    stream = [stream[s] for s in rs.permutation(len(stream))]
+
+    pipeline = Pipeline(dict(dataset, i_train=initial), lr=args.lr, fol=args.fol, sol=args.sol, seed=args.seed)
+    pipeline.train(args.epochs)
+    # streamed items are not recommended, before and after the stream
+    pipeline.dataset = dataset
+    before = pipeline.evaluate(args.k)
+
+    features = FeatureStream.FeatureStream(pipeline.item_features_mask, pipeline.feature_depth, args.fol, args.sol,
+                                           args.tolerance, args.drift, args.min_growth, args.seed)
+    for u, items in initial.items():
+        client = pipeline.clients[u]
+        features.seed(u, list(items), client.model.features, client.model.user_weights)
+    rankings = features.rankings
+
+    # the users marked by the stream are selected again before the evaluation, once each
+    updates, refreshes, changed, pending = [], [], 0, set()
+    for u, i in stream:
+        client = pipeline.clients[u]
+        start = time.perf_counter()
+        client.pos_items.append(i)
+        pipeline.sampler.add(client.model.row, [i])
+        if features.add(u, [i]):
+            pending.add(u)
+        updates.append((time.perf_counter() - start) * 1e6)
+    for u in sorted(pending):
+        client = pipeline.clients[u]
+        start = time.perf_counter()
+        selected, gains = features.features(u)
+        changed += pipeline.server.refresh(client.model.row, client.pos_items, selected, gains, args.steps,
+                                           args.seed)
+        refreshes.append((time.perf_counter() - start) * 1e6)
+    after = pipeline.evaluate(args.k)
+
+    # counts and selection of a user from scratch, as a fold-in, on a sample of the stream
+    mask = pipeline.item_features_mask
+    scratch = []
+    for u, _ in stream[:500]:
+        start = time.perf_counter()
+        items = np.array(pipeline.clients[u].pos_items)
+        negatives = np.unique(pipeline.sampler.negative(np.full(len(items), pipeline.clients[u].model.row)))
+        select_features(csr_matrix(mask[items].sum(axis=0)), csr_matrix(mask[negatives].sum(axis=0)),
+                        np.array([len(items)]), pipeline.feature_depth, args.fol, args.sol)
+        scratch.append((time.perf_counter() - start) * 1e6)
+
+    print(f'{len(stream)} streamed interactions of {len(set(u for u, _ in stream))} users: {len(refreshes)} '
+          f'selections ({features.rankings - rankings} rankings, {changed} feature changes)')
+    print(f'count update       p50 {np.percentile(updates, 50):9.1f} us  p99 {np.percentile(updates, 99):9.1f} us')
+    if refreshes:
+        print(f'selection          p50 {np.percentile(refreshes, 50):9.1f} us  '
+              f'p99 {np.percentile(refreshes, 99):9.1f} us')
+    print(f'from scratch       p50 {np.percentile(scratch, 50):9.1f} us  p99 {np.percentile(scratch, 99):9.1f} us')
+    print(f'before the stream  HR@{args.k} {before["hr"]:.4f} nDCG@{args.k} {before["ndcg"]:.4f}')
+    print(f'after the stream   HR@{args.k} {after["hr"]:.4f} nDCG@{args.k} {after["ndcg"]:.4f}')
+
+
+if __name__ == '__main__':
+    main()
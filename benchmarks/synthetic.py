@@ -0,0 +1,196 @@
+"""
+Synthetic knowledge-graph recommendation datasets for the KGFlex benchmarks.
+
+Items link to first hop entities, and entities to second hop objects, through typed predicates: item features
+are the (predicate, entity) pairs of the first hop and the (predicate~predicate, object) pairs of the second.
+The hops after the first one are also returned as knowledge-graph triples, with a third hop between objects
+when depth is 3, for the features of any depth expanded by KnowledgeGraph.
+Entity, object and item popularities follow power laws. Every user likes a few features and picks items by
+item popularity and number of liked features, so that the features carry a learnable signal.
+
+Usage:
+    python -m benchmarks.synthetic FOLDER [--users 1000] [--items 2000] [--depth 2] ...
+
+writes dataset.tsv, item_features.tsv, predicate_mapping.tsv and graph.tsv in the layout of the data folder;
+the timestamp of dataset.tsv is 0 for the training interactions and 1 for the test ones.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+URI = 'http://synthetic.kg/'
+
+
+def zipf_weights(n, exponent):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def edges(rs, n_sources, degree, n_targets, exponent):
+    """
+    Random edges from every source to power-law distributed targets, each edge counted once.
+    :param degree: range of the number of edges drawn by a source
+    :return: sorted sources and targets of the edges, csr indptr over the sources
+    """
+    cdf = np.cumsum(zipf_weights(n_targets, exponent)[rs.permutation(n_targets)])
+    owner = np.repeat(np.arange(n_sources), rs.randint(degree[0], degree[1] + 1, n_sources))
+    drawn = np.minimum(np.searchsorted(cdf, rs.random_sample(len(owner)) * cdf[-1]), n_targets - 1)
+    keys = np.unique(owner * n_targets + drawn)
+    sources, targets = keys // n_targets, keys % n_targets
+    return sources, targets, np.searchsorted(sources, np.arange(n_sources + 1))
+
+
+def make_dataset(n_users=1000, n_items=2000, n_entities=500, n_objects=5000, n_predicates=(8, 8), depth=2,
+                 item_degree=(2, 10), entity_degree=(1, 5), item_exponent=0.8, feature_exponent=1.1,
+                 profile=(5, 50), tastes=3, strength=2.0, test_ratio=0.2, block_size=1024, seed=42):
+    """
+    :param n_users: number of users
+    :param n_items: number of items
+    :param n_entities: number of first hop entities, i.e. first order feature cardinality
+    :param n_objects: number of second hop objects
+    :param n_predicates: number of first and second hop predicates, each entity and object has a single type
+    :param depth: 1 for first order features only, 2 for first and second order features, 3 for a third hop
+        in the triples (item features stop at the second order)
+    :param item_degree: range of the number of entities of an item
+    :param entity_degree: range of the number of objects of an entity
+    :param item_exponent: power-law exponent of the item popularity
+    :param feature_exponent: power-law exponent of the entity and object popularity
+    :param profile: range of the number of items of a user
+    :param tastes: number of features liked by a user
+    :param strength: preference for the items with liked features
+    :param test_ratio: fraction of the items of each user in the test set
+    :param block_size: users generated together
+    :param seed: random seed
+    :return: dict with i_train (user: {item: 1}), i_test (user: set of items), feature_map, predicate_mapping,
+        triples (subject, predicate uri, object of the hops after the first), private_users and private_items
+        (identity mappings)
+    """
+    rs = np.random.RandomState(seed)
+    first, second = n_predicates
+    entity_predicate = rs.randint(0, first, n_entities)
+    object_predicate = rs.randint(0, second, n_objects)
+
+    # first hop: (predicate, entity); second hop: (predicate~predicate, object), object ids after the entities
+    items, entities, _ = edges(rs, n_items, item_degree, n_entities, feature_exponent)
+    item_col, predicate_col, object_col = [items], [entity_predicate[entities]], [entities]
+    triples = [pd.DataFrame(columns=['subject', 'predicate', 'object'])]
+    if depth > 1:
+        sources, objects, indptr = edges(rs, n_entities, entity_degree, n_objects, feature_exponent)
+        triples.append(pd.DataFrame({'subject': sources, 'predicate': [f'{URI}q{q}' for q in
+                                                                       object_predicate[objects].tolist()],
+                                     'object': n_entities + objects}))
+        lengths = indptr[entities + 1] - indptr[entities]
+        offsets = np.cumsum(lengths) - lengths
+        slots = np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(indptr[entities], lengths)
+        path_entities, path_objects = sources[slots], objects[slots]
+        item_col.append(np.repeat(items, lengths))
+        predicate_col.append(first + entity_predicate[path_entities] * second + object_predicate[path_objects])
+        object_col.append(n_entities + path_objects)
+    if depth > 2:
+        sources, objects, _ = edges(rs, n_objects, entity_degree, n_objects, feature_exponent)
+        triples.append(pd.DataFrame({'subject': n_entities + sources,
+                                     'predicate': [f'{URI}q{q}' for q in object_predicate[objects].tolist()],
+                                     'object': n_entities + objects}))
+    feature_map = pd.DataFrame({'itemId': np.concatenate(item_col), 'predicate': np.concatenate(predicate_col),
+                                'object': np.concatenate(object_col)}).drop_duplicates()
+
+    # user profiles: Gumbel top-k over log(popularity) + strength * liked features of the item
+    feature_codes, feature_of_row = np.unique(feature_map.predicate.values * (n_entities + n_objects) +
+                                              feature_map.object.values, return_inverse=True)
+    n_features = len(feature_codes)
+    matrix = csr_matrix((np.ones(len(feature_map)), (feature_map.itemId.values, feature_of_row)),
+                        shape=(n_items, n_features))
+    feature_cdf = np.cumsum(np.asarray(matrix.sum(axis=0)).ravel())
+    log_popularity = np.log(zipf_weights(n_items, item_exponent))[rs.permutation(n_items)]
+    i_train, i_test = dict(), dict()
+    for start in range(0, n_users, block_size):
+        users = np.arange(start, min(start + block_size, n_users))
+        liked = np.minimum(np.searchsorted(feature_cdf, rs.random_sample((len(users), tastes)) * feature_cdf[-1]),
+                           n_features - 1)
+        taste = csr_matrix((np.ones(liked.size), (np.repeat(np.arange(len(users)), tastes), liked.ravel())),
+                           shape=(len(users), n_features))
+        keys = log_popularity + strength * (taste @ matrix.T).toarray() + rs.gumbel(size=(len(users), n_items))
+        sizes = np.minimum(rs.randint(profile[0], profile[1] + 1, len(users)), n_items)
+        ranking = np.argsort(-keys, axis=1)
+        for u, size, ranked in zip(users, sizes, ranking):
+            n_test = int(np.ceil(size * test_ratio)) if size > 1 else 0
+            i_train[int(u)] = {int(i): 1 for i in ranked[:size - n_test]}
+            i_test[int(u)] = set(ranked[size - n_test:size].tolist())
+
+    predicates = [(p, f'{URI}p{p}', 1) for p in range(first)]
+    if depth > 1:
+        predicates += [(first + p * second + q, f'{URI}p{p}~{URI}q{q}', 2) for p in range(first) for q in range(second)]
+    predicate_mapping = pd.DataFrame(predicates, columns=['predicate', 'uri', 'predicate_order'])
+    return {'i_train': i_train, 'i_test': i_test, 'feature_map': feature_map.reset_index(drop=True),
+            'predicate_mapping': predicate_mapping[['uri', 'predicate', 'predicate_order']],
+            'triples': pd.concat(triples, ignore_index=True),
+            'private_users': {u: u for u in range(n_users)}, 'private_items': {i: i for i in range(n_items)}}
+
+
+def write(dataset, folder):
+    """ write a dataset in the layout of the data folder """
+    os.makedirs(folder, exist_ok=True)
+    rows = [(u, i, 1.0, 0) for u, items in dataset['i_train'].items() for i in items] + \
+           [(u, i, 1.0, 1) for u, items in dataset['i_test'].items() for i in items]
+    pd.DataFrame(rows).to_csv(os.path.join(folder, 'dataset.tsv'), sep='\t', header=False, index=False)
+    dataset['feature_map'].to_csv(os.path.join(folder, 'item_features.tsv'), sep='\t', header=False, index=False)
+    dataset['predicate_mapping'].to_csv(os.path.join(folder, 'predicate_mapping.tsv'), sep='\t', header=False,
+                                        index=False)
+    dataset['triples'].to_csv(os.path.join(folder, 'graph.tsv'), sep='\t', header=False, index=False)
+
+
+def read(folder):
+    """
+    Read a dataset written by write, the way the KGFlex data loader reads its files.
+    :return: dict as make_dataset, users and items keep their public ids
+    """
+    ratings = pd.read_csv(os.path.join(folder, 'dataset.tsv'), sep='\t',
+                          names=['userId', 'itemId', 'rating', 'timestamp'])
+    feature_map = pd.read_csv(os.path.join(folder, 'item_features.tsv'), sep='\t',
+                              names=['itemId', 'predicate', 'object'])
+    predicate_mapping = pd.read_csv(os.path.join(folder, 'predicate_mapping.tsv'), sep='\t',
+                                    names=['uri', 'predicate', 'predicate_order'])
+    triples = pd.read_csv(os.path.join(folder, 'graph.tsv'), sep='\t', names=['subject', 'predicate', 'object']) \
+        if os.path.exists(os.path.join(folder, 'graph.tsv')) else None
+
+    users = np.sort(ratings.userId.unique())
+    items = np.sort(np.union1d(ratings.itemId.unique(), feature_map.itemId.unique()))
+    user_rows = pd.Series(np.arange(len(users)), index=users)
+    item_rows = pd.Series(np.arange(len(items)), index=items)
+    ratings = ratings.assign(user=user_rows[ratings.userId.values].values, item=item_rows[ratings.itemId.values].values)
+
+    i_train = {u: dict() for u in range(len(users))}
+    i_test = {u: set() for u in range(len(users))}
+    for u, i, test in zip(ratings.user.values.tolist(), ratings.item.values.tolist(),
+                          ratings.timestamp.values.tolist()):
+        if test:
+            i_test[u].add(i)
+        else:
+            i_train[u][i] = 1
+    return {'i_train': i_train, 'i_test': i_test, 'feature_map': feature_map, 'predicate_mapping': predicate_mapping,
+            'triples': triples, 'private_users': dict(enumerate(users.tolist())),
+            'private_items': dict(enumerate(items.tolist()))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='synthetic KGFlex dataset')
+    parser.add_argument('folder')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--entities', type=int, default=500)
+    parser.add_argument('--objects', type=int, default=5000)
+    parser.add_argument('--depth', type=int, default=2, choices=(1, 2, 3))
+    parser.add_argument('--item-exponent', type=float, default=0.8)
+    parser.add_argument('--feature-exponent', type=float, default=1.1)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    write(make_dataset(args.users, args.items, args.entities, args.objects, depth=args.depth,
+                       item_exponent=args.item_exponent, feature_exponent=args.feature_exponent, seed=args.seed),
+          args.folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import json
+import os
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# version of the checkpoint layout
+FORMAT = 1
+
+
+class Checkpoint:
+    """ class Checkpoint: KGFlex model saved as a folder of memory-mappable npy arrays and a json manifest """
+
+    def __init__(self, server_model, store, item_features_mask, model_features, clients, users=None, items=None):
+        """
+        :param server_model: server model
+        :param store: client store
+        :param item_features_mask: items x model features mask
+        :param model_features: (predicate, object) of each model feature
+        :param clients: private id of the client of each store row
+        :param users: public id of the client of each store row, for serving
+        :param items: public id of each item, for serving
+        """
+        self.server_model = server_model
+        self.store = store
+        self.item_features_mask = item_features_mask
+        self.model_features = model_features
+        self.clients = np.asarray(clients, dtype=np.int64)
+        self.users = users
+        self.items = items
+
+    def save_weights(self, path):
+        """
+        Write the checkpoint in the folder path, replacing a previous one.
+        :param path: checkpoint folder
+        """
+        os.makedirs(path, exist_ok=True)
+        mask = csr_matrix(self.item_features_mask)
+        # users folded in after training are not saved
+        n_slots = self.store.indptr[len(self.clients)]
+        arrays = {'feature_vecs': self.server_model.feature_vecs, 'feature_bias': self.server_model.feature_bias,
+                  'indptr': self.store.indptr[:len(self.clients) + 1], 'features': self.store.features[:n_slots],
+                  'weights': self.store.weights[:n_slots], 'vecs': self.store.vecs[:n_slots], 'clients': self.clients,
+                  'mask_indptr': mask.indptr, 'mask_indices': mask.indices, 'mask_data': mask.data}
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f'{name}.npy'), array)
+
+        manifest = {'format': FORMAT, 'embedding': self.store.embedding, 'mask_shape': list(mask.shape),
+                    'vocabulary': [list(f) for f in self.model_features]}
+        if self.users is not None:
+            manifest['users'] = np.asarray(self.users).tolist()
+        if self.items is not None:
+            manifest['items'] = np.asarray(self.items).tolist()
+        # the manifest is written last: a checkpoint with a manifest is complete
+        with open(os.path.join(path, 'manifest.json.tmp'), 'w') as file:
+            json.dump(manifest, file)
+        os.replace(os.path.join(path, 'manifest.json.tmp'), os.path.join(path, 'manifest.json'))
+
+    def load_weights(self, path):
+        """
+        Load the server model and the client embeddings of a checkpoint in place, so that every view and
+        shared copy of the current arrays sees them.
+        :param path: checkpoint folder
+        """
+        _, arrays = self.read(path)
+        n_slots = self.store.indptr[len(self.clients)]
+        if not np.array_equal(arrays['clients'], self.clients) or \
+                not np.array_equal(arrays['features'], self.store.features[:n_slots]):
+            raise ValueError(f'checkpoint {path} does not match the model features')
+        self.server_model.feature_vecs[:] = arrays['feature_vecs']
+        self.server_model.feature_bias[:] = arrays['feature_bias']
+        self.store.vecs[:n_slots] = arrays['vecs']
+
+    @staticmethod
+    def read(path, mmap_mode='r'):
+        """
+        Open a checkpoint.
+        :param path: checkpoint folder
+        :param mmap_mode: memory mapping of the arrays, None to read them in memory
+        :return: manifest, dict name: array
+        """
+        with open(os.path.join(path, 'manifest.json')) as file:
+            manifest = json.load(file)
+        if manifest['format'] != FORMAT:
+            raise ValueError(f'unsupported checkpoint format {manifest["format"]}')
+        arrays = {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+                  for name in os.listdir(path) if name.endswith('.npy')}
+        return manifest, arrays
+
+    @staticmethod
+    def mask(manifest, arrays):
+        """ item features mask of a checkpoint """
+        return csr_matrix((arrays['mask_data'], arrays['mask_indices'], arrays['mask_indptr']),
+                          shape=tuple(manifest['mask_shape']))
@@ -1,33 +1,33 @@
 import numpy as np
-from scipy.sparse import csr_matrix
-import time
 
 
 class Client:
     """ class Client: contains the client id, the relative training subset and Client model """
 
-    def __init__(self, user_id, model, user_data, user_features, model_features_mapping, upc,
-                 item_features_mask, random_seed=42):
+    def __init__(self, user_id, model, user_data, upc, item_features_mask, sampler, random_seed=42):
         np.random.seed(random_seed)
         self.user_id = user_id
 
-        self.pos_items = set(user_data)
-        self.neg_items = list(set(range(item_features_mask.shape[0])) - self.pos_items)
-        self.pos_items = list(self.pos_items)
+        self.pos_items = list(set(user_data))
         self.update_per_client = upc if upc else len(self.pos_items)
 
         self.model = model
-
-        index_mask = [True if f in user_features else False for f in model_features_mapping]
-        self.index_mask = csr_matrix(index_mask)
-        self.user_item_features_mask = self.index_mask.multiply(item_features_mask)
-
-        self.model.init_vec(user_features, model_features_mapping, index_mask)
+        self.item_features_mask = item_features_mask
+        self.sampler = sampler
+        # triples of the last training step, and how many of them had no common features with the client
+        self.samples = 0
+        self.skipped_samples = 0
+
+    def feature_scores(self, server_model):
+        """ weighted score of each client feature: weight * (<user_vec, feature_vec> + feature_bias) """
+        features = self.model.features
+        return self.model.user_weights * ((self.model.user_vecs * server_model.feature_vecs[features]).sum(axis=1) +
+                                          server_model.feature_bias[features])
 
     def predict(self, server_model, items_mapping_reverse, mask, max_k):
-        result = (self.model.user_weights.multiply(self.user_item_features_mask) * (
-                self.model.user_vecs.multiply(server_model.feature_vecs).sum(
-                    axis=1) + csr_matrix(server_model.feature_bias).T)).A1
+        weighted_features = np.zeros_like(server_model.feature_bias)
+        weighted_features[self.model.features] = self.feature_scores(server_model)
+        result = self.item_features_mask.dot(weighted_features)
 
         result[~mask] = -np.inf
 
@@ -38,45 +38,61 @@ class Client:
 
         return prediction
 
-    def train(self, lr, server_model):
+    def sample(self):
         positive_sampled = np.random.choice(self.pos_items, self.update_per_client)
-        negative_sampled = np.random.choice(self.neg_items, self.update_per_client)
-
-        weighted_features = (self.model.user_weights.multiply(
-            self.model.user_vecs.multiply(server_model.feature_vecs).sum(
-                axis=1).A1 + server_model.feature_bias).toarray()).reshape(-1)
-
-        x_p = weighted_features * self.user_item_features_mask[positive_sampled].T
-        x_n = weighted_features * self.user_item_features_mask[negative_sampled].T
-
-        # remove items with no prediction (no common features)
-        deleted = np.concatenate((np.where(x_p == 0)[0], np.where(x_n == 0)[0]))
-        x_p = np.delete(x_p, deleted)
-        x_n = np.delete(x_n, deleted)
-        positive_sampled = np.delete(positive_sampled, deleted)
-        negative_sampled = np.delete(negative_sampled, deleted)
-
-        if len(positive_sampled) > 0:
-            x_pn = np.subtract(x_p, x_n)
-            d_loss = (1 / (1 + np.exp(x_pn)))
+        negative_sampled = self.sampler.negative(np.full(self.update_per_client, self.model.row))
+        # no triple for a client which rated every item
+        kept = negative_sampled >= 0
+        return positive_sampled[kept], negative_sampled[kept]
+
+    def sample_entries(self, items):
+        """
+        Nonzero entries of the client item-features mask for the given items.
+        :param items: sampled items
+        :return: sample index, client feature index (position in the client features), mask value
+        """
+        features = self.model.features
+        rows = self.item_features_mask[items]
+        sample = np.repeat(np.arange(len(items)), np.diff(rows.indptr))
+        if len(features) == 0:
+            return sample[:0], sample[:0], rows.data[:0]
+        position = np.minimum(np.searchsorted(features, rows.indices), len(features) - 1)
+        hit = features[position] == rows.indices
+        return sample[hit], position[hit], rows.data[hit]
 
-            uv_ = self.model.user_vecs.A
-            fv_ = np.array(server_model.feature_vecs, order='K', copy=True)
-
-            pos_masked_weights = self.user_item_features_mask[positive_sampled].multiply(self.model.user_weights)
-            pos_d_loss_masked_weights = (d_loss * pos_masked_weights.A.T).T
-
-            neg_masked_weights = self.user_item_features_mask[negative_sampled].multiply(self.model.user_weights)
-            neg_d_loss_masked_weights = (- d_loss * neg_masked_weights.A.T).T
-
-            d_loss_masked_weights = pos_d_loss_masked_weights + neg_d_loss_masked_weights
-
-            self.model.user_vecs += csr_matrix(
-                lr * (np.sum(d_loss_masked_weights, axis=0)[:, None] * fv_))
-            feature_vecs_update = lr * (
-                         np.sum(d_loss_masked_weights, axis=0)[:, None] * uv_)
-            feature_bias_update = lr * (d_loss.dot(pos_masked_weights.A) - d_loss.dot(neg_masked_weights.A))
-
-            return feature_vecs_update, feature_bias_update
-
-        return 0, 0
+    def train(self, lr, server_model):
+        """
+        BPR step on the client sampled triples, computed only on the nonzero (sample, feature) entries.
+        :return: updated server features, feature vectors update and feature bias update of those features
+        """
+        positive_sampled, negative_sampled = self.sample()
+        n_samples = len(positive_sampled)
+        n_features = len(self.model.features)
+
+        weighted_features = self.feature_scores(server_model)
+
+        pos_sample, pos_feature, pos_value = self.sample_entries(positive_sampled)
+        neg_sample, neg_feature, neg_value = self.sample_entries(negative_sampled)
+        x_p = np.bincount(pos_sample, weights=pos_value * weighted_features[pos_feature], minlength=n_samples)
+        x_n = np.bincount(neg_sample, weights=neg_value * weighted_features[neg_feature], minlength=n_samples)
+
+        # items with no prediction (no common features) do not contribute
+        kept = (x_p != 0) & (x_n != 0)
+        self.samples, self.skipped_samples = n_samples, n_samples - int(kept.sum())
+        d_loss = np.zeros(n_samples, dtype=weighted_features.dtype)
+        d_loss[kept] = 1 / (1 + np.exp(x_p[kept] - x_n[kept]))
+
+        d_loss_weights = lr * self.model.user_weights * (
+                np.bincount(pos_feature, weights=d_loss[pos_sample] * pos_value, minlength=n_features) -
+                np.bincount(neg_feature, weights=d_loss[neg_sample] * neg_value, minlength=n_features)
+        ).astype(weighted_features.dtype)
+
+        touched = np.flatnonzero(d_loss_weights)
+        features = self.model.features[touched]
+        uv_ = np.array(self.model.user_vecs[touched], dtype=server_model.feature_vecs.dtype)
+
+        self.model.user_vecs[touched] += d_loss_weights[touched, None] * server_model.feature_vecs[features]
+        feature_vecs_update = d_loss_weights[touched, None] * uv_
+        feature_bias_update = d_loss_weights[touched]
+
+        return features, feature_vecs_update, feature_bias_update
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+class ClientStore:
+    """ class ClientStore: features, weights and embeddings of every client packed in contiguous arrays """
+
+    def __init__(self, indptr, features, weights, embedding, random_seed=42, dtype=np.float32):
+        """
+        :param indptr: indptr over the clients of their features
+        :param features: model feature ids of each client
+        :param weights: weight of each client feature
+        :param embedding: embedding size
+        :param random_seed: random seed
+        :param dtype: type of weights and embeddings
+        """
+        np.random.seed(random_seed)
+        self.embedding = embedding
+
+        # features of each client sorted by model feature id; the store owns its arrays, which are updated in place
+        # (a restored indptr is a read-only memory map of the checkpoint)
+        self.indptr = np.array(indptr, dtype=np.int64)
+        lengths = np.diff(self.indptr)
+        owner = np.repeat(np.arange(len(lengths)), lengths)
+        order = np.lexsort((features, owner))
+        self.features = np.asarray(features, dtype=np.int64)[order]
+        self.weights = np.asarray(weights, dtype=dtype)[order]
+
+        # every client draws its embeddings from the same seeded sequence, one row per feature
+        init = np.random.randn(lengths.max() if len(lengths) else 0, embedding) / 10
+        self.vecs = init[np.arange(self.indptr[-1]) - np.repeat(self.indptr[:-1], lengths)].astype(dtype)
+        # buffers with spare capacity of the appended clients
+        self.buffers = dict()
+        # number of changes of the clients, for the copies of the store kept by the client nodes
+        self.version = 0
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def slots(self, rows):
+        """
+        Positions in the packed arrays of the features of the given clients.
+        :param rows: store rows of the clients
+        :return: slot owner (position in rows) and slot position
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        lengths = self.indptr[rows + 1] - self.indptr[rows]
+        owner = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        return owner, np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(self.indptr[rows], lengths)
+
+    def extend(self, name, values):
+        """
+        Append values to one of the packed arrays.
+        :param name: indptr, features, weights or vecs
+        :param values: appended values
+        """
+        array, self.buffers[name] = extend(getattr(self, name), values, self.buffers.get(name))
+        setattr(self, name, array)
+
+    def append(self, features, weights, random_seed=42):
+        """
+        Add a client after the last one, with the embeddings drawn as the ones of the other clients.
+        :param features: model feature ids of the client
+        :param weights: weight of each client feature
+        :param random_seed: random seed of the construction of the store
+        :return: row of the client
+        """
+        order = np.argsort(features, kind='stable')
+        np.random.seed(random_seed)
+        vecs = np.random.randn(len(features), self.embedding) / 10
+
+        self.extend('features', np.asarray(features, dtype=np.int64)[order])
+        self.extend('weights', np.asarray(weights)[order])
+        self.extend('vecs', vecs)
+        self.extend('indptr', [self.indptr[-1] + len(features)])
+        self.version += 1
+        return len(self) - 1
+
+    def rewrite(self, row, features, weights, vecs):
+        """
+        Replace the features of a client, keeping its row: they are written in its slots when their number does
+        not change, otherwise the packed arrays are spliced and the slots of the following clients shift.
+        :param row: row of the client
+        :param features: sorted model feature ids of the client
+        :param weights: weight of each client feature
+        :param vecs: embeddings of each client feature
+        """
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        if stop - start == len(features):
+            self.features[start:stop] = features
+            self.weights[start:stop] = weights
+            self.vecs[start:stop] = vecs
+        else:
+            for name, values in (('features', features), ('weights', weights), ('vecs', vecs)):
+                array = getattr(self, name)
+                setattr(self, name, splice(array, start, stop, np.asarray(values, dtype=array.dtype)))
+                self.buffers.pop(name, None)
+            self.indptr[row + 1:] += len(features) - (stop - start)
+        self.version += 1
+
+
+def splice(array, start, stop, values):
+    """ copy of an array with array[start:stop] replaced by values """
+    return np.concatenate([array[:start], values, array[stop:]])
+
+
+def extend(array, values, buffer=None):
+    """
+    Append values to an array, in the spare capacity of its buffer when it has some: buffers grow
+    geometrically, so that n appends copy O(n) values overall.
+    :param array: array, the view returned by the previous extend if any
+    :param values: appended values
+    :param buffer: buffer returned by the previous extend, if any
+    :return: extended array (a view on the start of the buffer) and its buffer
+    """
+    size = len(array) + len(values)
+    # the array is still the view made by the last extend, it has not been replaced
+    if buffer is None or array.base is not buffer or len(buffer) < size:
+        buffer = np.empty((max(2 * size, 16),) + array.shape[1:], dtype=array.dtype)
+        buffer[:len(array)] = array
+    buffer[len(array):size] = values
+    return buffer[:size], buffer
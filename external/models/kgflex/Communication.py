@@ -0,0 +1,127 @@
+import numpy as np
+
+# bytes of a feature id in a payload
+ID_BYTES = 4
+
+
+class Communication:
+    """ class Communication: compression of the client uploads and count of the bytes exchanged in a round """
+
+    def __init__(self, embedding, top_k=-1, quantization='none', residual_vecs=None, residual_bias=None):
+        """
+        :param embedding: embedding size
+        :param top_k: number of features uploaded by each client, by decreasing update norm (-1: all)
+        :param quantization: 'none' or 'float16', type of the uploaded values
+        :param residual_vecs: (slots x embedding) residuals of the client uploads, None to disable error feedback
+        :param residual_bias: residuals of the client bias uploads
+        """
+        if quantization not in ('none', 'float16'):
+            raise ValueError(f'unknown quantization {quantization}')
+        self.embedding = embedding
+        self.top_k = top_k
+        self.quantization = quantization
+        self.residual_vecs = residual_vecs
+        self.residual_bias = residual_bias
+        self.upload_bytes = 0
+        self.download_bytes = 0
+
+    @property
+    def error_feedback(self):
+        return self.residual_vecs is not None
+
+    def resize(self, n_slots):
+        """ zero residuals for the slots added after the last call """
+        if self.error_feedback and len(self.residual_vecs) < n_slots:
+            added = n_slots - len(self.residual_vecs)
+            self.residual_vecs = np.concatenate([self.residual_vecs, np.zeros((added, self.embedding),
+                                                                              dtype=self.residual_vecs.dtype)])
+            self.residual_bias = np.concatenate([self.residual_bias, np.zeros(added, dtype=self.residual_bias.dtype)])
+
+    def remap(self, previous_indptr, previous_features, indptr, features):
+        """
+        Follow the clients of the store whose features changed: residuals are kept by (client, feature), the
+        features a client did not have start from zero.
+        :param previous_indptr: indptr of the store before the change
+        :param previous_features: features of the store before the change
+        :param indptr: indptr of the store
+        :param features: features of the store
+        """
+        if not self.error_feedback:
+            return
+        self.resize(len(previous_features))
+        n_features = int(max(previous_features.max(initial=0), features.max(initial=0))) + 1
+        previous_keys = np.repeat(np.arange(len(previous_indptr) - 1), np.diff(previous_indptr)) * n_features + \
+            previous_features
+        keys = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr)) * n_features + features
+        position = np.minimum(np.searchsorted(previous_keys, keys), max(len(previous_keys) - 1, 0))
+        hit = previous_keys[position] == keys if len(previous_keys) else np.zeros(len(keys), dtype=bool)
+        residual_vecs = np.zeros((len(keys), self.embedding), dtype=self.residual_vecs.dtype)
+        residual_bias = np.zeros(len(keys), dtype=self.residual_bias.dtype)
+        residual_vecs[hit] = self.residual_vecs[position[hit]]
+        residual_bias[hit] = self.residual_bias[position[hit]]
+        self.residual_vecs, self.residual_bias = residual_vecs, residual_bias
+
+    def download(self, n_features, itemsize):
+        """
+        Count the download of the server vectors and bias of the given number of client features.
+        :param n_features: number of downloaded features
+        :param itemsize: bytes of a server model value
+        """
+        self.download_bytes += n_features * (self.embedding + 1) * itemsize
+
+    def upload(self, slots, owner, vecs_update, bias_update):
+        """
+        Payload of the client updates: only nonzero features are sent, reduced to the top_k of each client and
+        quantized. With error feedback, what is not sent is kept and added to the next update of the same slot.
+        :param slots: store slot of each updated client feature
+        :param owner: owner of each slot, the top_k features are selected per owner
+        :param vecs_update: (slots x embedding) feature vectors update
+        :param bias_update: feature bias update
+        :return: mask of the sent slots, sent feature vectors update, sent feature bias update
+        """
+        if self.error_feedback:
+            vecs_update = vecs_update + self.residual_vecs[slots]
+            bias_update = bias_update + self.residual_bias[slots]
+
+        norm = np.sqrt((vecs_update ** 2).sum(axis=1) + bias_update ** 2)
+        sent = norm > 0
+        if self.top_k != -1 and len(norm):
+            # rank of each slot among the slots of the same owner, by decreasing norm
+            order = np.lexsort((-norm, owner))
+            group = np.r_[True, owner[order][1:] != owner[order][:-1]]
+            starts = np.flatnonzero(group)
+            rank = np.empty(len(order), dtype=np.int64)
+            rank[order] = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+            sent &= rank < self.top_k
+
+        sent_vecs, sent_bias = vecs_update[sent], bias_update[sent]
+        value_bytes = vecs_update.itemsize
+        if self.quantization == 'float16':
+            sent_vecs = sent_vecs.astype(np.float16).astype(vecs_update.dtype)
+            sent_bias = sent_bias.astype(np.float16).astype(bias_update.dtype)
+            value_bytes = 2
+
+        if self.error_feedback:
+            residual_vecs, residual_bias = vecs_update, bias_update
+            residual_vecs[sent] -= sent_vecs
+            residual_bias[sent] -= sent_bias
+            self.residual_vecs[slots] = residual_vecs
+            self.residual_bias[slots] = residual_bias
+
+        self.upload_bytes += int(sent.sum()) * (ID_BYTES + (self.embedding + 1) * value_bytes)
+        return sent, sent_vecs, sent_bias
+
+    def add(self, counters):
+        """ add the counters of another process """
+        self.upload_bytes += counters['upload_bytes']
+        self.download_bytes += counters['download_bytes']
+
+    def reset(self):
+        """
+        Counters of the round, set back to zero.
+        :return: dict upload_bytes, download_bytes
+        """
+        counters = {'upload_bytes': self.upload_bytes, 'download_bytes': self.download_bytes}
+        self.upload_bytes = 0
+        self.download_bytes = 0
+        return counters
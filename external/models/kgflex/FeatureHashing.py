@@ -0,0 +1,71 @@
+import hashlib
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+class FeatureHashing:
+    """
+    class FeatureHashing: signed hashing of the model features into a fixed number of server features (buckets).
+    An item has, in each bucket, the sum of the signs of its features hashed there, and a client has the sum of
+    the signed weights of its features: the contribution of a feature shared by a client and an item keeps its
+    sign, while the ones of colliding features cancel out on average.
+    """
+
+    def __init__(self, features, buckets, random_seed=42):
+        """
+        :param features: (predicate, object) tuple of each model feature
+        :param buckets: number of server features
+        :param random_seed: key of the hash function
+        """
+        self.buckets = buckets
+        key = str(random_seed).encode()
+        hashes = np.array([int.from_bytes(hashlib.blake2b(repr(tuple(f)).encode(), digest_size=8, key=key).digest(),
+                                          'little') for f in features], dtype=np.uint64)
+        self.bucket = (hashes % np.uint64(buckets)).astype(np.int64)
+        self.sign = np.where(hashes >> np.uint64(63), -1, 1).astype(np.int8)
+
+    def mask(self, item_features_mask):
+        """
+        :param item_features_mask: (items x model features) mask
+        :return: (items x buckets) csr matrix of signed sums, without the entries cancelled out
+        """
+        coo = csr_matrix(item_features_mask).tocoo()
+        mask = csr_matrix((self.sign[coo.col] * coo.data.astype(np.float64), (coo.row, self.bucket[coo.col])),
+                          shape=(coo.shape[0], self.buckets))
+        mask.eliminate_zeros()
+        return mask
+
+    def clients(self, indptr, features, weights):
+        """
+        Hash the features of the clients of a store, the weights of a client features in the same bucket are summed.
+        :return: indptr over the clients, buckets and signed weights, by increasing bucket for each client
+        """
+        owner = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+        keys, inverse = np.unique(owner * self.buckets + self.bucket[features], return_inverse=True)
+        hashed_weights = np.bincount(inverse, weights=self.sign[features] * np.asarray(weights, dtype=np.float64),
+                                     minlength=len(keys))
+        hashed_indptr = np.zeros(len(indptr), dtype=np.int64)
+        hashed_indptr[1:] = np.cumsum(np.bincount(keys // self.buckets, minlength=len(indptr) - 1))
+        return hashed_indptr, keys % self.buckets, hashed_weights
+
+    def encode(self, features):
+        """
+        Buckets and signed values of the model features of some items, for ItemStore.append.
+        :param features: list with the model feature ids of each item
+        :return: list with the buckets of each item, list with their values
+        """
+        buckets, values = [], []
+        for item_features in features:
+            item_features = np.asarray(item_features, dtype=np.int64)
+            item_buckets, inverse = np.unique(self.bucket[item_features], return_inverse=True)
+            item_values = np.bincount(inverse, weights=self.sign[item_features], minlength=len(item_buckets))
+            buckets.append(item_buckets[item_values != 0])
+            values.append(item_values[item_values != 0])
+        return buckets, values
+
+    def bucket_depth(self, feature_depth):
+        """ lowest order of the model features of each bucket, 0 for the empty buckets """
+        depth = np.full(self.buckets, np.iinfo(np.int64).max)
+        np.minimum.at(depth, self.bucket, np.asarray(feature_depth, dtype=np.int64))
+        depth[depth == np.iinfo(np.int64).max] = 0
+        return depth
@@ -0,0 +1,139 @@
+import numpy as np
+from scipy.sparse import csr_matrix, isspmatrix_csr
+
+
+class FeatureIndex:
+    """ class FeatureIndex: inverted index model feature -> items carrying it, used to prune the scored items """
+
+    def __init__(self, item_features_mask, dtype=np.float32):
+        # the matrix of an item store is read as it is, the items appended to it are indexed by refresh
+        self.item_features_mask = item_features_mask if isspmatrix_csr(item_features_mask) and \
+            item_features_mask.dtype == dtype else csr_matrix(item_features_mask, dtype=dtype)
+        self.index()
+
+    @property
+    def n_items(self):
+        return self.item_features_mask.shape[0]
+
+    def index(self):
+        """ postings of all the items, the tail index is emptied """
+        postings = self.item_features_mask.tocsc()
+        postings.sort_indices()
+        self.indptr = postings.indptr
+        self.items = postings.indices
+        self.values = postings.data
+        self.n_indexed = postings.shape[0]
+        # postings of the items appended after the last index, offset by n_indexed
+        self.tail = None
+        # extreme mask values of each feature, to bound the contribution of a feature to any item score
+        self.max_value = np.zeros(postings.shape[1], dtype=postings.dtype)
+        self.min_value = np.zeros(postings.shape[1], dtype=postings.dtype)
+        self.bounded = np.zeros(postings.shape[1], dtype=bool)
+        self.bound_values(postings)
+
+    def bound_values(self, postings):
+        """ extend the extreme mask values of each feature to the given postings """
+        non_empty = np.diff(postings.indptr) > 0
+        starts = postings.indptr[:-1][non_empty]
+        maximum = np.maximum.reduceat(postings.data, starts)
+        minimum = np.minimum.reduceat(postings.data, starts)
+        bounded = self.bounded[non_empty]
+        self.max_value[non_empty] = np.where(bounded, np.maximum(self.max_value[non_empty], maximum), maximum)
+        self.min_value[non_empty] = np.where(bounded, np.minimum(self.min_value[non_empty], minimum), minimum)
+        self.bounded |= non_empty
+
+    def refresh(self):
+        """
+        Index the items appended to the mask. Their postings go in a tail index, rebuilt at every refresh,
+        and main and tail index are merged once the tail holds more than a quarter of the postings.
+        """
+        n_indexed = self.n_indexed + (self.tail.shape[0] if self.tail is not None else 0)
+        if self.n_items == n_indexed:
+            return
+        rows = self.item_features_mask[self.n_indexed:]
+        if 4 * rows.nnz > len(self.items):
+            return self.index()
+        self.tail = rows.tocsc()
+        self.tail.sort_indices()
+        self.bound_values(self.tail)
+
+    def postings(self, features):
+        """
+        Items carrying at least one of the given features.
+        :param features: model feature ids
+        :return: sorted unique item ids
+        """
+        items = [self.items[self.positions(self.indptr, features)]]
+        if self.tail is not None:
+            items.append(self.tail.indices[self.positions(self.tail.indptr, features)] + self.n_indexed)
+        return np.unique(np.concatenate(items))
+
+    @staticmethod
+    def positions(indptr, features):
+        """ positions of the postings of the given features """
+        starts = indptr[features]
+        lengths = indptr[np.asarray(features) + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+
+    def score(self, items, features, feature_scores):
+        """
+        Exact scores of the given items for a user.
+        :param items: item ids
+        :param features: sorted model feature ids of the user
+        :param feature_scores: score of each user feature
+        :return: item scores
+        """
+        rows = self.item_features_mask[items]
+        sample = np.repeat(np.arange(len(items)), np.diff(rows.indptr))
+        position = np.minimum(np.searchsorted(features, rows.indices), len(features) - 1)
+        hit = features[position] == rows.indices
+        return np.bincount(sample[hit], weights=rows.data[hit] * feature_scores[position[hit]], minlength=len(items))
+
+    def top_k(self, features, feature_scores, mask, k):
+        """
+        Top-k items of a user, enumerating only the items reachable from the user features.
+        Features are visited by decreasing maximum contribution: once the k-th best exact score of the
+        reached items is not lower than the largest score an unreached item could get, the search stops.
+        :param features: sorted model feature ids of the user
+        :param feature_scores: score of each user feature
+        :param mask: boolean candidate mask over all the items
+        :param k: number of recommended items
+        :return: top-k items and their scores, by decreasing score
+        """
+        self.refresh()
+        k = min(k, self.n_items)
+        bound = np.maximum(np.maximum(feature_scores * self.max_value[features],
+                                      feature_scores * self.min_value[features]), 0)
+        order = np.argsort(-bound)
+        remaining_bound = np.append(np.cumsum(bound[order][::-1])[::-1], 0)
+
+        reached = np.zeros(0, dtype=np.int64)
+        scores = np.zeros(0)
+        cut = 0
+        while cut < len(order):
+            cut = min(max(2 * cut, 1), len(order))
+            reached = self.postings(features[order[:cut]])
+            reached = reached[mask[reached]]
+            scores = self.score(reached, features, feature_scores)
+            if len(reached) >= k:
+                top = np.argpartition(scores, -k)[-k:]
+                if scores[top].min() >= remaining_bound[cut]:
+                    return self.sort(reached[top], scores[top])
+
+        # every reachable item has been scored and too few of them are positive: the other items score zero
+        unreached = np.flatnonzero(mask)
+        unreached = unreached[~np.isin(unreached, reached, assume_unique=True)][:k]
+        reached = np.concatenate([reached, unreached])
+        scores = np.concatenate([scores, np.zeros(len(unreached))])
+        if len(reached) < k:
+            masked = np.flatnonzero(~mask)[:k - len(reached)]
+            reached = np.concatenate([reached, masked])
+            scores = np.concatenate([scores, np.full(len(masked), -np.inf)])
+        top = np.argpartition(scores, -k)[-k:]
+        return self.sort(reached[top], scores[top])
+
+    @staticmethod
+    def sort(items, scores):
+        order = np.argsort(scores)[::-1]
+        return items[order], scores[order]
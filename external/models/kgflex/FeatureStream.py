@@ -0,0 +1,197 @@
+from collections import Counter
+from itertools import chain
+import numpy as np
+
+from .UserFeatureMapper import UserFeatureMapper, rank_features
+
+
+class UserCounts:
+    """ class UserCounts: positive and negative feature counts of a user, and its selection at the last ranking """
+
+    def __init__(self):
+        self.items = set()
+        self.negatives = set()
+        self.positive = Counter()
+        self.negative = Counter()
+        # selected features by decreasing gain, lowest selected gain of each order, positives at the ranking
+        self.features = np.zeros(0, dtype=np.int64)
+        self.gains = np.zeros(0)
+        self.thresholds = np.zeros(0)
+        self.ranked_items = 0
+        self.dirty = True
+
+
+class FeatureStream:
+    """
+    class FeatureStream: feature selection of UserFeatureMapper kept up to date while interactions stream in.
+    A new interaction only updates the counts of the features of its item and of its sampled negative item;
+    the features of a user are ranked again, when asked for, only if the gain of some updated feature crossed
+    the selection threshold of its order or if the profile grew enough to shift all the gains.
+    """
+
+    def __init__(self, item_features, feature_depth, first_order_limit=-1, second_order_limit=-1, tolerance=0.0,
+                 drift=0.1, min_growth=10, random_seed=42):
+        """
+        :param item_features: (items x features) csr presence matrix
+        :param feature_depth: order of each feature
+        :param first_order_limit: number of first order features of each user (-1: all)
+        :param second_order_limit: number of second order features of each user (-1: all)
+        :param tolerance: margin of gain around the thresholds before a user is ranked again
+        :param drift: relative growth of the profile of a user after which it is ranked again
+        :param min_growth: positive items a user has to gain, at least, before it is ranked again for its growth
+        :param random_seed: random seed of the negative items
+        """
+        self.item_features = item_features
+        self.feature_depth = np.asarray(feature_depth, dtype=np.int64)
+        self.limits = (first_order_limit, second_order_limit)
+        self.tolerance = tolerance
+        self.drift = drift
+        self.min_growth = min_growth
+        self.random = np.random.RandomState(random_seed)
+        self.users = dict()
+        self.rankings = 0
+
+    def counts(self, user):
+        if user not in self.users:
+            self.users[user] = UserCounts()
+        return self.users[user]
+
+    def row(self, item):
+        """ features of an item """
+        return self.item_features.indices[self.item_features.indptr[item]:self.item_features.indptr[item + 1]]
+
+    def count(self, counter, item, sign):
+        """ add (sign 1) or remove (sign -1) the features of an item to the counts, as presence counts """
+        features = self.row(item).tolist()
+        if sign > 0:
+            counter.update(features)
+        else:
+            counter.subtract(features)
+            for f in features:
+                if counter[f] <= 0:
+                    del counter[f]
+        return features
+
+    def add(self, user, items):
+        """
+        Add positive interactions of a user, with a sampled negative item for each of them.
+        :param user: user id
+        :param items: positive items
+        :return: True if the features of the user have to be ranked again
+        """
+        counts = self.counts(user)
+        touched = self.count_items(counts, items)
+        if not counts.dirty and touched:
+            counts.dirty = self.crossed(counts, np.unique(np.fromiter(chain.from_iterable(touched), dtype=np.int64)))
+        return counts.dirty
+
+    def seed(self, user, items, features, gains):
+        """
+        Start the counts of a user from its items, taking its current features as its last ranking: it is ranked
+        again only when the interactions added afterwards call for it.
+        :param user: user id
+        :param items: positive items
+        :param features: current features of the user
+        :param gains: gain of each feature
+        """
+        counts = self.counts(user)
+        self.count_items(counts, items)
+        order = np.argsort(-np.asarray(gains), kind='stable')
+        self.select(counts, np.asarray(features, dtype=np.int64)[order], np.asarray(gains, dtype=np.float64)[order])
+
+    def count_items(self, counts, items):
+        """
+        Count the features of the new positive items of a user and of a sampled negative item for each of them.
+        :return: list with the features of each counted item
+        """
+        n_items = self.item_features.shape[0]
+        touched = []
+        for item in items:
+            if item in counts.items:
+                continue
+            counts.items.add(item)
+            touched.append(self.count(counts.positive, item, 1))
+            # a negative item which becomes positive is not a negative anymore
+            if item in counts.negatives:
+                counts.negatives.remove(item)
+                touched.append(self.count(counts.negative, item, -1))
+            if len(counts.items) < n_items:
+                negative = self.random.randint(n_items)
+                while negative in counts.items:
+                    negative = self.random.randint(n_items)
+                if negative not in counts.negatives:
+                    counts.negatives.add(negative)
+                    touched.append(self.count(counts.negative, negative, 1))
+        return touched
+
+    def crossed(self, counts, features):
+        """ whether the selection of a user may change after an update of the counts of the given features """
+        growth = len(counts.items) - counts.ranked_items
+        if growth >= self.min_growth and growth > self.drift * counts.ranked_items:
+            return True
+        gains = self.gains(counts, features)
+        threshold = counts.thresholds[self.feature_depth[features]]
+        selected = np.isin(features, counts.features)
+        # only the features of some positive item can enter the selection
+        candidate = ~selected & np.array([f in counts.positive for f in features.tolist()], dtype=bool)
+        return bool(np.any(candidate & (gains > threshold + self.tolerance)) or
+                    np.any(selected & (gains < threshold - self.tolerance)))
+
+    def gains(self, counts, features):
+        positive = np.array([counts.positive.get(f, 0) for f in features.tolist()], dtype=np.float64)
+        negative = np.array([counts.negative.get(f, 0) for f in features.tolist()], dtype=np.float64)
+        return UserFeatureMapper.features_entropy(positive, negative, np.full(len(features), len(counts.items)))
+
+    def rank(self, counts):
+        """ select the features of a user from its counts, as UserFeatureMapper.limited_second_order_selection """
+        features = np.fromiter(counts.positive.keys(), dtype=np.int64, count=len(counts.positive))
+        gains = self.gains(counts, features)
+        depth = self.feature_depth[features]
+        kept = (gains > 0) & (depth > 0)
+        _, features, gains = rank_features(np.zeros(kept.sum(), dtype=np.int64), features[kept], gains[kept],
+                                           self.feature_depth, 1, *self.limits)
+        self.select(counts, features, gains)
+        self.rankings += 1
+
+    def select(self, counts, features, gains):
+        """ take the given features, by decreasing gain, as the selection of a user at its current counts """
+        counts.features, counts.gains = features, gains
+        # lowest gain of each order which can still enter the selection
+        counts.thresholds = np.zeros(max(self.feature_depth.max(initial=0), 2) + 1)
+        for order in range(1, len(counts.thresholds)):
+            limit = self.limits[0] if order == 1 else self.limits[1]
+            selected = counts.gains[self.feature_depth[counts.features] == order]
+            if limit != -1 and len(selected) >= limit > 0:
+                counts.thresholds[order] = selected.min()
+            elif limit == 0:
+                counts.thresholds[order] = np.inf
+        counts.ranked_items = len(counts.items)
+        counts.dirty = False
+
+    def features(self, user):
+        """
+        Selected features of a user, ranked again only if needed.
+        :return: feature ids and gains, by decreasing gain
+        """
+        counts = self.counts(user)
+        if counts.dirty:
+            self.rank(counts)
+        return counts.features, counts.gains
+
+    def merge(self, other):
+        """
+        Add the interactions of the users of another stream over the same item features, e.g. on another shard:
+        the items and the negative items already counted here are not counted again.
+        """
+        for user, other_counts in other.users.items():
+            counts = self.counts(user)
+            for item in other_counts.items - counts.items:
+                counts.items.add(item)
+                self.count(counts.positive, item, 1)
+                if item in counts.negatives:
+                    counts.negatives.remove(item)
+                    self.count(counts.negative, item, -1)
+            for negative in other_counts.negatives - counts.negatives - counts.items:
+                counts.negatives.add(negative)
+                self.count(counts.negative, negative, 1)
+            counts.dirty = True
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+class ItemFeatures:
+    """ class ItemFeatures: integer-coded (predicate, object) features of the items, built in a single pass """
+
+    def __init__(self, feature_map: pd.DataFrame, private_items: dict):
+        """
+        :param feature_map: DataFrame with columns itemId (public id), predicate, object
+        :param private_items: dict private item id: public item id
+        """
+        self.n_items = len(private_items)
+        public_items = pd.Series(list(private_items.keys()), index=list(private_items.values()))
+
+        rows = feature_map[feature_map.itemId.isin(public_items.index)]
+        items = public_items[rows.itemId.values].values.astype(np.int64)
+        predicate_codes, self.predicates = pd.factorize(rows.predicate.values)
+        object_codes, self.objects = pd.factorize(rows.object.values)
+        n_objects = max(len(self.objects), 1)
+        pair_codes, pairs = pd.factorize(predicate_codes.astype(np.int64) * n_objects + object_codes)
+        self.feature_predicate = pairs // n_objects
+        self.feature_object = pairs % n_objects
+        self.n_features = len(pairs)
+
+        # item x feature matrix, every (item, feature) pair counted once
+        width = max(self.n_features, 1)
+        pair_keys = np.unique(items * width + pair_codes)
+        self.matrix = csr_matrix((np.ones(len(pair_keys), dtype=bool), (pair_keys // width, pair_keys % width)),
+                                 shape=(self.n_items, self.n_features))
+
+    @property
+    def features(self):
+        """ (predicate, object) tuple of each feature code """
+        return list(zip(self.predicates[self.feature_predicate].tolist(), self.objects[self.feature_object].tolist()))
+
+    def mask(self, model_codes):
+        """
+        Item x model feature mask.
+        :param model_codes: feature code of each model feature
+        :return: boolean (items x model features) csr matrix
+        """
+        code_to_model = np.full(self.n_features, -1, dtype=np.int64)
+        code_to_model[model_codes] = np.arange(len(model_codes))
+
+        coo = self.matrix.tocoo()
+        columns = code_to_model[coo.col]
+        kept = columns >= 0
+        return csr_matrix((coo.data[kept], (coo.row[kept], columns[kept])), shape=(self.n_items, len(model_codes)))
@@ -0,0 +1,54 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from .ClientStore import extend
+
+
+class ItemStore:
+    """ class ItemStore: append-only items x model features matrix, extended in place under its readers """
+
+    def __init__(self, item_features_mask, dtype=np.float32):
+        """
+        :param item_features_mask: items x model features mask
+        :param dtype: type of the mask values
+        """
+        self.matrix = csr_matrix(item_features_mask, dtype=dtype, copy=True)
+        self.matrix.sort_indices()
+        # buffers with spare capacity of the matrix arrays
+        self.buffers = dict()
+
+    @property
+    def n_items(self):
+        return self.matrix.shape[0]
+
+    def append(self, features, values=None):
+        """
+        Append items after the last one. The matrix stays the same object, so that the engines, the clients and
+        the feature index which read it see the new items: its data and indices are replaced by longer ones, then
+        it is resized and the indptr of the new rows is filled in.
+        :param features: list with the model feature ids of each new item
+        :param values: list with the mask value of each feature of each new item, ones if missing
+        :return: ids of the new items
+        """
+        matrix = self.matrix
+        n_features = matrix.shape[1]
+        owner = np.repeat(np.arange(len(features)), [len(f) for f in features])
+        indices = np.concatenate([np.asarray(f, dtype=np.int64) for f in features]) if len(features) else \
+            np.zeros(0, dtype=np.int64)
+        data = np.concatenate([np.asarray(v) for v in values]) if values is not None else np.ones(len(indices))
+        if len(indices) and (indices.min() < 0 or indices.max() >= n_features):
+            raise ValueError('item features must be model feature ids')
+
+        # sorted features of every item, each one counted once
+        keys, first = np.unique(owner * n_features + indices, return_index=True)
+        lengths = np.bincount(keys // n_features, minlength=len(features))
+        added = {'data': data[first].astype(matrix.dtype),
+                 'indices': (keys % n_features).astype(matrix.indices.dtype)}
+        start, nnz = self.n_items, matrix.indptr[-1]
+        for name, new in added.items():
+            array, self.buffers[name] = extend(getattr(matrix, name), new, self.buffers.get(name))
+            setattr(matrix, name, array)
+        # the new rows are added empty, after the last stored entry
+        matrix.resize((start + len(features), n_features))
+        matrix.indptr[start + 1:] = nnz + np.cumsum(lengths)
+        return np.arange(start, start + len(features))
@@ -1,7 +1,9 @@
 import numpy as np
-from scipy.sparse import csr_matrix
 from tqdm import tqdm
+import hashlib
 import math
+import os
+import time
 
 from old_elliot.recommender import BaseRecommenderModel
 from old_elliot.recommender.base_recommender_model import init_charger
@@ -9,8 +11,10 @@ from old_elliot.recommender.recommender_utils_mixin import RecMixin
 from old_elliot.utils.write import store_recommendation
 
 from .UserFeatureMapper import UserFeatureMapper
-from . import Client, ClientModel, Server, ServerModel
-from collections import defaultdict
+from .ItemFeatures import ItemFeatures
+from . import Client, ClientModel, ClientStore, Server, ServerModel, RoundEngine, ParallelRoundEngine, FeatureIndex, \
+    SocketRoundEngine, Sampler, Communication, Checkpoint, Profiler, ItemStore, FeatureStream, KnowledgeGraph, \
+    SketchFeatureMapper, FeatureHashing
 
 
 class KGFlex(RecMixin, BaseRecommenderModel):
@@ -30,61 +34,210 @@ class KGFlex(RecMixin, BaseRecommenderModel):
             ("_seed", "seed", "seed", 42, None, None)
         ]
         self.autoset_params()
+        # execution settings, not part of the model name
+        self._ufm_cache = getattr(self._params, "ufm_cache", True)
+        self._round_engine = getattr(self._params, "round_engine", "batch")
+        self._round_workers = int(getattr(self._params, "round_workers", 8))
+        self._protocol = getattr(self._params, "protocol", "sync")
+        self._async_buffer = int(getattr(self._params, "async_buffer", 16))
+        self._max_staleness = int(getattr(self._params, "max_staleness", 8))
+        self._upload_top_k = int(getattr(self._params, "upload_top_k", -1))
+        self._quantization = getattr(self._params, "quantization", "none")
+        self._error_feedback = getattr(self._params, "error_feedback", False)
+        self._predictor = getattr(self._params, "predictor", "block")
+        self._neg_sampling = getattr(self._params, "neg_sampling", "uniform")
+        self._dtype = getattr(self._params, "dtype", "float32")
+        self._kg_depth = int(getattr(self._params, "kg_depth", 2))
+        self._sketch_width = int(getattr(self._params, "sketch_width", 2 ** 14))
+        self._candidates = int(getattr(self._params, "candidates", 512))
+        self._hash_buckets = int(getattr(self._params, "hash_buckets", 0))
+        if self._kg_depth < 2:
+            raise ValueError(f'kg_depth {self._kg_depth} is below 2, the first and second order features of the items '
+                             'are always extracted; second_order_limit 0 leaves the second order ones out')
+        if self._protocol == "async" and self._round_engine == "sockets" and self._centralized != 1:
+            raise ValueError('the sockets round engine runs synchronous rounds only, '
+                             'use protocol sync or the batch, serial or parallel round engine')
         np.random.seed(self._seed)
+        # type of every model array and computation
+        self.dtype = np.dtype(self._dtype)
+        # time and memory of each phase, written next to the performance results
+        self.profiler = Profiler.Profiler()
 
         training_set = self._data.train_pd
         self.transactions = len(training_set)
 
-        # ------------------------------ ITEM FEATURES ------------------------------
-        print('importing items features')
+        # same path as the one set by init_charger, a restored model is read before training
+        self._saving_filepath = f'{self._config.path_output_rec_weight}{self.name}/best-weights-{self.name}'
 
-        self.item_features_mapper = {item: set(map(tuple,
-                                                   self._data.side_information_data.feature_map[
-                                                       self._data.side_information_data.feature_map.itemId ==
-                                                       self._data.private_items[item]]
-                                                   [['predicate', 'object']].values))
-                                     for item in self._data.private_items}
+        if self._restore:
+            # ------------------------------ RESTORED FEATURES ------------------------------
+            print(f'restoring model features from {self._saving_filepath}')
+            self.profiler.phase('restore features')
+
+            manifest, arrays = Checkpoint.Checkpoint.read(self._saving_filepath)
+            client_ids = arrays['clients'].tolist()
+            if set(client_ids) != set(self._data.i_train_dict.keys()):
+                raise ValueError(f'checkpoint {self._saving_filepath} does not match the training users')
+            model_features = [tuple(f) for f in manifest['vocabulary']]
+            self.item_features_mask = Checkpoint.Checkpoint.mask(manifest, arrays)
+            store_indptr, store_features, store_weights = arrays['indptr'], arrays['features'], arrays['weights']
+        elif self._kg_depth > 2:
+            # ------------------------------ KNOWLEDGE GRAPH FEATURES ------------------------------
+            print(f'knowledge graph of {self._kg_depth} hops')
+            self.profiler.phase('item features')
+
+            triples = getattr(self._data.side_information_data, 'graph', None)
+            if triples is None:
+                raise ValueError('kg_depth above 2 needs the graph triples in the side information')
+            self.knowledge_graph = KnowledgeGraph.KnowledgeGraph(self._data.side_information_data.feature_map,
+                                                                 self._data.side_information_data.predicate_mapping,
+                                                                 triples, self._data.private_items, self._kg_depth)
+
+            print('user features loading')
+            self.profiler.phase('user features')
+            self.user_feature_mapper = SketchFeatureMapper.SketchFeatureMapper(self._data.i_train_dict,
+                                                                               self.knowledge_graph, self._seed,
+                                                                               self._sketch_width, self._candidates)
+            client_ids = list(self._data.i_train_dict.keys())
+            self.user_feature_mapper.compute_and_export_features(client_ids, self._first_order_limit,
+                                                                 self._second_order_limit)
+
+            print('features mapping')
+            self.profiler.phase('features mapping')
+
+            # mapping features in columns, by order of appearance; only the model features are expanded in the mask
+            keys, first = np.unique(self.user_feature_mapper.features, return_index=True)
+            key_to_model = np.empty(len(keys), dtype=np.int64)
+            key_to_model[np.argsort(first)] = np.arange(len(keys))
+            model_keys = keys[np.argsort(first)]
+            model_features = self.knowledge_graph.features(model_keys)
+            self.item_features_mask = self.knowledge_graph.mask(model_keys)
+            store_indptr, store_features, store_weights = self.user_feature_mapper.indptr, \
+                key_to_model[np.searchsorted(keys, self.user_feature_mapper.features)], self.user_feature_mapper.gains
+        else:
+            # ------------------------------ ITEM FEATURES ------------------------------
+            print('importing items features')
+            self.profiler.phase('item features')
+
+            self.item_features = ItemFeatures(self._data.side_information_data.feature_map, self._data.private_items)
 
-        # ------------------------------ USER FEATURES ------------------------------
-        print('user features loading')
+            # ------------------------------ USER FEATURES ------------------------------
+            print('user features loading')
+            self.profiler.phase('user features')
 
-        self.user_feature_mapper = UserFeatureMapper(self._data.i_train_dict,
-                                                     self.item_features_mapper,
-                                                     self._data.side_information_data.predicate_mapping, self._seed)
-        client_ids = list(self._data.i_train_dict.keys())
-        self.user_feature_mapper.compute_and_export_features(client_ids, self._parallel_ufm, self._first_order_limit,
-                                                             self._second_order_limit)
+            self.user_feature_mapper = UserFeatureMapper(self._data.i_train_dict,
+                                                         self.item_features,
+                                                         self._data.side_information_data.predicate_mapping,
+                                                         self._seed)
+            client_ids = list(self._data.i_train_dict.keys())
+            # extractions are shared by the trials of the grid through the weights folder
+            cache_dir = os.path.join(self._config.path_output_rec_weight, 'ufm_cache') if self._ufm_cache else None
+            self.user_feature_mapper.compute_and_export_features(client_ids, self._parallel_ufm,
+                                                                 self._first_order_limit, self._second_order_limit,
+                                                                 cache_dir)
 
-        # ------------------------------ MODEL FEATURES ------------------------------
-        print('features mapping')
+            # ------------------------------ MODEL FEATURES ------------------------------
+            print('features mapping')
+            self.profiler.phase('features mapping')
 
-        # mapping features in columns
-        model_features_mapping = defaultdict(lambda: len(model_features_mapping))
-        for c in client_ids:
-            for feature in self.user_feature_mapper.client_features[c]:
-                _ = model_features_mapping[feature]
+            # mapping features in columns, by order of appearance
+            codes, first = np.unique(self.user_feature_mapper.features, return_index=True)
+            model_codes = codes[np.argsort(first)]
+            code_to_model = np.full(self.item_features.n_features, -1, dtype=np.int64)
+            code_to_model[model_codes] = np.arange(len(model_codes))
+            item_features = self.item_features.features
+            model_features = [item_features[code] for code in model_codes]
+            self.item_features_mask = self.item_features.mask(model_codes)
+            store_indptr, store_features, store_weights = self.user_feature_mapper.indptr, \
+                code_to_model[self.user_feature_mapper.features], self.user_feature_mapper.gains
+
+        self.model_features_mapping = {f: model_id for model_id, f in enumerate(model_features)}
+        # hashed mode: the server has hash_buckets features, whatever the number of model features
+        self.feature_hashing = FeatureHashing.FeatureHashing(model_features, self._hash_buckets, self._seed) \
+            if self._hash_buckets > 0 else None
+        if self.feature_hashing is not None and not self._restore:
+            self.item_features_mask = self.feature_hashing.mask(self.item_features_mask)
+            store_indptr, store_features, store_weights = self.feature_hashing.clients(store_indptr, store_features,
+                                                                                       store_weights)
+        # items can be appended later on, every component reads the same matrix of the item store
+        self.item_store = ItemStore.ItemStore(self.item_features_mask, self.dtype)
+        self.item_features_mask = self.item_store.matrix
+        # order of each model feature, for the selection of the features of folded in users; the predicate of
+        # a knowledge graph feature is its path, predicate uris joined by ~
+        predicate_order = self._data.side_information_data.predicate_mapping.set_index('predicate')[
+            'predicate_order'].to_dict()
+        self.feature_depth = np.array([predicate_order.get(p, str(p).count('~') + 1) for p, _ in model_features],
+                                      dtype=np.int64)
+        if self.feature_hashing is not None:
+            self.feature_depth = self.feature_hashing.bucket_depth(self.feature_depth)
 
         # total number of features (i.e. columns of the item matrix / latent factors)
-        print('FEATURES INFO: {} features found'.format(len(model_features_mapping)))
-        item_features_mask = []
-        for _, v in self.item_features_mapper.items():
-            common = set.intersection(set(model_features_mapping.keys()), set(v))
-            item_features_mask.append([True if f in common else False for f in model_features_mapping])
-        self.item_features_mask = csr_matrix(item_features_mask)
+        print('FEATURES INFO: {} features found'.format(len(self.model_features_mapping)))
+        if self.feature_hashing is not None:
+            print(f'FEATURES INFO: features hashed in {self._hash_buckets} buckets')
 
         # ------------------------------ INITIALIZING NODES ------------------------------
 
         print('initializing server')
-        self.server = Server.Server(self._lr,
-                                    ServerModel.ServerModel(model_features_mapping, self._embedding, self._seed))
+        self.profiler.phase('server initialization')
+        self.server_model = ServerModel.ServerModel(self.model_features_mapping if self.feature_hashing is None
+                                                    else range(self._hash_buckets), self._embedding, self._seed,
+                                                    self.dtype)
 
         print('creating clients')
+        self.profiler.phase('clients creation')
+        self.sampler = Sampler.Sampler([list(self._data.i_train_dict[c]) for c in client_ids],
+                                       self.item_features_mask.shape[0], self._neg_sampling)
+        self.client_store = ClientStore.ClientStore(store_indptr, store_features, store_weights, self._embedding,
+                                                    self._seed, self.dtype)
         self.clients = [
-            Client.Client(c, ClientModel.ClientModel(self._embedding),
-                          self._data.i_train_dict[c], self.user_feature_mapper.client_features[c],
-                          model_features_mapping, self._upc,
-                          self.item_features_mask, self._seed) for c in tqdm(client_ids)]
+            Client.Client(c, ClientModel.ClientModel(self.client_store, row),
+                          self._data.i_train_dict[c], self._upc,
+                          self.item_features_mask, self.sampler, self._seed) for row, c in enumerate(tqdm(client_ids))]
+
+        # client uploads are compressed and counted in federated training only
+        self.communication = None
+        if self._centralized != 1:
+            n_slots = len(self.client_store.features)
+            residuals = (np.zeros((n_slots, self._embedding), dtype=self.dtype), np.zeros(n_slots, dtype=self.dtype)) \
+                if self._error_feedback else (None, None)
+            self.communication = Communication.Communication(self._embedding, self._upload_top_k, self._quantization,
+                                                             *residuals)
+
+        # a restored model goes straight to prediction, without workers
+        if self._round_engine == "parallel" and not self._restore:
+            self.round_engine = ParallelRoundEngine.ParallelRoundEngine(self.item_features_mask, self.client_store,
+                                                                        self.server_model, self._round_workers,
+                                                                        self.communication)
+        elif self._round_engine == "sockets" and self._centralized != 1 and not self._restore:
+            # server in this process, round_workers client nodes talking to it through local sockets
+            self.round_engine = SocketRoundEngine.SocketRoundEngine(self.item_features_mask, self.client_store,
+                                                                    self.server_model, self.sampler, self._upc,
+                                                                    self._round_workers, self.communication,
+                                                                    self._seed)
+        else:
+            self.round_engine = RoundEngine.RoundEngine(self.item_features_mask, self.client_store,
+                                                        self.communication, self.dtype)
 
+        self.server = Server.Server(self._lr, self.server_model, self.round_engine,
+                                    FeatureIndex.FeatureIndex(self.item_features_mask, self.dtype)
+                                    if self._predictor == "index" else None,
+                                    self.sampler)
+
+        # saved and restored by RecMixin through save_weights / load_weights
+        public_users = [self._data.private_users[c] for c in client_ids]
+        public_items = [self._data.private_items[i] for i in range(self.item_features_mask.shape[0])]
+        self._model = Checkpoint.Checkpoint(self.server_model, self.client_store, self.item_features_mask,
+                                            model_features, client_ids, public_users, public_items)
+        # users added after training, by public id
+        self.folded_clients = dict()
+        self.client_positions = {c: position for position, c in enumerate(client_ids)}
+        # feature counts of the users with streamed interactions, built on the first ones
+        self.feature_stream = None
+        # users whose features have to be selected again, with their local training steps
+        self.stale_users = dict()
+
+        self.profiler.stop()
         print(f"\nINFO: clients created\n")
 
     @property
@@ -98,22 +251,205 @@ class KGFlex(RecMixin, BaseRecommenderModel):
             return self.restore_weights()
 
         for it in range(self._epochs):
+            self.refresh_users()
+            self.profiler.phase('training', epoch=it)
             if self._centralized == 1:
                 print("centralized training")
                 self.server.centralized_training(self.transactions, self.clients, self._batch_size)
+                self.profiler.annotate(**self.round_engine.counters())
             else:
                 selected_clients = list(
                     np.random.choice(self.clients, math.ceil(self._q * len(self.clients)), replace=False))
-                self.server.train_model(selected_clients)
+                if self._protocol == "async":
+                    self.server.train_model_async(selected_clients, self._async_buffer, self._max_staleness,
+                                                  self._round_workers)
+                elif self._round_engine == "serial":
+                    self.server.train_model(selected_clients)
+                else:
+                    self.server.train_model_batch(selected_clients)
+            self.profiler.phase('evaluation', epoch=it)
             self.evaluate(it)
 
+        self.round_engine.close()
+        self.export_profile(self.server.round_stats)
+
+    def restore_weights(self):
+        try:
+            self.profiler.phase('restore weights')
+            self._model.load_weights(self._saving_filepath)
+            print(f"Model correctly Restored")
+
+            self.profiler.phase('evaluation')
+            recs = self.get_recommendations(self.evaluator.get_needed_recommendations())
+            self._results.append(self.evaluator.eval(recs))
+            self.export_profile()
+
+            print("******************************************")
+            if self._save_recs:
+                store_recommendation(recs[1], self._config.path_output_rec_result + f"{self.name}.tsv")
+            return True
+
+        except Exception as ex:
+            raise Exception(f"Error in model restoring operation! {ex}")
+
+    def export_profile(self, rounds=()):
+        """
+        Write the profile of the run in the performance folder. Model names can exceed the file name limit,
+        so the files are named by a digest of the name, which is written in the report.
+        :param rounds: statistics of the federated rounds
+        """
+        digest = hashlib.sha1(self.name.encode()).hexdigest()[:12]
+        try:
+            self.profiler.export(os.path.join(self._config.path_output_rec_performance, f'profile_{digest}'), rounds,
+                                 self.name)
+        except OSError as ex:
+            print(f'profile not written: {ex}')
+
+    def fold_in(self, user, items, steps=10):
+        """
+        Make a new user servable without running the pipeline again: its features are selected among the
+        model features of its items and its embeddings are trained against the frozen server model.
+        Folded in users are served by recommend and do not take part in the federated rounds.
+        :param user: public id of the new user, the new items of a known user are streamed by add_interactions
+        :param items: public ids of the items of the user, unknown items are ignored
+        :param steps: local training steps
+        :return: dict user, features, items and milliseconds of the fold-in
+        """
+        if user in self._data.public_users or user in self.folded_clients:
+            raise ValueError(f'user {user} is already served by the model, its items are added by add_interactions')
+        start = time.time()
+        self.round_engine.collect()
+        private_items = [self._data.public_items[i] for i in items if i in self._data.public_items]
+        row = self.server.fold_in(private_items, self.feature_depth, self._first_order_limit,
+                                  self._second_order_limit, steps, self._seed)
+        self.folded_clients[user] = Client.Client(user, ClientModel.ClientModel(self.client_store, row),
+                                                  private_items, self._upc, self.item_features_mask, self.sampler,
+                                                  self._seed)
+        stats = {'user': user, 'features': len(self.folded_clients[user].model.features),
+                 'items': len(private_items), 'milliseconds': (time.time() - start) * 1000}
+        print(f'fold-in of user {user}: {stats["features"]} features from {stats["items"]} items '
+              f'in {stats["milliseconds"]:.1f} ms')
+        return stats
+
+    def client(self, user):
+        """ client of a trained or folded in user, by public id """
+        if user in self.folded_clients:
+            return self.folded_clients[user]
+        return self.clients[self.client_positions[self._data.public_users[user]]]
+
+    def add_interactions(self, user, items, steps=10):
+        """
+        Keep the features of a user up to date with its new interactions, without extracting them again:
+        only the counts of the features of the new items are updated, and the user is marked for a new selection,
+        among the model features, when the information gain of some of them crosses the selection threshold.
+        The selection is made by refresh_users, when the user is served or trained next, so that the interactions
+        streamed in the meantime are selected once. The new items are never drawn as negatives of the user.
+        :param user: public id of a trained or folded in user
+        :param items: public ids of the new items of the user, unknown items are ignored
+        :param steps: local training steps of the user if its features change
+        :return: dict user, items, features, pending (whether the features will be selected again) and
+            milliseconds of the update
+        """
+        start = time.time()
+        self.round_engine.collect()
+        client = self.client(user)
+        if self.feature_stream is None:
+            self.feature_stream = FeatureStream.FeatureStream(self.item_features_mask, self.feature_depth,
+                                                              self._first_order_limit, self._second_order_limit,
+                                                              random_seed=self._seed)
+        if user not in self.feature_stream.users:
+            # the current features of the user are its last ranking
+            self.feature_stream.seed(user, client.pos_items, client.model.features, client.model.user_weights)
+
+        private_items = [self._data.public_items[i] for i in items if i in self._data.public_items]
+        client.pos_items = list(set(client.pos_items).union(private_items))
+        self.sampler.add(client.model.row, private_items)
+        if self.feature_stream.add(user, private_items):
+            self.stale_users[user] = steps
+
+        return {'user': user, 'items': len(private_items), 'features': len(client.model.features),
+                'pending': user in self.stale_users, 'milliseconds': (time.time() - start) * 1000}
+
+    def refresh_users(self, users=None):
+        """
+        Select again the features of the users marked by add_interactions and rewrite them in the client store.
+        :param users: public ids of the users to refresh, None for all the marked ones
+        :return: number of users whose features changed
+        """
+        users = list(self.stale_users) if users is None else [u for u in users if u in self.stale_users]
+        if not users:
+            return 0
+        self.round_engine.collect()
+        changed = 0
+        for user in users:
+            client = self.client(user)
+            features, gains = self.feature_stream.features(user)
+            changed += self.server.refresh(client.model.row, client.pos_items, features, gains,
+                                           self.stale_users.pop(user), self._seed)
+        return changed
+
+    def recommend(self, user, k=10):
+        """
+        Top-k of a trained or folded in user among the items it has not rated.
+        :param user: public id of the user
+        :param k: number of items
+        :return: list of (public item id, score)
+        """
+        self.refresh_users([user])
+        client = self.client(user)
+        mask = np.ones(self.item_features_mask.shape[0], dtype=bool)
+        mask[client.pos_items] = False
+        return client.predict(self.server_model, self._data.private_items, mask, min(k, int(mask.sum())))
+
+    def add_items(self, items):
+        """
+        Append new items to the catalog, scored for every user right away without rebuilding clients or masks:
+        their features are encoded against the model features and appended to the item store, which the
+        engine, the clients and the feature index read. Features out of the model vocabulary are ignored,
+        and training negatives are still drawn among the items the model has been built with.
+        In hashed mode the features are appended as their signed buckets.
+        :param items: dict public item id: iterable of (predicate, object) features
+        :return: dict items, encoded features, ignored features and milliseconds of the ingestion
+        """
+        start = time.time()
+        known = [i for i in items if i in self._data.public_items]
+        if known:
+            raise ValueError(f'items already in the catalog: {known[:10]}')
+
+        features = [[self.model_features_mapping.get(tuple(f), -1) for f in item_features]
+                    for item_features in items.values()]
+        encoded = [[f for f in item_features if f >= 0] for item_features in features]
+        if self.feature_hashing is None:
+            private_ids = self.item_store.append(encoded)
+        else:
+            private_ids = self.item_store.append(*self.feature_hashing.encode(encoded))
+        for private, public in zip(private_ids.tolist(), items):
+            self._data.private_items[private] = public
+            self._data.public_items[public] = private
+        self._model.items = list(self._model.items) + list(items)
+
+        stats = {'items': len(items), 'features': sum(len(f) for f in encoded),
+                 'ignored_features': sum(len(f) for f in features) - sum(len(f) for f in encoded),
+                 'milliseconds': (time.time() - start) * 1000}
+        print(f'{stats["items"]} items added with {stats["features"]} features '
+              f'({stats["ignored_features"]} unknown features ignored) in {stats["milliseconds"]:.1f} ms')
+        return stats
+
+    def candidate_mask(self, validation=False):
+        """ Elliot candidate mask, with the items added after the data loading as candidates of every user """
+        mask = self.get_candidate_mask(validation=validation)
+        added = self.item_features_mask.shape[0] - mask.shape[1]
+        return np.hstack([mask, np.ones((mask.shape[0], added), dtype=bool)]) if added > 0 else mask
+
     def get_recommendations(self, k: int = 100):
+        self.refresh_users()
+        self.round_engine.collect()
         if not self._negative_sampling:
             return {}, self.server.predict(self.clients, self._data.private_users, self._data.private_items,
-                                           mask=self.get_candidate_mask(), max_k=k)
+                                           mask=self.candidate_mask(), max_k=k)
         else:
             return self.server.predict(self.clients, self._data.private_users, self._data.private_items,
-                                       mask=self.get_candidate_mask(validation=True), max_k=k) if hasattr(self._data,
-                                                                                                          "val_dict") else {}, \
+                                       mask=self.candidate_mask(validation=True), max_k=k) if hasattr(self._data,
+                                                                                                      "val_dict") else {}, \
                    self.server.predict(self.clients, self._data.private_users, self._data.private_items,
-                                       mask=self.get_candidate_mask(), max_k=k)
+                                       mask=self.candidate_mask(), max_k=k)
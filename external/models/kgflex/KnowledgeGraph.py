@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+class KnowledgeGraph:
+    """
+    class KnowledgeGraph: integer-coded adjacency of the items and of the entities of a knowledge graph.
+    Multi-hop (predicate path, object) features of the items are expanded on the fly, a block of items at a
+    time, and never materialized for the whole catalog. A feature is an int64 key: path code * n_nodes + node,
+    where the path code of predicates p1 ... pd is (...((p1 + 1) * P + p2 + 1) * P ...) + pd.
+    """
+
+    def __init__(self, feature_map: pd.DataFrame, predicate_mapping: pd.DataFrame, triples: pd.DataFrame,
+                 private_items: dict, depth=3):
+        """
+        :param feature_map: DataFrame with columns itemId (public id), predicate, object; its first order
+            rows are the first hop of the items
+        :param predicate_mapping: DataFrame with columns uri, predicate, predicate_order
+        :param triples: DataFrame with columns subject, predicate (uri), object: the further hops
+        :param private_items: dict private item id: public item id
+        :param depth: maximum number of hops of a feature
+        """
+        self.n_items = len(private_items)
+        self.depth = depth
+        public_items = pd.Series(list(private_items.keys()), index=list(private_items.values()))
+        order = predicate_mapping.set_index('predicate')['predicate_order']
+        uri = predicate_mapping.set_index('predicate')['uri']
+
+        first_hop = feature_map[feature_map.itemId.isin(public_items.index) &
+                                (feature_map.predicate.map(order).values == 1)]
+        # predicates and nodes of the first hop and of the triples share the same codes
+        predicate_codes, self.predicates = pd.factorize(np.concatenate([uri[first_hop.predicate.values].values,
+                                                                        triples.predicate.values.astype(str)]))
+        node_codes, self.nodes = pd.factorize(np.concatenate([first_hop.object.values.astype(str),
+                                                              triples.subject.values.astype(str),
+                                                              triples.object.values.astype(str)]))
+        self.n_predicates = max(len(self.predicates), 1)
+        self.n_nodes = max(len(self.nodes), 1)
+        if (self.n_predicates + 1) ** depth * self.n_nodes >= 2 ** 63:
+            raise ValueError(f'{depth} hops over {self.n_predicates} predicates and {self.n_nodes} nodes '
+                             f'do not fit int64 feature keys')
+
+        n_first = len(first_hop)
+        items = public_items[first_hop.itemId.values].values.astype(np.int64)
+        self.item_indptr, self.item_predicates, self.item_nodes = self.adjacency(
+            items, predicate_codes[:n_first], node_codes[:n_first], self.n_items)
+        n_triples = len(triples)
+        self.node_indptr, self.node_predicates, self.node_nodes = self.adjacency(
+            node_codes[n_first:n_first + n_triples], predicate_codes[n_first:],
+            node_codes[n_first + n_triples:], self.n_nodes)
+
+    @staticmethod
+    def adjacency(sources, predicates, targets, n_sources):
+        """
+        csr adjacency, every (source, predicate, target) edge counted once.
+        :return: indptr over the sources, predicate and target of each edge
+        """
+        edges = pd.DataFrame({'s': sources, 'p': predicates, 't': targets}).drop_duplicates().sort_values(['s'],
+                                                                                                         kind='stable')
+        indptr = np.zeros(n_sources + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(edges.s.values, minlength=n_sources))
+        return indptr, edges.p.values.astype(np.int64), edges.t.values.astype(np.int64)
+
+    @staticmethod
+    def gather(indptr, sources):
+        """ edge positions of the given sources and the position in sources of each edge """
+        lengths = indptr[sources + 1] - indptr[sources]
+        offsets = np.cumsum(lengths) - lengths
+        return np.repeat(np.arange(len(sources)), lengths), \
+            np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(indptr[sources], lengths)
+
+    def expand(self, items, depth=None):
+        """
+        Features of a block of items up to depth hops, each one counted once per item.
+        :param items: private item ids
+        :param depth: number of hops, the one of the graph if missing
+        :return: owner (position in items) and key of each (item, feature) pair, sorted by owner and key
+        """
+        items = np.asarray(items, dtype=np.int64)
+        owner, edges = self.gather(self.item_indptr, items)
+        paths, nodes = self.item_predicates[edges], self.item_nodes[edges]
+        owners, keys = [owner], [paths * self.n_nodes + nodes]
+        for _ in range(1, depth or self.depth):
+            source, edges = self.gather(self.node_indptr, nodes)
+            owner = owner[source]
+            paths = (paths[source] + 1) * self.n_predicates + self.node_predicates[edges]
+            nodes = self.node_nodes[edges]
+            owners.append(owner)
+            keys.append(paths * self.n_nodes + nodes)
+
+        owner, keys = np.concatenate(owners), np.concatenate(keys)
+        order = np.lexsort((keys, owner))
+        owner, keys = owner[order], keys[order]
+        first = np.r_[True, (owner[1:] != owner[:-1]) | (keys[1:] != keys[:-1])] if len(keys) else owner.astype(bool)
+        return owner[first], keys[first]
+
+    def paths(self, keys):
+        """ predicate codes of the path of each key, first hop first """
+        codes = np.asarray(keys, dtype=np.int64) // self.n_nodes
+        paths = [[] for _ in range(len(codes))]
+        for position, code in enumerate(codes.tolist()):
+            while True:
+                paths[position].insert(0, code % self.n_predicates)
+                code = code // self.n_predicates - 1
+                if code < 0:
+                    break
+        return paths
+
+    def feature_depth(self, keys):
+        """ number of hops of each key """
+        return np.array([len(p) for p in self.paths(keys)], dtype=np.int64)
+
+    def features(self, keys):
+        """ (predicate path, object) tuple of each key, predicate uris of a path joined by ~ """
+        nodes = (np.asarray(keys, dtype=np.int64) % self.n_nodes).tolist()
+        return [('~'.join(self.predicates[path]), self.nodes[node]) for path, node in zip(self.paths(keys), nodes)]
+
+    def mask(self, keys, block_size=1024):
+        """
+        Item x model feature mask, expanding the items a block at a time.
+        :param keys: key of each model feature
+        :param block_size: number of items expanded together
+        :return: boolean (items x model features) csr matrix
+        """
+        keys = np.asarray(keys, dtype=np.int64)
+        order = np.argsort(keys)
+        sorted_keys = keys[order]
+        rows, columns = [], []
+        for start in range(0, self.n_items, block_size):
+            owner, item_keys = self.expand(np.arange(start, min(start + block_size, self.n_items)))
+            position = np.minimum(np.searchsorted(sorted_keys, item_keys), max(len(keys) - 1, 0))
+            hit = sorted_keys[position] == item_keys if len(keys) else np.zeros(len(item_keys), dtype=bool)
+            rows.append(start + owner[hit])
+            columns.append(order[position[hit]])
+        rows, columns = np.concatenate(rows), np.concatenate(columns)
+        return csr_matrix((np.ones(len(rows), dtype=bool), (rows, columns)), shape=(self.n_items, len(keys)))
@@ -0,0 +1,205 @@
+import time
+import numpy as np
+from queue import Queue
+from multiprocessing import Pool
+from types import SimpleNamespace
+from scipy.sparse import csr_matrix
+
+from .RoundEngine import RoundEngine
+from .Communication import Communication
+from .SharedMemory import share, attach, balanced_chunks
+
+
+class ParallelRoundEngine(RoundEngine):
+    """ class ParallelRoundEngine: trains the clients of a federated round in shards, on a pool of processes """
+
+    def __init__(self, item_features_mask, store, server_model, workers, communication=None):
+        """
+        Server model and client embeddings are moved to shared memory: the workers read the server model of
+        the current round and update the embeddings of their clients in place.
+        :param item_features_mask: items x model features mask
+        :param store: client store
+        :param server_model: server model
+        :param workers: number of processes
+        :param communication: upload compression and byte counters, the residuals of the uploads are shared too
+        """
+        super().__init__(item_features_mask, store, communication, server_model.feature_vecs.dtype)
+        self.workers = workers
+        self.shared = {'feature_vecs': share(server_model.feature_vecs),
+                       'feature_bias': share(server_model.feature_bias)}
+        arrays = attach(self.shared)
+        server_model.feature_vecs, server_model.feature_bias = arrays['feature_vecs'], arrays['feature_bias']
+
+        self.pool = None
+        # arrays read by the workers, as they are in this process
+        self.attached = dict()
+        self.attach()
+        # updates of the submitted groups, in order of completion
+        self.completed = Queue()
+
+    def current(self):
+        """ arrays of the item features, of the store and of the upload residuals, as they are now """
+        mask = self.item_features_mask
+        arrays = {'mask_data': mask.data, 'mask_indices': mask.indices, 'mask_indptr': mask.indptr,
+                  'features': self.store.features, 'weights': self.store.weights, 'vecs': self.store.vecs}
+        if self.communication is not None and self.communication.error_feedback:
+            arrays['residual_vecs'] = self.communication.residual_vecs
+            arrays['residual_bias'] = self.communication.residual_bias
+        return arrays
+
+    def attach(self):
+        """
+        Move item features, store and upload residuals to shared memory, next to the server model, and start the
+        workers on them. The store and the residuals are replaced by their shared views.
+        """
+        if self.pool is not None:
+            self.close()
+        shared = dict(self.shared, **{name: share(array) for name, array in self.current().items()})
+        arrays = attach(shared)
+        store, communication = self.store, self.communication
+        store.features, store.weights, store.vecs = arrays['features'], arrays['weights'], arrays['vecs']
+        settings = None
+        if communication is not None:
+            settings = (communication.embedding, communication.top_k, communication.quantization)
+            if communication.error_feedback:
+                communication.residual_vecs = arrays['residual_vecs']
+                communication.residual_bias = arrays['residual_bias']
+        self.attached = self.current()
+        self.pool = Pool(self.workers, initializer=attach_worker,
+                         initargs=(shared, self.item_features_mask.shape, settings))
+
+    def sync(self):
+        """ start the workers again on the arrays replaced since the last round, e.g. by clients appended """
+        super().sync()
+        if any(array is not self.attached.get(name) for name, array in self.current().items()):
+            self.attach()
+
+    def train_clients(self, lr, server_model, clients):
+        """
+        Sample the training triples of every client, then train contiguous shards of clients in parallel.
+        The workers read the shared server model, which is expected to be the one given at construction.
+        :param lr: learning rate
+        :param server_model: server model
+        :param clients: selected clients
+        :return: server feature vectors update, server feature bias update
+        """
+        self.sync()
+        sample_owner, positive, negative = self.sample(clients)
+        n_samples = np.bincount(sample_owner, minlength=len(clients))
+        sample_bounds = np.r_[0, np.cumsum(n_samples)]
+
+        rows = np.array([c.model.row for c in clients], dtype=np.int64)
+        lengths = self.store.indptr[rows + 1] - self.store.indptr[rows]
+        bounds = balanced_chunks(lengths + n_samples, self.workers)
+
+        tasks = []
+        for shard, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+            owner, slots = self.store.slots(rows[start:stop])
+            self.download(len(slots), server_model)
+            tasks.append((stop - start, lr, owner, slots,
+                          np.repeat(np.arange(stop - start), n_samples[start:stop]),
+                          positive[sample_bounds[start]:sample_bounds[stop]],
+                          negative[sample_bounds[start]:sample_bounds[stop]]))
+        # each shard returns the update of the features of its clients only, summed here in a single buffer
+        feature_vecs_update = np.zeros_like(server_model.feature_vecs)
+        feature_bias_update = np.zeros_like(server_model.feature_bias)
+        for (n_clients, *_), (features, vecs_update, bias_update, worker_counters) in \
+                zip(tasks, self.pool.imap(train_shard, tasks)):
+            feature_vecs_update[features] += vecs_update
+            feature_bias_update[features] += bias_update
+            self.add(worker_counters, n_clients)
+
+        return feature_vecs_update, feature_bias_update
+
+    def submit(self, lr, server_model, clients):
+        """
+        Start the training of a group of clients on a worker.
+        The worker reads the shared server model while the server keeps applying the updates of other groups.
+        :param lr: learning rate
+        :param server_model: server model
+        :param clients: clients of the group
+        :return: handle of the update
+        """
+        self.sync()
+        owner, slots = self.gather(clients)
+        self.download(len(slots), server_model)
+        handle = self.submitted
+        self.submitted += 1
+        self.pool.apply_async(train_group, ((handle, len(clients), lr, owner, slots) + self.sample(clients),),
+                              callback=self.completed.put, error_callback=self.completed.put)
+        return handle
+
+    def wait(self):
+        """
+        Next completed update, in order of completion.
+        :return: handle, updated features, their vectors update and their bias update
+        """
+        result = self.completed.get()
+        if isinstance(result, BaseException):
+            raise result
+        self.add(*result[-2:])
+        return result[:-2]
+
+    def add(self, counters, n_clients):
+        """ add the upload, sample and time counters of a worker task on n_clients clients """
+        uploaded, samples, skipped_samples, seconds = counters
+        if self.communication is not None:
+            self.communication.add(uploaded)
+        self.record(seconds, n_clients, samples, skipped_samples)
+
+    def close(self):
+        """ release the resources of the engine """
+        self.pool.close()
+        self.pool.join()
+
+
+_worker = dict()
+
+
+def attach_worker(shared, shape, settings):
+    """ pool initializer: model, embeddings and item features are read from the shared memory blocks """
+    arrays = attach(shared)
+    _worker.update(arrays)
+    communication = None
+    if settings is not None:
+        communication = Communication(*settings, residual_vecs=arrays.get('residual_vecs'),
+                                      residual_bias=arrays.get('residual_bias'))
+    _worker['engine'] = RoundEngine(csr_matrix((arrays['mask_data'], arrays['mask_indices'], arrays['mask_indptr']),
+                                               shape=shape, copy=False), None, communication,
+                                    arrays['mask_data'].dtype)
+    _worker['server_model'] = SimpleNamespace(feature_vecs=arrays['feature_vecs'],
+                                              feature_bias=arrays['feature_bias'])
+
+
+def train_shard(task):
+    start = time.perf_counter()
+    _, lr, owner, slots, sample_owner, positive, negative = task
+    server_model = _worker['server_model']
+    vecs_update, features, feature_vecs_update, feature_bias_update = _worker['engine'].train_sparse(
+        lr, server_model, owner, _worker['features'][slots], _worker['weights'][slots],
+        _worker['vecs'][slots].astype(server_model.feature_vecs.dtype), sample_owner, positive, negative, slots)
+
+    # shards own disjoint clients, their embeddings are updated in place
+    _worker['vecs'][slots] += vecs_update
+    return features, feature_vecs_update, feature_bias_update, counters(start)
+
+
+def train_group(task):
+    start = time.perf_counter()
+    handle, n_clients, lr, owner, slots, sample_owner, positive, negative = task
+    server_model = _worker['server_model']
+    vecs_update, features, feature_vecs_update, feature_bias_update = _worker['engine'].train_sparse(
+        lr, server_model, owner, _worker['features'][slots], _worker['weights'][slots],
+        _worker['vecs'][slots].astype(server_model.feature_vecs.dtype), sample_owner, positive, negative, slots)
+    _worker['vecs'][slots] += vecs_update
+    return handle, features, feature_vecs_update, feature_bias_update, counters(start), n_clients
+
+
+def counters(start):
+    """ upload and sample counters of the worker since the last task, and seconds of the task begun at start """
+    engine = _worker['engine']
+    uploaded = engine.communication.reset() if engine.communication is not None else None
+    samples, skipped_samples = engine.samples, engine.skipped_samples
+    engine.samples = engine.skipped_samples = 0
+    return uploaded, samples, skipped_samples, time.perf_counter() - start
+
@@ -0,0 +1,96 @@
+import csv
+import json
+import os
+import resource
+import time
+
+
+def memory():
+    """
+    Resident set size and its high-water mark, in MiB.
+    :return: rss, peak rss (lifetime peak where the peak cannot be read from /proc)
+    """
+    try:
+        with open('/proc/self/status') as file:
+            fields = dict(line.split(':', 1) for line in file if ':' in line)
+        return int(fields['VmRSS'].split()[0]) / 1024, int(fields['VmHWM'].split()[0]) / 1024
+    except (OSError, KeyError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return peak, peak
+
+
+def reset_peak():
+    """ restart the high-water mark of the process from its current rss, where the kernel allows it """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+class Profiler:
+    """ class Profiler: wall time, cpu time and memory high-water mark of the consecutive phases of a run """
+
+    def __init__(self):
+        self.phases = []
+        self.current = None
+
+    def phase(self, name, **fields):
+        """
+        End the running phase, if any, and start a new one.
+        :param name: phase name
+        :param fields: other columns of the phase, e.g. the epoch
+        """
+        self.stop()
+        reset_peak()
+        self.current = dict(phase=name, **fields)
+        self.current['start'] = (time.perf_counter(), time.process_time())
+
+    def annotate(self, **fields):
+        """ add columns to the running phase """
+        self.current.update(fields)
+
+    def stop(self):
+        """ end the running phase """
+        if self.current is None:
+            return
+        wall, cpu = self.current.pop('start')
+        rss, peak = memory()
+        self.current.update(seconds=time.perf_counter() - wall, cpu_seconds=time.process_time() - cpu,
+                            rss_mb=rss, peak_rss_mb=peak)
+        self.phases.append(self.current)
+        self.current = None
+
+    def report(self, rounds=(), model=None):
+        """
+        :param rounds: statistics of the federated rounds
+        :param model: name of the profiled model
+        :return: dict with the model name, the phases, the total time of each phase name, the rounds and the peak
+            rss of the terminated child processes
+        """
+        totals = dict()
+        for p in self.phases:
+            totals[p['phase']] = totals.get(p['phase'], 0.0) + p['seconds']
+        return {'model': model, 'phases': self.phases, 'totals': totals, 'rounds': list(rounds),
+                'children_peak_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024}
+
+    def export(self, path, rounds=(), model=None):
+        """
+        Write the report as path.json, and its phases and rounds as path_phases.tsv and path_rounds.tsv.
+        :param path: path of the report, without extension
+        :param rounds: statistics of the federated rounds
+        :param model: name of the profiled model
+        """
+        self.stop()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        report = self.report(rounds, model)
+        with open(f'{path}.json', 'w') as file:
+            json.dump(report, file, indent=2)
+        for name, rows in (('phases', report['phases']), ('rounds', [dict(round=i, **r) for i, r in
+                                                                    enumerate(report['rounds'])])):
+            columns = list(dict.fromkeys(c for r in rows for c in r))
+            with open(f'{path}_{name}.tsv', 'w', newline='') as file:
+                writer = csv.DictWriter(file, columns, delimiter='\t')
+                writer.writeheader()
+                writer.writerows(rows)
+        print(f'profile written in {path}.json')
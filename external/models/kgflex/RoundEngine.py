@@ -0,0 +1,236 @@
+from collections import deque
+import time
+import numpy as np
+from scipy.sparse import csr_matrix, isspmatrix_csr
+
+
+class RoundEngine:
+    """ class RoundEngine: trains the clients of a federated round as one block-sparse computation """
+
+    def __init__(self, item_features_mask, store, communication=None, dtype=np.float32):
+        self.dtype = np.dtype(dtype)
+        # the matrix of an item store is read as it is, so that the items appended to it are seen
+        self.item_features_mask = item_features_mask if isspmatrix_csr(item_features_mask) and \
+            item_features_mask.dtype == self.dtype else csr_matrix(item_features_mask, dtype=self.dtype)
+        self.n_features = self.item_features_mask.shape[1]
+        self.store = store
+        self.communication = communication
+        # updates computed by submit, waiting to be collected
+        self.completed = deque()
+        self.submitted = 0
+        # since the last round: sampled triples, triples skipped for lack of common features, seconds per client
+        self.samples = 0
+        self.skipped_samples = 0
+        self.client_seconds = []
+
+    def sync(self):
+        """ follow the clients appended to the store since the last round: their slots get upload residuals """
+        if self.communication is not None:
+            self.communication.resize(len(self.store.features))
+
+    def gather(self, clients):
+        """
+        Stack the features of the given clients in a single list of (client, feature) slots.
+        :param clients: list of clients
+        :return: slot owner (position of the client in the list) and slot position in the store
+        """
+        return self.store.slots([c.model.row for c in clients])
+
+    def sample_matrix(self, items, sample_owner, slot_keys):
+        """
+        Link every sampled item to the slots of its features owned by the client which sampled it.
+        :param items: sampled items
+        :param sample_owner: slot owner of each sample
+        :param slot_keys: sorted slot keys (owner * n_features + feature)
+        :return: sparse (samples x slots) matrix
+        """
+        rows = self.item_features_mask[items]
+        row = np.repeat(np.arange(len(items)), np.diff(rows.indptr))
+        keys = sample_owner[row].astype(np.int64) * self.n_features + rows.indices
+        if len(slot_keys) == 0:
+            return csr_matrix((len(items), 0))
+        position = np.minimum(np.searchsorted(slot_keys, keys), len(slot_keys) - 1)
+        hit = slot_keys[position] == keys
+        return csr_matrix((rows.data[hit], (row[hit], position[hit])), shape=(len(items), len(slot_keys)))
+
+    def step(self, lr, server_model, owner, features, weights, vecs, sample_owner, positive, negative):
+        """
+        BPR step on a block of (client, positive, negative) triples.
+        :return: slot embeddings update, gradient coefficient of each slot
+        """
+        slot_keys = owner.astype(np.int64) * self.n_features + features
+        fv_ = server_model.feature_vecs[features]
+        scores = weights * ((vecs * fv_).sum(axis=1) + server_model.feature_bias[features])
+
+        pos_matrix = self.sample_matrix(positive, sample_owner, slot_keys)
+        neg_matrix = self.sample_matrix(negative, sample_owner, slot_keys)
+        x_p = pos_matrix.dot(scores)
+        x_n = neg_matrix.dot(scores)
+
+        # samples with no prediction (no common features) do not contribute
+        kept = (x_p != 0) & (x_n != 0)
+        self.samples += len(kept)
+        self.skipped_samples += len(kept) - int(kept.sum())
+        d_loss = np.zeros(len(x_p), dtype=x_p.dtype)
+        d_loss[kept] = 1 / (1 + np.exp(x_p[kept] - x_n[kept]))
+
+        d_slot = lr * weights * (pos_matrix.T.dot(d_loss) - neg_matrix.T.dot(d_loss))
+        return d_slot[:, None] * fv_, d_slot
+
+    def payload(self, slots, owner, features, d_slot, vecs):
+        """
+        Server update of each slot, as uploaded by the clients.
+        :return: features, vectors update and bias update of the uploaded slots
+        """
+        vecs_update, bias_update = d_slot[:, None] * vecs, d_slot
+        if self.communication is None:
+            return features, vecs_update, bias_update
+        sent, vecs_update, bias_update = self.communication.upload(slots, owner, vecs_update, bias_update)
+        return features[sent], vecs_update, bias_update
+
+    def download(self, n_slots, server_model):
+        if self.communication is not None:
+            self.communication.download(n_slots, server_model.feature_vecs.itemsize)
+
+    def train(self, lr, server_model, owner, features, weights, vecs, sample_owner, positive, negative, slots=None):
+        """
+        BPR step on a block of (client, positive, negative) triples.
+        :return: slot embeddings update, server feature vectors update, server feature bias update
+        """
+        vecs_update, d_slot = self.step(lr, server_model, owner, features, weights, vecs,
+                                        sample_owner, positive, negative)
+        features, slot_vecs, slot_bias = self.payload(slots, owner, features, d_slot, vecs)
+
+        slot_to_feature = csr_matrix((np.ones(len(features), dtype=self.dtype), (features, np.arange(len(features)))),
+                                     shape=(self.n_features, len(features)))
+        feature_vecs_update = slot_to_feature.dot(slot_vecs)
+        feature_bias_update = np.bincount(features, weights=slot_bias, minlength=self.n_features).astype(self.dtype)
+
+        return vecs_update, feature_vecs_update, feature_bias_update
+
+    def train_sparse(self, lr, server_model, owner, features, weights, vecs, sample_owner, positive, negative,
+                     slots=None):
+        """
+        BPR step on a block of (client, positive, negative) triples, with the server update restricted to the
+        features of the block.
+        :return: slot embeddings update, updated features, their vectors update and their bias update
+        """
+        vecs_update, d_slot = self.step(lr, server_model, owner, features, weights, vecs,
+                                        sample_owner, positive, negative)
+        features, slot_vecs, slot_bias = self.payload(slots, owner, features, d_slot, vecs)
+
+        touched, slot_feature = np.unique(features, return_inverse=True)
+        slot_to_feature = csr_matrix((np.ones(len(features), dtype=self.dtype),
+                                      (slot_feature, np.arange(len(features)))), shape=(len(touched), len(features)))
+        feature_vecs_update = slot_to_feature.dot(slot_vecs)
+        feature_bias_update = np.bincount(slot_feature, weights=slot_bias, minlength=len(touched)).astype(self.dtype)
+
+        return vecs_update, touched, feature_vecs_update, feature_bias_update
+
+    def train_triples(self, lr, server_model, clients, sample_owner, positive, negative):
+        """
+        Train the given clients on their (positive, negative) samples in a single step.
+        Client embeddings are updated in place, the server update is returned.
+        :param lr: learning rate
+        :param server_model: server model
+        :param clients: clients involved in the step
+        :param sample_owner: position in clients of the client owning each sample
+        :param positive: positive items
+        :param negative: negative items
+        :return: server feature vectors update, server feature bias update
+        """
+        self.sync()
+        owner, slots = self.gather(clients)
+        self.download(len(slots), server_model)
+
+        vecs_update, feature_vecs_update, feature_bias_update = self.train(
+            lr, server_model, owner, self.store.features[slots], self.store.weights[slots],
+            self.store.vecs[slots].astype(server_model.feature_vecs.dtype), sample_owner, positive, negative, slots)
+
+        self.store.vecs[slots] += vecs_update
+
+        return feature_vecs_update, feature_bias_update
+
+    def sample(self, clients):
+        """
+        Sample the training triples of every client, in client order.
+        :return: position in clients of the client owning each sample, positive items, negative items
+        """
+        samples = [c.sample() for c in clients]
+        sample_owner = np.repeat(np.arange(len(clients)), [len(p) for p, _ in samples])
+        positive = np.concatenate([p for p, _ in samples]) if samples else np.zeros(0, dtype=np.int64)
+        negative = np.concatenate([n for _, n in samples]) if samples else np.zeros(0, dtype=np.int64)
+        return sample_owner, positive, negative
+
+    def train_clients(self, lr, server_model, clients):
+        """
+        Sample the training triples of every client and train them in a single step.
+        :param lr: learning rate
+        :param server_model: server model
+        :param clients: selected clients
+        :return: server feature vectors update, server feature bias update
+        """
+        start = time.perf_counter()
+        update = self.train_triples(lr, server_model, clients, *self.sample(clients))
+        self.record(time.perf_counter() - start, len(clients))
+        return update
+
+    def submit(self, lr, server_model, clients):
+        """
+        Start the training of a group of clients against the current server model.
+        In process the update is computed right away and collected in submission order.
+        :param lr: learning rate
+        :param server_model: server model
+        :param clients: clients of the group
+        :return: handle of the update
+        """
+        start = time.perf_counter()
+        self.sync()
+        owner, slots = self.gather(clients)
+        self.download(len(slots), server_model)
+        vecs_update, features, feature_vecs_update, feature_bias_update = self.train_sparse(
+            lr, server_model, owner, self.store.features[slots], self.store.weights[slots],
+            self.store.vecs[slots].astype(server_model.feature_vecs.dtype), *self.sample(clients), slots)
+        self.store.vecs[slots] += vecs_update
+        self.record(time.perf_counter() - start, len(clients))
+
+        handle = self.submitted
+        self.submitted += 1
+        self.completed.append((handle, features, feature_vecs_update, feature_bias_update))
+        return handle
+
+    def wait(self):
+        """
+        Next completed update.
+        :return: handle, updated features, their vectors update and their bias update
+        """
+        return self.completed.popleft()
+
+    def record(self, seconds, n_clients, samples=0, skipped_samples=0):
+        """
+        Add the training time of a group of clients trained together, each one taking an equal share of it,
+        and the sample counters of a group trained out of this engine.
+        """
+        if n_clients:
+            self.client_seconds.extend([seconds / n_clients] * n_clients)
+        self.samples += samples
+        self.skipped_samples += skipped_samples
+
+    def counters(self):
+        """
+        Training counters since the last call.
+        :return: dict samples, skipped samples and distribution of the training seconds of the clients
+        """
+        seconds = np.array(self.client_seconds)
+        counters = {'samples': self.samples, 'skipped_samples': self.skipped_samples}
+        for name, q in (('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)):
+            counters[f'client_seconds_{name}'] = float(np.percentile(seconds, q)) if len(seconds) else 0.0
+        self.samples = self.skipped_samples = 0
+        self.client_seconds = []
+        return counters
+
+    def collect(self):
+        """ bring the client embeddings in the store before evaluation, they are already there in process """
+
+    def close(self):
+        """ release the resources of the engine """
@@ -0,0 +1,147 @@
+import numpy as np
+
+from .ClientStore import extend
+
+
+class Sampler:
+    """ class Sampler: positive and negative items of every client, drawn in bulk from shared sorted arrays """
+
+    def __init__(self, positives, n_items, method='uniform'):
+        """
+        :param positives: list with the positive items of each client
+        :param n_items: number of items
+        :param method: negative sampling method, 'uniform' or 'popularity'
+        """
+        self.n_items = n_items
+        self.method = method
+
+        self.indptr = np.zeros(len(positives) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(p) for p in positives])
+        self.items = np.concatenate([np.sort(np.fromiter(p, dtype=np.int64, count=len(p))) for p in positives]) \
+            if positives else np.zeros(0, dtype=np.int64)
+        # (client, item) keys are sorted, so membership is a binary search
+        self.keys = np.repeat(np.arange(len(positives), dtype=np.int64), np.diff(self.indptr)) * n_items + self.items
+
+        self.alias_prob = None
+        self.alias = None
+        # number of items the negatives are drawn from, popularity draws never reach the items no client rated
+        self.support = n_items
+        if method == 'popularity':
+            popularity = np.bincount(self.items, minlength=n_items)
+            self.alias_prob, self.alias = self.alias_table(popularity)
+            self.support = np.count_nonzero(popularity)
+        # sorted keys of the positive items added to the clients afterwards, rejected as negatives only
+        self.added_keys = np.zeros(0, dtype=np.int64)
+        # buffers with spare capacity of the appended clients
+        self.buffers = dict()
+        # number of changes of the positives, for the copies of the sampler kept by the client nodes
+        self.version = 0
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def append(self, positives):
+        """
+        Add a client after the last one, e.g. a folded in user; its keys follow the ones of the other clients.
+        Items added to the catalog after the sampler are not drawn, they are left out of the positives.
+        :param positives: positive items of the client
+        :return: row of the client
+        """
+        items = np.unique(np.asarray(positives, dtype=np.int64))
+        items = items[items < self.n_items]
+        client = len(self)
+        for name, values in (('items', items), ('keys', client * self.n_items + items),
+                             ('indptr', [self.indptr[-1] + len(items)])):
+            array, self.buffers[name] = extend(getattr(self, name), values, self.buffers.get(name))
+            setattr(self, name, array)
+        self.version += 1
+        return client
+
+    def add(self, client, positives):
+        """
+        Add positive items to a client, e.g. streamed interactions: they are never drawn as its negatives,
+        while its positives are still drawn among the ones it was built with.
+        :param client: client row
+        :param positives: new positive items
+        """
+        items = np.unique(np.asarray(positives, dtype=np.int64))
+        keys = client * self.n_items + items[items < self.n_items]
+        keys = keys[~self.member(self.keys, keys) & ~self.member(self.added_keys, keys)]
+        if len(keys):
+            self.added_keys = np.insert(self.added_keys, np.searchsorted(self.added_keys, keys), keys)
+            self.version += 1
+
+    @staticmethod
+    def member(sorted_keys, keys):
+        """ whether each key is in the sorted keys """
+        if len(sorted_keys) == 0:
+            return np.zeros(len(keys), dtype=bool)
+        position = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        return sorted_keys[position] == keys
+
+    @staticmethod
+    def alias_table(weights):
+        """
+        Vose's alias table for sampling items proportionally to the given weights in O(1).
+        :param weights: non negative item weights
+        :return: acceptance probability and alias of each item
+        """
+        n = len(weights)
+        prob = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+        alias = np.arange(n)
+        small = list(np.flatnonzero(prob < 1))
+        large = list(np.flatnonzero(prob >= 1))
+        while small and large:
+            s, l = small.pop(), large.pop()
+            alias[s] = l
+            prob[l] -= 1 - prob[s]
+            (small if prob[l] < 1 else large).append(l)
+        prob[large] = 1
+        prob[small] = 1
+        return prob, alias
+
+    def draw(self, size, uniform=None):
+        """
+        :param size: number of items
+        :param uniform: whether each item is drawn uniformly instead of by popularity, None for none of them
+        """
+        if self.alias is None:
+            return np.random.randint(self.n_items, size=size)
+        items = np.random.randint(self.n_items, size=size)
+        popular = np.where(np.random.random(size) < self.alias_prob[items], items, self.alias[items])
+        return popular if uniform is None else np.where(uniform, items, popular)
+
+    def positive(self, clients):
+        """
+        Uniformly sample a positive item for each of the given clients.
+        :param clients: client rows
+        :return: positive items
+        """
+        lengths = self.indptr[clients + 1] - self.indptr[clients]
+        return self.items[self.indptr[clients] + (np.random.random(len(clients)) * lengths).astype(np.int64)]
+
+    def negative(self, clients):
+        """
+        Sample an item not rated by each of the given clients, rejecting the positive ones in bulk.
+        :param clients: client rows
+        :return: negative items, -1 for the clients which rated every item
+        """
+        clients = np.asarray(clients, dtype=np.int64)
+        n_positive = self.indptr[clients + 1] - self.indptr[clients]
+        if len(self.added_keys):
+            n_positive += np.searchsorted(self.added_keys, (clients + 1) * self.n_items) - \
+                np.searchsorted(self.added_keys, clients * self.n_items)
+        # clients which may have rated every item of the popularity draws draw uniformly
+        uniform = n_positive >= self.support if self.alias is not None else None
+        negative = self.draw(len(clients), uniform)
+        full = n_positive >= self.n_items
+        negative[full] = -1
+        rejected = np.flatnonzero(~full)
+        while len(rejected):
+            keys = clients[rejected] * self.n_items + negative[rejected]
+            hit = self.member(self.keys, keys)
+            if len(self.added_keys):
+                hit |= self.member(self.added_keys, keys)
+            rejected = rejected[hit]
+            negative[rejected] = self.draw(len(rejected), None if uniform is None else uniform[rejected])
+        return negative
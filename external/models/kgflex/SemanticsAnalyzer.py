@@ -1,4 +1,5 @@
 from .UserFeatureMapper import UserFeatureMapper
+from .ItemFeatures import ItemFeatures
 from collections import defaultdict
 import numpy as np
 from old_elliot.recommender import BaseRecommenderModel
@@ -31,18 +32,13 @@ class SemanticsAnalyzer(RecMixin, BaseRecommenderModel):
         # ------------------------------ ITEM FEATURES ------------------------------
         print('importing items features')
 
-        self.item_features_mapper = {item: set(map(tuple,
-                                                   self._data.side_information_data.feature_map[
-                                                       self._data.side_information_data.feature_map.itemId ==
-                                                       self._data.private_items[item]]
-                                                   [['predicate', 'object']].values))
-                                     for item in self._data.private_items}
+        self.item_features = ItemFeatures(self._data.side_information_data.feature_map, self._data.private_items)
 
         # ------------------------------ USER FEATURES ------------------------------
         print('user features loading')
 
         self.user_feature_mapper = UserFeatureMapper(self._data.i_train_dict,
-                                                     self.item_features_mapper,
+                                                     self.item_features,
                                                      self._data.side_information_data.predicate_mapping, self._seed)
         client_ids = list(self._data.i_train_dict.keys())
         self.user_feature_mapper.compute_and_export_features(client_ids, self._parallel_ufm, self._first_order_limit,
@@ -55,9 +51,10 @@ class SemanticsAnalyzer(RecMixin, BaseRecommenderModel):
 
         for c, user_id in enumerate(client_ids):
             print(c)
-            for i, v in enumerate(self.user_feature_mapper[user_id]):
+            user_features = self.user_feature_mapper[user_id]
+            for i, v in enumerate(user_features):
                 feat['<' + ', '.join(el.split('/')[-1] for el in pred.loc[v[0]]['p'].split('~')) + ', ' +
-                   obj.loc[v[1]]['o'].split('/')[-1].split(':')[-1] + '>'] += self.user_feature_mapper[user_id][v]
+                   obj.loc[v[1]]['o'].split('/')[-1].split(':')[-1] + '>'] += user_features[v]
 
         k = pd.DataFrame.from_dict(feat, orient="index")
         k[0] = k[0].apply(lambda x: int(x * 100))
@@ -1,33 +1,315 @@
 # import multiprocessing
 import numpy as np
-# import math
 import time
 from tqdm import tqdm
 from scipy.sparse import csr_matrix
 
+from .UserFeatureMapper import select_features
+
 
 class Server:
 
-    def __init__(self, lr, model):
+    def __init__(self, lr, model, engine=None, index=None, sampler=None):
         self.model = model
         self.lr = lr
+        self.engine = engine
+        self.index = index
+        self.sampler = sampler
+        # clients, commits and time of every federated round
+        self.round_stats = []
         # self.predictor = Predictor()
 
     def train_model(self, clients):
-        tmp_feature_vecs = np.zeros(self.model.feature_vecs.shape)
-        tmp_feature_bias = np.zeros(self.model.feature_bias.shape)
+        start = time.time()
+        tmp_feature_vecs = np.zeros_like(self.model.feature_vecs)
+        tmp_feature_bias = np.zeros_like(self.model.feature_bias)
+        communication = self.engine.communication if self.engine is not None else None
+        if self.engine is not None:
+            self.engine.sync()
         for c in tqdm(clients):
-            client_update = c.train(self.lr, self.model)
-            tmp_feature_vecs += client_update[0]
-            tmp_feature_bias += client_update[1]
+            client_start = time.perf_counter()
+            features, feature_vecs_update, feature_bias_update = c.train(self.lr, self.model)
+            if communication is not None:
+                communication.download(len(c.model.features), self.model.feature_vecs.itemsize)
+                sent, feature_vecs_update, feature_bias_update = communication.upload(
+                    c.model.slots(features), np.zeros(len(features), dtype=np.int64),
+                    feature_vecs_update, feature_bias_update)
+                features = features[sent]
+            tmp_feature_vecs[features] += feature_vecs_update
+            tmp_feature_bias[features] += feature_bias_update
+            if self.engine is not None:
+                self.engine.record(time.perf_counter() - client_start, 1, c.samples, c.skipped_samples)
         self.model.feature_vecs += tmp_feature_vecs
         self.model.feature_bias += tmp_feature_bias
+        return self.record_round(len(clients), start, 1, 0, [0])
+
+    def train_model_batch(self, clients):
+        start = time.time()
+        feature_vecs_update, feature_bias_update = self.engine.train_clients(self.lr, self.model, clients)
+        self.model.feature_vecs += feature_vecs_update
+        self.model.feature_bias += feature_bias_update
+        return self.record_round(len(clients), start, 1, 0, [0])
+
+    def train_model_async(self, clients, buffer_size, max_staleness, window):
+        """
+        Asynchronous round: groups of buffer_size clients are trained against the server model of the moment
+        in which they are dispatched, with up to window groups in flight, and the update of a group is applied
+        as soon as it arrives. Updates computed on a model older than max_staleness commits are dropped.
+        :param clients: selected clients
+        :param buffer_size: number of client updates in a commit
+        :param max_staleness: maximum number of commits between dispatch and commit of an update
+        :param window: maximum number of groups in flight
+        :return: round statistics
+        """
+        start = time.time()
+        groups = [clients[i:i + buffer_size] for i in range(0, len(clients), buffer_size)]
+        # handle of each group in flight: version of the model it has read, number of clients
+        in_flight = dict()
+        version = 0
+        dropped = 0
+        staleness = []
+
+        for group in groups[:window]:
+            in_flight[self.engine.submit(self.lr, self.model, group)] = (version, len(group))
+        dispatched = len(in_flight)
+
+        while in_flight:
+            handle, features, feature_vecs_update, feature_bias_update = self.engine.wait()
+            read_version, size = in_flight.pop(handle)
+            if version - read_version > max_staleness:
+                dropped += size
+            else:
+                staleness.append(version - read_version)
+                self.model.feature_vecs[features] += feature_vecs_update
+                self.model.feature_bias[features] += feature_bias_update
+                version += 1
+            if dispatched < len(groups):
+                group = groups[dispatched]
+                in_flight[self.engine.submit(self.lr, self.model, group)] = (version, len(group))
+                dispatched += 1
+
+        return self.record_round(len(clients), start, version, dropped, staleness)
+
+    def record_round(self, n_clients, start, commits, dropped, staleness):
+        """
+        Throughput, staleness, communication cost, skipped samples and client time distribution of a round.
+        :param n_clients: number of clients of the round
+        :param start: start time of the round
+        :param commits: number of updates applied to the server model
+        :param dropped: number of clients whose update has been dropped
+        :param staleness: staleness of each applied update
+        :return: round statistics
+        """
+        elapsed = time.time() - start
+        stats = {'clients': n_clients, 'commits': commits, 'dropped_clients': dropped,
+                 'mean_staleness': float(np.mean(staleness)) if len(staleness) else 0.0,
+                 'seconds': elapsed, 'clients_per_second': n_clients / elapsed if elapsed > 0 else 0.0,
+                 'upload_bytes': 0, 'download_bytes': 0}
+        if self.engine is not None and self.engine.communication is not None:
+            stats.update(self.engine.communication.reset())
+        if self.engine is not None:
+            stats.update(self.engine.counters())
+        self.round_stats.append(stats)
+        print(f'round: {n_clients} clients in {elapsed:.2f}s ({stats["clients_per_second"]:.1f} clients/s), '
+              f'{commits} commits, {dropped} clients dropped, mean staleness {stats["mean_staleness"]:.2f}, '
+              f'upload {stats["upload_bytes"] / 2 ** 20:.2f} MiB, '
+              f'download {stats["download_bytes"] / 2 ** 20:.2f} MiB, '
+              f'{stats.get("skipped_samples", 0)} of {stats.get("samples", 0)} samples skipped')
+        return stats
+
+    def centralized_training(self, transactions, clients, batch_size):
+        """
+        One epoch of minibatch BPR over the (user, positive, negative) triples of all the clients.
+        Each minibatch is trained as a single block and applied to server and client parameters right away.
+        :param transactions: number of training transactions (triples sampled in the epoch)
+        :param clients: all the clients
+        :param batch_size: number of triples in a minibatch
+        """
+        for batch_start in tqdm(range(0, transactions, batch_size)):
+            users = np.random.randint(len(clients), size=min(batch_size, transactions - batch_start))
+            positive = self.sampler.positive(users)
+            negative = self.sampler.negative(users)
+            # no triple for the users which rated every item
+            kept = negative >= 0
+            users, positive, negative = users[kept], positive[kept], negative[kept]
+
+            batch_users, sample_owner = np.unique(users, return_inverse=True)
+            feature_vecs_update, feature_bias_update = self.engine.train_triples(
+                self.lr, self.model, [clients[u] for u in batch_users], sample_owner, positive, negative)
+            self.model.feature_vecs += feature_vecs_update
+            self.model.feature_bias += feature_bias_update
+
+    def fold_in(self, items, feature_depth, first_order_limit, second_order_limit, steps, random_seed=42):
+        """
+        Add a new client to the store of a trained model, leaving the server model untouched.
+        Its features are selected, by information gain on its items, among the model features, and its
+        embeddings are trained for some local BPR steps against the frozen server model.
+        The client is appended to the sampler too, at the same row, to draw its negative items.
+        :param items: positive items of the client
+        :param feature_depth: order of each model feature
+        :param first_order_limit: number of first order features of the client
+        :param second_order_limit: number of second order features of the client
+        :param steps: local training steps, each one on a triple for every positive item
+        :param random_seed: random seed
+        :return: store row of the client
+        """
+        items = np.unique(np.asarray(items, dtype=np.int64))
+        n_items = self.engine.item_features_mask.shape[0]
+
+        np.random.seed(random_seed)
+        # counts of UserFeatureMapper.feature_counter on the rows of the user items only, as presence counts
+        # since the values of a hashed mask are signed
+        trainable = 0 < len(items) < n_items
+        client = self.sampler.append(items)
+        mask = self.engine.item_features_mask
+        positive_counts = csr_matrix((mask[items] != 0).sum(axis=0), dtype=np.float64)
+        negative_counts = csr_matrix((mask[np.unique(self.sampler.negative(np.full(len(items), client)))] != 0)
+                                     .sum(axis=0) if trainable else (1, mask.shape[1]), dtype=np.float64)
+        _, features, gains = select_features(positive_counts, negative_counts, np.array([len(items)]),
+                                             feature_depth, first_order_limit, second_order_limit)
+        row = self.engine.store.append(features, gains, random_seed)
+        self.local_training(row, items, steps)
+        return row
+
+    def refresh(self, row, items, features, gains, steps, random_seed=42):
+        """
+        Replace the features of a client of the store with a new selection, e.g. the one of a FeatureStream,
+        keeping its row. When the features are the same only their weights change; otherwise the features it
+        keeps keep their embeddings and upload residuals, the new ones are drawn as the ones of an appended
+        client, and it is trained for some local steps as a folded in client.
+        :param row: store row of the client, its row in the sampler too
+        :param items: positive items of the client
+        :param features: selected model features
+        :param gains: weight of each selected feature
+        :param steps: local training steps of a client whose features change
+        :param random_seed: random seed
+        :return: whether the features of the client changed
+        """
+        store = self.engine.store
+        order = np.argsort(features, kind='stable')
+        features, gains = np.asarray(features, dtype=np.int64)[order], np.asarray(gains)[order]
+        _, slots = store.slots([row])
+        previous_features, previous_vecs = store.features[slots], store.vecs[slots]
+        if np.array_equal(previous_features, features):
+            store.rewrite(row, features, gains, previous_vecs)
+            return False
+
+        np.random.seed(random_seed)
+        vecs = np.random.randn(len(features), store.embedding) / 10
+        kept = np.isin(features, previous_features)
+        vecs[kept] = previous_vecs[np.searchsorted(previous_features, features[kept])]
+        communication = self.engine.communication
+        previous = (store.indptr.copy(), store.features.copy()) \
+            if communication is not None and communication.error_feedback else None
+        store.rewrite(row, features, gains, vecs)
+        if previous is not None:
+            communication.remap(*previous, store.indptr, store.features)
+        self.local_training(row, np.unique(np.asarray(items, dtype=np.int64)), steps)
+        return True
+
+    def local_training(self, row, items, steps):
+        """
+        Local BPR steps of a single client against the frozen server model.
+        :param row: store row of the client, its row in the sampler too
+        :param items: sorted positive items of the client
+        :param steps: training steps, each one on a triple for every positive item
+        """
+        store = self.engine.store
+        _, slots = store.slots([row])
+        if not 0 < len(items) < self.engine.item_features_mask.shape[0] or len(slots) == 0 or steps == 0:
+            return
+
+        # RoundEngine.step of a single client, with the mask rows of the positive items and of the negative
+        # items of every step gathered once
+        features, weights = store.features[slots], store.weights[slots]
+        feature_vecs, feature_bias = self.model.feature_vecs[features], self.model.feature_bias[features]
+        n = len(items)
+        negative = self.sampler.negative(np.full(steps * n, row))
+        if negative[0] < 0:
+            return
+        rows = self.engine.item_features_mask[np.concatenate([items, negative])]
+        sample = np.repeat(np.arange(rows.shape[0]), np.diff(rows.indptr))
+        position = np.minimum(np.searchsorted(features, rows.indices), len(features) - 1)
+        hit = features[position] == rows.indices
+        entries = csr_matrix((rows.data[hit], (sample[hit], position[hit])), shape=(rows.shape[0], len(features)))
+        positive_entries = entries[:n]
+
+        vecs = store.vecs[slots]
+        for step in range(steps):
+            scores = weights * ((vecs * feature_vecs).sum(axis=1) + feature_bias)
+            positive = np.random.randint(n, size=n)
+            negative_entries = entries[n * (step + 1):n * (step + 2)]
+            x_p = positive_entries.dot(scores)[positive]
+            x_n = negative_entries.dot(scores)
+            kept = (x_p != 0) & (x_n != 0)
+            d_loss = np.zeros(n, dtype=scores.dtype)
+            d_loss[kept] = 1 / (1 + np.exp(x_p[kept] - x_n[kept]))
+            d_slot = self.lr * weights * (positive_entries.T.dot(np.bincount(positive, weights=d_loss, minlength=n))
+                                          - negative_entries.T.dot(d_loss))
+            vecs += (d_slot[:, None] * feature_vecs).astype(vecs.dtype)
+        store.vecs[slots] = vecs
+
+    def predict(self, clients, users_mapping_reverse, items_mapping_reverse, mask, max_k, block_size=1024):
+        """
+        Top-k recommendation of all the clients, scoring blocks of clients with a single sparse product.
+        :param clients: clients to predict
+        :param users_mapping_reverse: dict private user id: public user id
+        :param items_mapping_reverse: dict private item id: public item id
+        :param mask: (users x items) boolean candidate mask
+        :param max_k: number of recommended items
+        :param block_size: number of clients scored together
+        :return: dict public user id: list of (public item id, score)
+        """
+        if self.index is not None:
+            return self.predict_index(clients, users_mapping_reverse, items_mapping_reverse, mask, max_k, block_size)
+
+        store = self.engine.store
+        item_features_mask = self.engine.item_features_mask
+        k = min(max_k, item_features_mask.shape[0])
+
+        predictions = dict()
+        for start in range(0, len(clients), block_size):
+            block = clients[start:start + block_size]
+            owner, slots = store.slots([c.model.row for c in block])
+            features = store.features[slots]
+            scores = store.weights[slots] * ((store.vecs[slots] * self.model.feature_vecs[features]).sum(axis=1) +
+                                             self.model.feature_bias[features])
+            user_feature_scores = csr_matrix((scores, (owner, features)),
+                                             shape=(len(block), self.model.feature_bias.shape[0]))
+            result = item_features_mask.dot(user_feature_scores.T).T.toarray()
+
+            result[~mask[[c.user_id for c in block]]] = -np.inf
+
+            unordered_top_k = np.argpartition(result, -k, axis=1)[:, -k:]
+            top_k = np.take_along_axis(unordered_top_k,
+                                       np.argsort(np.take_along_axis(result, unordered_top_k, axis=1), axis=1)[:, ::-1],
+                                       axis=1)
+            top_k_score = np.take_along_axis(result, top_k, axis=1)
+            for c, items, item_scores in zip(block, top_k, top_k_score):
+                predictions[users_mapping_reverse[c.user_id]] = [(items_mapping_reverse[i], s)
+                                                                 for i, s in zip(items, item_scores)]
+        print('\r✓ PREDICTIONS: {} CLIENTS\' PREDICTED'.format(len(clients)))
+        return predictions
+
+    def predict_index(self, clients, users_mapping_reverse, items_mapping_reverse, mask, max_k, block_size=1024):
+        """
+        Top-k recommendation of all the clients through the inverted feature index,
+        scoring only the items which share some feature with each client.
+        """
+        store = self.engine.store
 
-    def predict(self, clients, users_mapping_reverse, items_mapping_reverse, mask, max_k):
         predictions = dict()
-        for i, c in enumerate(clients):
-            print('\r==== PREDICTIONS: CLIENT {} OF {} ===>'.format(i + 1, len(clients)), end='')
-            predictions[users_mapping_reverse[c.user_id]] = c.predict(self.model, items_mapping_reverse,
-                                                                      mask[c.user_id], max_k)
+        for start in range(0, len(clients), block_size):
+            block = clients[start:start + block_size]
+            owner, slots = store.slots([c.model.row for c in block])
+            features = store.features[slots]
+            scores = store.weights[slots] * ((store.vecs[slots] * self.model.feature_vecs[features]).sum(axis=1) +
+                                             self.model.feature_bias[features])
+            bounds = np.searchsorted(owner, np.arange(len(block) + 1))
+            for i, c in enumerate(block):
+                items, item_scores = self.index.top_k(features[bounds[i]:bounds[i + 1]],
+                                                      scores[bounds[i]:bounds[i + 1]], mask[c.user_id], max_k)
+                predictions[users_mapping_reverse[c.user_id]] = [(items_mapping_reverse[i], s)
+                                                                 for i, s in zip(items, item_scores)]
         print('\r✓ PREDICTIONS: {} CLIENTS\' PREDICTED'.format(len(clients)))
         return predictions
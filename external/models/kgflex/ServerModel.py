@@ -3,7 +3,7 @@ import numpy as np
 
 class ServerModel:
 
-    def __init__(self, features_mapping, embedding, random_seed=42):
+    def __init__(self, features_mapping, embedding, random_seed=42, dtype=np.float32):
         np.random.seed(random_seed)
-        self.feature_vecs = np.random.randn(len(features_mapping), embedding) / 10
-        self.feature_bias = np.random.randn(len(features_mapping)) / 10
\ No newline at end of file
+        self.feature_vecs = (np.random.randn(len(features_mapping), embedding) / 10).astype(dtype)
+        self.feature_bias = (np.random.randn(len(features_mapping)) / 10).astype(dtype)
\ No newline at end of file
@@ -0,0 +1,30 @@
+import numpy as np
+from multiprocessing import RawArray
+
+
+def share(array):
+    """ copy of the array in a shared memory block """
+    raw = RawArray('b', max(array.nbytes, 1))
+    np.frombuffer(raw, dtype=array.dtype, count=array.size)[:] = array.ravel()
+    return raw, array.dtype.str, array.shape
+
+
+def attach(shared):
+    """ numpy views of shared memory blocks """
+    return {k: np.frombuffer(raw, dtype=np.dtype(dtype), count=int(np.prod(shape))).reshape(shape)
+            for k, (raw, dtype, shape) in shared.items()}
+
+
+def balanced_chunks(sizes, n_chunks):
+    """
+    Split a sequence of work sizes in contiguous chunks of similar total size.
+    :param sizes: size of each element
+    :param n_chunks: number of chunks
+    :return: chunk bounds
+    """
+    cumulative = np.cumsum(sizes)
+    if len(cumulative) == 0:
+        return np.zeros(1, dtype=np.int64)
+    targets = cumulative[-1] * np.arange(1, n_chunks) / n_chunks
+    inner = np.searchsorted(cumulative, targets, side='right')
+    return np.unique(np.concatenate([[0], inner, [len(sizes)]]))
@@ -0,0 +1,178 @@
+import math
+import numpy as np
+
+from .KnowledgeGraph import KnowledgeGraph
+from .Sampler import Sampler
+from .UserFeatureMapper import UserFeatureMapper, rank_features
+
+
+class CountMinSketch:
+    """ class CountMinSketch: counts of int64 keys in a fixed table, never below the exact counts """
+
+    def __init__(self, width=2 ** 14, rows=4, random_seed=42):
+        """
+        :param width: columns of each row, rounded up to a power of two
+        :param rows: independent hash functions
+        :param random_seed: random seed of the hash functions
+        """
+        bits = max(int(math.ceil(math.log2(max(width, 2)))), 1)
+        self.width = 2 ** bits
+        self.shift = np.uint64(64 - bits)
+        rs = np.random.RandomState(random_seed)
+        # multiply-shift hashing with odd multipliers
+        self.a = (rs.randint(0, 2 ** 63, size=rows, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+        self.b = rs.randint(0, 2 ** 63, size=rows, dtype=np.uint64)
+        self.table = np.zeros((rows, self.width), dtype=np.int64)
+
+    def columns(self, keys):
+        keys = np.asarray(keys, dtype=np.int64).view(np.uint64)
+        return ((keys[None, :] * self.a[:, None] + self.b[:, None]) >> self.shift).astype(np.int64)
+
+    def add(self, keys):
+        """ count every occurrence of the given keys """
+        for row, columns in enumerate(self.columns(keys)):
+            self.table[row] += np.bincount(columns, minlength=self.width)
+
+    def query(self, keys):
+        """ estimated counts of the given keys """
+        columns = self.columns(keys)
+        return self.table[np.arange(len(columns))[:, None], columns].min(axis=0) if len(keys) else \
+            np.zeros(0, dtype=np.int64)
+
+    def clear(self):
+        self.table[:] = 0
+
+
+class SketchFeatureMapper:
+    """
+    class SketchFeatureMapper: user features of any depth over a KnowledgeGraph, in bounded memory.
+    The features of the positive and negative items of a user are expanded a block at a time and counted in
+    count-min sketches; the features with the best estimated information gain are the candidates, and only
+    the candidates are counted exactly, in a second pass, to select the features of the user.
+    """
+
+    def __init__(self, data, graph: KnowledgeGraph, random_seed=42, width=2 ** 14, candidates=512, min_gain=0.0,
+                 block_size=256):
+        """
+        :param data: dict client: positive items
+        :param graph: knowledge graph of the items
+        :param random_seed: random seed
+        :param width: columns of the count-min sketches
+        :param candidates: features of a user counted exactly (-1: every feature, without sketches)
+        :param min_gain: estimated information gain of a candidate
+        :param block_size: items expanded together
+        """
+        np.random.seed(random_seed)
+        self.random_seed = random_seed
+        self.user_pos_items = data
+        self.graph = graph
+        self.candidates = candidates
+        self.min_gain = min_gain
+        self.block_size = block_size
+        self.positive_sketch = CountMinSketch(width, random_seed=random_seed)
+        self.negative_sketch = CountMinSketch(width, random_seed=random_seed)
+
+        # extracted features, as in UserFeatureMapper, with the knowledge graph keys as feature codes
+        self.clients = []
+        self.client_rows = dict()
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.features = np.zeros(0, dtype=np.int64)
+        self.gains = np.zeros(0)
+
+    def blocks(self, items):
+        """
+        Feature keys of the items, a block at a time.
+        :return: function returning an iterable over the blocks, expanded once when the items fit in a block
+        """
+        if len(items) <= self.block_size:
+            expanded = [self.graph.expand(items)[1]]
+            return lambda: expanded
+        return lambda: (self.graph.expand(items[start:start + self.block_size])[1]
+                        for start in range(0, len(items), self.block_size))
+
+    @staticmethod
+    def exact_counts(blocks, keys):
+        """ number of occurrences of each of the sorted keys in the blocks """
+        counts = np.zeros(len(keys), dtype=np.int64)
+        for block in blocks():
+            position = np.minimum(np.searchsorted(keys, block), len(keys) - 1)
+            hit = keys[position] == block
+            counts += np.bincount(position[hit], minlength=len(keys))
+        return counts
+
+    def candidate_keys(self, positive_blocks, negative_blocks, n_positive):
+        """ features of the positive items with the best estimated information gain, sorted """
+        self.positive_sketch.clear()
+        self.negative_sketch.clear()
+        for block in positive_blocks():
+            self.positive_sketch.add(block)
+        for block in negative_blocks():
+            self.negative_sketch.add(block)
+
+        candidates = np.zeros(0, dtype=np.int64)
+        for block in positive_blocks():
+            keys = np.union1d(candidates, block)
+            gains = UserFeatureMapper.features_entropy(self.positive_sketch.query(keys).astype(np.float64),
+                                                       self.negative_sketch.query(keys).astype(np.float64),
+                                                       np.full(len(keys), n_positive))
+            kept = np.flatnonzero(gains > self.min_gain)
+            if len(kept) > self.candidates:
+                kept = kept[np.argpartition(-gains[kept], self.candidates - 1)[:self.candidates]]
+            candidates = np.sort(keys[kept])
+        return candidates
+
+    def client_features(self, positives, negatives, limit_first, limit_second):
+        """
+        Features of a client by decreasing information gain, limits as in UserFeatureMapper.
+        :param positives: positive items
+        :param negatives: negative items
+        :return: feature keys and information gains
+        """
+        positive_blocks, negative_blocks = self.blocks(positives), self.blocks(negatives)
+        if self.candidates == -1:
+            keys = np.unique(np.concatenate(list(positive_blocks()) or [np.zeros(0, dtype=np.int64)]))
+        else:
+            keys = self.candidate_keys(positive_blocks, negative_blocks, len(positives))
+        if len(keys) == 0:
+            return keys, np.zeros(0)
+
+        positive_counts = self.exact_counts(positive_blocks, keys).astype(np.float64)
+        negative_counts = self.exact_counts(negative_blocks, keys).astype(np.float64)
+        gains = UserFeatureMapper.features_entropy(positive_counts, negative_counts,
+                                                   np.full(len(keys), len(positives)))
+        kept = (positive_counts > 0) & (gains > 0)
+        keys, gains = keys[kept], gains[kept]
+        _, selected, gains = rank_features(np.zeros(len(keys), dtype=np.int64), np.arange(len(keys)), gains,
+                                           self.graph.feature_depth(keys), 1, limit_first, limit_second)
+        return keys[selected], gains
+
+    def compute_and_export_features(self, clients: list, first_order_limit, second_order_limit):
+        """
+        Extract the features of the given clients; each order above the first is limited to second_order_limit.
+        :param clients: list of clients
+        :param first_order_limit: number of first order features of each client
+        :param second_order_limit: number of features of each higher order of each client
+        """
+        positives = [np.array(sorted(self.user_pos_items[c]), dtype=np.int64) for c in clients]
+        sampler = Sampler(positives, self.graph.n_items)
+        owner = np.repeat(np.arange(len(clients)), np.diff(sampler.indptr))
+        negative = sampler.negative(owner)
+
+        features, gains = [], []
+        for position, c in enumerate(clients):
+            client_negatives = np.unique(negative[sampler.indptr[position]:sampler.indptr[position + 1]])
+            client_negatives = client_negatives[client_negatives >= 0]
+            client_features, client_gains = self.client_features(positives[position], client_negatives,
+                                                                 first_order_limit, second_order_limit)
+            features.append(client_features)
+            gains.append(client_gains)
+            if (position + 1) % 1000 == 0 or position + 1 == len(clients):
+                print(f'\rextracted features of {position + 1} clients of {len(clients)}', end='')
+        print()
+
+        self.clients = list(clients)
+        self.client_rows = {c: row for row, c in enumerate(self.clients)}
+        self.indptr = np.zeros(len(clients) + 1, dtype=np.int64)
+        self.indptr[1:] = np.cumsum([len(f) for f in features])
+        self.features = np.concatenate(features) if features else np.zeros(0, dtype=np.int64)
+        self.gains = np.concatenate(gains) if gains else np.zeros(0)
@@ -0,0 +1,250 @@
+import socket
+import struct
+import time
+import numpy as np
+from multiprocessing import Process
+from types import SimpleNamespace
+
+from .RoundEngine import RoundEngine
+from .SharedMemory import balanced_chunks
+
+# message types
+HELLO, ROUND, PULL, MODEL, PUSH, COLLECT, EMBEDDINGS, STOP, STORE = range(9)
+
+# array types of the binary format
+DTYPES = [np.dtype(t) for t in ('<i4', '<i8', '<f2', '<f4', '<f8')]
+
+
+def send(connection, kind, arrays):
+    """
+    Send a message: type and number of arrays, then type, shape and raw data of every array.
+    :return: number of bytes sent
+    """
+    chunks = [struct.pack('<BB', kind, len(arrays))]
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+        chunks.append(struct.pack(f'<BB{array.ndim}Q', DTYPES.index(array.dtype), array.ndim, *array.shape))
+        chunks.append(array.tobytes())
+    message = b''.join(chunks)
+    connection.sendall(message)
+    return len(message)
+
+
+def receive_exactly(connection, n_bytes):
+    buffer = bytearray(n_bytes)
+    view = memoryview(buffer)
+    received = 0
+    while received < n_bytes:
+        chunk = connection.recv_into(view[received:], n_bytes - received)
+        if chunk == 0:
+            raise ConnectionError('connection closed')
+        received += chunk
+    return buffer
+
+
+def receive(connection):
+    """
+    Receive a message.
+    :return: message type, list of arrays, number of bytes received
+    """
+    kind, n_arrays = struct.unpack('<BB', receive_exactly(connection, 2))
+    n_bytes = 2
+    arrays = []
+    for _ in range(n_arrays):
+        code, ndim = struct.unpack('<BB', receive_exactly(connection, 2))
+        shape = struct.unpack(f'<{ndim}Q', receive_exactly(connection, 8 * ndim))
+        dtype = DTYPES[code]
+        size = int(np.prod(shape)) * dtype.itemsize
+        arrays.append(np.frombuffer(receive_exactly(connection, size), dtype=dtype).reshape(shape))
+        n_bytes += 2 + 8 * ndim + size
+    return kind, arrays, n_bytes
+
+
+class SocketRoundEngine(RoundEngine):
+    """ class SocketRoundEngine: federated rounds between the server and client nodes running as processes """
+
+    def __init__(self, item_features_mask, store, server_model, sampler, upc, nodes, communication=None,
+                 random_seed=42, host='127.0.0.1'):
+        """
+        Clients are split in nodes of contiguous store rows; each node owns the embeddings of its clients and
+        talks to the server through a TCP socket. In a round, a node receives its selected clients, pulls the
+        server vectors of their features in one message, trains them and pushes back one sparse update.
+        :param item_features_mask: items x model features mask
+        :param store: client store
+        :param server_model: server model
+        :param sampler: training items sampler
+        :param upc: updates per client, None for one update per positive item
+        :param nodes: number of node processes
+        :param communication: upload compression (applied by the nodes) and byte counters
+        :param random_seed: random seed of the nodes
+        :param host: address of the server
+        """
+        super().__init__(item_features_mask, store, communication, server_model.feature_vecs.dtype)
+        self.sampler = sampler
+        # versions of store and sampler the nodes have
+        self.version = (store.version, sampler.version)
+        self.bounds = balanced_chunks(np.diff(store.indptr), nodes)
+        n_nodes = len(self.bounds) - 1
+        wire = np.float16 if communication is not None and communication.quantization == 'float16' \
+            else server_model.feature_vecs.dtype
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind((host, 0))
+        listener.listen(n_nodes)
+        address = listener.getsockname()
+
+        self.processes = [Process(target=run_node,
+                                  args=(address, node, self.bounds[node], self.bounds[node + 1], item_features_mask,
+                                        store, server_model.feature_vecs.shape, self.dtype, sampler, upc,
+                                        communication, wire,
+                                        random_seed + node), daemon=True)
+                          for node in range(n_nodes)]
+        for process in self.processes:
+            process.start()
+
+        self.connections = [None] * n_nodes
+        for _ in range(n_nodes):
+            connection, _ = listener.accept()
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _, (node,), _ = receive(connection)
+            self.connections[int(node[0])] = connection
+        listener.close()
+
+    def count(self, sent, received):
+        """ bytes on the wire: the server sends the downloads and receives the uploads """
+        if self.communication is not None:
+            self.communication.add({'upload_bytes': received, 'download_bytes': sent})
+
+    def sync(self):
+        """
+        Send to the nodes the features of their clients and the positives added to the sampler, when they changed
+        since the last round. The embeddings of the store are the ones collected before the change.
+        """
+        version = (self.store.version, self.sampler.version)
+        if version == self.version:
+            return
+        self.version = version
+        store = self.store
+        for node, connection in enumerate(self.connections):
+            start, stop = store.indptr[self.bounds[node]], store.indptr[self.bounds[node + 1]]
+            send(connection, STORE, [store.indptr, store.features[start:stop], store.weights[start:stop],
+                                     store.vecs[start:stop], self.sampler.added_keys])
+
+    def train_clients(self, lr, server_model, clients):
+        """
+        Synchronous round over the nodes of the selected clients.
+        :param lr: learning rate
+        :param server_model: server model
+        :param clients: selected clients
+        :return: server feature vectors update, server feature bias update
+        """
+        self.sync()
+        rows = np.sort(np.array([c.model.row for c in clients], dtype=np.int64))
+        node_bounds = np.searchsorted(rows, self.bounds)
+        active = [node for node in range(len(self.connections)) if node_bounds[node + 1] > node_bounds[node]]
+        sent = received = 0
+
+        for node in active:
+            sent += send(self.connections[node], ROUND,
+                         [np.array([lr]), rows[node_bounds[node]:node_bounds[node + 1]]])
+        # batched pull: one message with the vectors of all the features of the node clients
+        for node in active:
+            _, (features,), n_bytes = receive(self.connections[node])
+            received += n_bytes
+            sent += send(self.connections[node], MODEL,
+                         [server_model.feature_vecs[features], server_model.feature_bias[features]])
+
+        feature_vecs_update = np.zeros_like(server_model.feature_vecs)
+        feature_bias_update = np.zeros_like(server_model.feature_bias)
+        for node in active:
+            _, (features, vecs_update, bias_update, (samples, skipped_samples, seconds)), n_bytes = \
+                receive(self.connections[node])
+            received += n_bytes
+            feature_vecs_update[features] += vecs_update
+            feature_bias_update[features] += bias_update
+            self.record(seconds, node_bounds[node + 1] - node_bounds[node], int(samples), int(skipped_samples))
+
+        self.count(sent, received)
+        return feature_vecs_update, feature_bias_update
+
+    def collect(self):
+        """ copy the client embeddings of the nodes in the server store, for evaluation """
+        for node, connection in enumerate(self.connections):
+            send(connection, COLLECT, [])
+            _, (vecs,), _ = receive(connection)
+            self.store.vecs[self.store.indptr[self.bounds[node]]:self.store.indptr[self.bounds[node + 1]]] = vecs
+
+    def close(self):
+        """ stop the nodes """
+        for connection in self.connections:
+            send(connection, STOP, [])
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+
+
+def run_node(address, node, start, stop, item_features_mask, store, model_shape, dtype, sampler, upc, communication,
+             wire, random_seed):
+    """
+    Client node: serves the rounds of the clients in rows [start, stop) until the server stops it.
+    """
+    np.random.seed(random_seed)
+    connection = socket.create_connection(address)
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    send(connection, HELLO, [np.array([node], dtype=np.int64)])
+
+    engine = RoundEngine(item_features_mask, store, communication, dtype)
+    # local copy of the server model, only the pulled features are up to date
+    server_model = SimpleNamespace(feature_vecs=np.zeros(model_shape, dtype=dtype),
+                                   feature_bias=np.zeros(model_shape[0], dtype=dtype))
+    n_positive = np.diff(sampler.indptr)
+
+    while True:
+        kind, arrays, _ = receive(connection)
+        if kind == STOP:
+            break
+        if kind == COLLECT:
+            send(connection, EMBEDDINGS, [store.vecs[store.indptr[start]:store.indptr[stop]]])
+            continue
+        if kind == STORE:
+            # clients of the node rewritten by the server, residuals follow their (client, feature) pairs
+            indptr, features, weights, vecs, added_keys = arrays
+            previous_indptr, previous_features = store.indptr, store.features
+            store.indptr = indptr
+            for name, values in (('features', features), ('weights', weights), ('vecs', vecs)):
+                array = np.zeros((indptr[-1],) + values.shape[1:], dtype=values.dtype)
+                array[indptr[start]:indptr[stop]] = values
+                setattr(store, name, array)
+            if communication is not None:
+                communication.remap(previous_indptr, previous_features, store.indptr, store.features)
+            sampler.added_keys = added_keys
+            continue
+
+        start_round = time.perf_counter()
+        lr, rows = float(arrays[0][0]), arrays[1]
+        owner, slots = store.slots(rows)
+        features = store.features[slots]
+        pulled = np.unique(features)
+        send(connection, PULL, [pulled.astype(np.int32)])
+        _, (vecs, bias), _ = receive(connection)
+        server_model.feature_vecs[pulled] = vecs
+        server_model.feature_bias[pulled] = bias
+
+        n_samples = np.full(len(rows), upc) if upc else n_positive[rows]
+        sample_owner = np.repeat(np.arange(len(rows)), n_samples)
+        positive = sampler.positive(rows[sample_owner])
+        negative = sampler.negative(rows[sample_owner])
+        kept = negative >= 0
+        sample_owner, positive, negative = sample_owner[kept], positive[kept], negative[kept]
+
+        vecs_update, touched, feature_vecs_update, feature_bias_update = engine.train_sparse(
+            lr, server_model, owner, features, store.weights[slots], store.vecs[slots].astype(vecs.dtype),
+            sample_owner, positive, negative, slots)
+        store.vecs[slots] += vecs_update
+        # sample counters and seconds of the round of the node
+        node_counters = np.array([engine.samples, engine.skipped_samples, time.perf_counter() - start_round])
+        engine.samples = engine.skipped_samples = 0
+        send(connection, PUSH, [touched.astype(np.int32), feature_vecs_update.astype(wire),
+                                feature_bias_update.astype(wire), node_counters])
+    connection.close()
@@ -1,126 +1,61 @@
-import os
-import time
+import hashlib
 import math
-import random
+import os
 import numpy as np
-from itertools import islice
-from operator import itemgetter
-from collections import OrderedDict, Counter
+from collections import OrderedDict
 import pandas as pd
-# from modules.auxiliar import TextColor, import_as_tsv
-from multiprocessing import Process, Queue, cpu_count
+from scipy.sparse import csr_matrix
+from multiprocessing import Pool
 import multiprocessing
 
+from .ItemFeatures import ItemFeatures
+from .Sampler import Sampler
+from .SharedMemory import share, attach, balanced_chunks
+
 from sys import platform
 if platform == 'darwin':
     multiprocessing.set_start_method("fork")
 
 
 class UserFeatureMapper:
-    def __init__(self, data, item_features_dict, predicate_mapping: pd.DataFrame, random_seed=42):
+    def __init__(self, data, item_features: ItemFeatures, predicate_mapping: pd.DataFrame, random_seed=42):
         np.random.seed(random_seed)
+        self.random_seed = random_seed
+        # orders of the extracted features
+        self.depth = 2
 
         self.user_pos_items = data
 
         self.predicate_mapping = predicate_mapping.set_index('predicate')['predicate_order'].to_dict()
 
-        self.client_features = dict()
-        self.clients_with_feature_extracted = set()
-        self.item_features_dict = item_features_dict
+        self.item_features = item_features
+        self.feature_depth = np.array([self.predicate_mapping.get(p, 0) for p in item_features.predicates.tolist()],
+                                      dtype=np.int64)[item_features.feature_predicate]
 
-    def build_item_features_dict(self):
+        # extracted features: for the client in position c, features[indptr[c]:indptr[c + 1]] with their gains
+        self.clients = []
+        self.client_rows = dict()
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.features = np.zeros(0, dtype=np.int64)
+        self.gains = np.zeros(0)
+
+    def positives(self, clients):
         """
-        For each item builds its features reading predicates and objects from the item_features dataset
-        :return: dict {key = item_id : value = item features}
+        Positive items of the given clients.
+        :return: indptr over the clients and positive items
         """
-        return {item: set(map(tuple,
-                              self.item_features[self.item_features.itemId == self.item_ids[item]]
-                              [['predicate', 'object']].values))
-                for item in self.item_ids}
+        indptr = np.zeros(len(clients) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(self.user_pos_items[c]) for c in clients])
+        items = np.fromiter((i for c in clients for i in self.user_pos_items[c]), dtype=np.int64, count=indptr[-1])
+        return indptr, items
 
-    def feature_counter(self, client, depth, neg_item_method='list'):
+    def feature_counter(self, clients):
         """
-
-        :param client:
-        :param depth:
-        :param neg_item_method:
-        :return:
+        Count the features of the positive items and of as many sampled negative items of each client.
+        :param clients: list of clients
+        :return: (clients x features) positive and negative counts, number of positive items of each client
         """
-
-        def pick_negative_uniform(positive):
-            """
-            Pick a negative item for each positive item.
-            Every negative item in the training set is picked with the same probability
-            :param positive: list of client positive items
-            :return: set of picked negative items
-            """
-
-            items = set(self.item_features_dict)
-            picked_negative = set()
-
-            for _ in positive:
-                negative = random.choice(items)
-                while negative in neg_items or negative in positive:
-                    negative = random.choice(items)
-                picked_negative.add(negative)
-
-            return neg_items
-
-        def pick_negative_with_popularity(positive):
-            """
-            Pick a negative item for each positive item.
-            Popular items have more chances to be picked.
-            :param positive: list of client positive items
-            :return: set of picked negative items
-            """
-            picked_negative = set()
-
-            for _ in positive:
-                negative = random.choice(list(self.item_features_dict))
-                while negative in positive:
-                    negative = random.choice(list(self.item_features_dict))
-                picked_negative.add(negative)
-
-            return picked_negative
-
-        def count_features(positive, negative, feature_depth):
-            """
-            Given a list of positive and negative items retrieves all them features and then counts them.
-            :param feature_depth: depth of the features
-            :param positive: list positive items
-            :param negative: list of negative items
-            :return:
-            """
-
-            pos_to_add = []
-            for i in positive:
-                pos_to_add += list(
-                    set(filter(lambda x: self.predicate_mapping[x[0]] == feature_depth, self.item_features_dict[i])))
-            pos_counter = Counter(pos_to_add)
-
-            neg_to_add = []
-            for i in negative:
-                neg_to_add += list(
-                    set(filter(lambda x: self.predicate_mapping[x[0]] == feature_depth, self.item_features_dict[i])))
-            neg_counter = Counter(neg_to_add)
-
-            return pos_counter, neg_counter
-
-        positive_items = self.user_pos_items[client]
-        # NEG ITEMS SELECTION
-        if neg_item_method == 'set':
-            neg_items = pick_negative_uniform(positive_items)
-        elif neg_item_method == 'list':
-            neg_items = pick_negative_with_popularity(positive_items)
-        else:
-            neg_items = pick_negative_with_popularity(positive_items)
-
-        counters = dict()
-        for d in range(depth):
-            pos_c, neg_c = count_features(positive_items, neg_items, d + 1)
-            counters[d + 1] = (pos_c, neg_c, len(positive_items))
-
-        return counters
+        return feature_counter(self.item_features.matrix.astype(np.float64), *self.positives(clients))
 
     @staticmethod
     def features_entropy(pos_counter, neg_counter, counter):
@@ -128,132 +63,104 @@ class UserFeatureMapper:
         :param pos_counter: number of times in which feature is true and target is true
         :param neg_counter: number of times in which feature is true and target is false
         :param counter: number of items from which feaures have been extracted
-        :return: dictionary feature: entropy with descending order by entropy
+        :return: information gain of each feature
         """
 
         def relative_gain(partial, total):
-            if total == 0:
-                return 0
-            ratio = partial / total
-            if ratio == 0:
-                return 0
-            return - ratio * np.log2(ratio)
+            ratio = np.divide(partial, total, out=np.zeros(len(partial)), where=total != 0)
+            return - ratio * np.log2(ratio, out=np.zeros(len(ratio)), where=ratio != 0)
 
-        def info_gain(pos_c, neg_c, n_items):
+        den_1 = pos_counter + neg_counter
+        h_pos = relative_gain(pos_counter, den_1) + relative_gain(neg_counter, den_1)
+        den_2 = 2 * counter - (pos_counter + neg_counter)
 
-            den_1 = pos_c + neg_c
-            h_pos = relative_gain(pos_c, den_1) + relative_gain(neg_c, den_1)
-            den_2 = 2 * n_items - (pos_c + neg_c)
+        num_1 = counter - pos_counter
+        num_2 = counter - neg_counter
+        h_neg = relative_gain(num_1, den_2) + relative_gain(num_2, den_2)
 
-            num_1 = n_items - pos_c
-            num_2 = n_items - neg_c
-            h_neg = relative_gain(num_1, den_2) + relative_gain(num_2, den_2)
+        return 1 - den_1 / (den_1 + den_2) * h_pos - den_2 / (den_1 + den_2) * h_neg
 
-            return 1 - den_1 / (den_1 + den_2) * h_pos - den_2 / (den_1 + den_2) * h_neg
-
-        attribute_entropies = dict()
-        for positive_feature in pos_counter:
-            ig = info_gain(pos_counter[positive_feature], neg_counter[positive_feature], counter)
-            if ig > 0:
-                attribute_entropies[positive_feature] = ig
-
-        return OrderedDict(sorted(attribute_entropies.items(), key=itemgetter(1), reverse=True))
-
-    def limited_second_order_selection(self, client, limit_first, limit_second, neg_item_method='list'):
+    def limited_second_order_selection(self, clients, limit_first, limit_second):
+        """
+        First and second order features of the given clients, weighted by information gain.
+        Features of each order are reduced to the top ones by information gain (limit -1: all, 0: none).
+        :param clients: list of clients
+        :param limit_first: number of first order features of each client
+        :param limit_second: number of second order features of each client
+        :return: indptr over the clients, feature codes and information gains, by decreasing gain for each client
+        """
+        return select_features(*self.feature_counter(clients), self.feature_depth, limit_first, limit_second)
 
-        # positive and negative counters
-        counters = self.feature_counter(client, 2, neg_item_method)
+    def second_order_selection(self, clients):
+        return self.limited_second_order_selection(clients, -1, -1)
 
-        # 1st-order-features
-        pos_1, neg_1, counter_1 = counters[1]
-        # 2nd-order-features
-        pos_2, neg_2, counter_2 = counters[2]
+    def fingerprint(self, clients, positives_indptr, positives_items, n_chunks):
+        """
+        Content address of an extraction: it only depends on the clients and their positive items, on the item
+        features, on the random seed, on the feature depth and on the number of chunks (each chunk has its own seed).
+        :return: hex digest
+        """
+        digest = hashlib.sha1()
+        for array in (np.asarray(clients), positives_indptr, positives_items,
+                      self.item_features.matrix.indptr, self.item_features.matrix.indices,
+                      self.item_features.feature_predicate, self.item_features.feature_object, self.feature_depth):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        digest.update(repr((self.item_features.predicates.tolist(), self.item_features.objects.tolist(),
+                            int(self.random_seed), self.depth, n_chunks)).encode())
+        return digest.hexdigest()
+
+    def compute_and_export_features(self, clients: list, parallel, first_order_limit, second_order_limit,
+                                    cache_dir=None):
+        """
+        Extract the features of the given clients with a pool of processes.
+        Item features are placed in shared memory once and clients are handed out in chunks of similar total
+        profile size; every chunk comes back as compact arrays.
+        With a cache directory, the full rankings (no limits) are stored on disk under the fingerprint of the
+        extraction and every later extraction of the same data is a load followed by a truncation to the limits.
+        :param clients: list of clients
+        :param parallel: number of processes
+        :param first_order_limit: number of first order features of each client
+        :param second_order_limit: number of second order features of each client
+        :param cache_dir: directory of the cached extractions, None to disable the cache
+        """
+        positives_indptr, positives_items = self.positives(clients)
+        bounds = balanced_chunks(np.diff(positives_indptr), max(parallel, 1) * 4)
+        random_seed = np.random.randint(0, 2 ** 31 - 1, len(bounds) - 1)
 
-        if limit_first == -1 and limit_second == -1:
-            pos_f = pos_1 + pos_2
-            neg_f = neg_1 + neg_2
+        if cache_dir is None:
+            indptr, features, gains = self.extract(clients, parallel, positives_indptr, positives_items, bounds,
+                                                   random_seed, first_order_limit, second_order_limit)
         else:
-            if limit_first == -1:
-                if limit_second != 0:
-                    entropies_2 = self.features_entropy(pos_2, neg_2, counter_2)
-                    # top 2nd-order-features ordered by entropy
-                    entropies_2_red = OrderedDict(islice(entropies_2.items(), limit_second))
-                    # filtering pos and neg features respect to the 'top limit' selected
-                    pos_2_red = Counter({k: pos_2[k] for k in entropies_2_red.keys()})
-                    neg_2_red = Counter({k: neg_2[k] for k in entropies_2_red.keys()})
-                else:
-                    pos_2_red = Counter()
-                    neg_2_red = Counter()
-
-                # final features: 1st-order-f + top 2nd-order-f
-                pos_f = pos_1 + pos_2_red
-                neg_f = neg_1 + neg_2_red
-            elif limit_second == -1:
-                if limit_first != 0:
-                    entropies_1 = self.features_entropy(pos_1, neg_1, counter_1)
-
-                    # top 1st-order-features ordered by entropy
-                    entropies_1_red = OrderedDict(islice(entropies_1.items(), limit_second))
-                    # filtering pos and neg features respect to the 'top limit' selected
-                    pos_1_red = Counter({k: pos_1[k] for k in entropies_1_red.keys()})
-                    neg_1_red = Counter({k: neg_1[k] for k in entropies_1_red.keys()})
-                else:
-                    pos_1_red = Counter()
-                    neg_1_red = Counter()
-
-                # final features: top 1st-order-f + 2nd-order-f
-                pos_f = pos_1_red + pos_2
-                neg_f = neg_1_red + neg_2
+            path = os.path.join(cache_dir, 'ufm_' + self.fingerprint(clients, positives_indptr, positives_items,
+                                                                     len(bounds) - 1) + '.npz')
+            if os.path.exists(path):
+                print(f'loading cached features of {len(clients)} clients from {path}')
+                with np.load(path) as cached:
+                    indptr, features, gains = cached['indptr'], cached['features'], cached['gains']
             else:
-                if limit_first != 0:
-                    entropies_1 = self.features_entropy(pos_1, neg_1, counter_1)
-
-                    # top 10 1st-order-features ordered by entropy
-                    entropies_1_red = OrderedDict(islice(entropies_1.items(), limit_first))
-                    # filtering pos and neg features respect to the 'top limit' selected
-                    pos_1_red = Counter({k: pos_1[k] for k in entropies_1_red.keys()})
-                    neg_1_red = Counter({k: neg_1[k] for k in entropies_1_red.keys()})
-                else:
-                    pos_1_red = Counter()
-                    neg_1_red = Counter()
-
-                if limit_second != 0:
-                    entropies_2 = self.features_entropy(pos_2, neg_2, counter_2)
-
-                    # top 10 2nd-order-features ordered by entropy
-                    entropies_2_red = OrderedDict(islice(entropies_2.items(), limit_second))
-                    # filtering pos and neg features respect to the 'top limit' selected
-                    pos_2_red = Counter({k: pos_2[k] for k in entropies_2_red.keys()})
-                    neg_2_red = Counter({k: neg_2[k] for k in entropies_2_red.keys()})
-                else:
-                    pos_2_red = Counter()
-                    neg_2_red = Counter()
-
-                # final features: top 1st-order-f + top 2nd-order-f
-                pos_f = pos_1_red + pos_2_red
-                neg_f = neg_1_red + neg_2_red
-
-        return self.features_entropy(pos_f, neg_f, counter_2)
-
-    def second_order_selection(self, client, neg_item_method='list'):
-
-        # positive and negative counters
-        counters = self.feature_counter(client, 2, neg_item_method)
-
-        # 1st-order-features
-        pos_1, neg_1, counter_1 = counters[1]
-        # 2nd-order-features
-        pos_2, neg_2, counter_2 = counters[2]
-
-        # final features: 1st-order-f + top 10 2nd-order-f
-        pos_f = pos_1 + pos_2
-        neg_f = neg_1 + neg_2
-
-        return self.features_entropy(pos_f, neg_f, counter_2)
-
-    def compute_and_export_features(self, clients: list, parallel, first_order_limit, second_order_limit):
+                indptr, features, gains = self.extract(clients, parallel, positives_indptr, positives_items, bounds,
+                                                       random_seed, -1, -1)
+                os.makedirs(cache_dir, exist_ok=True)
+                # written aside and renamed, concurrent trials never read a partial file
+                partial = f'{path}.{os.getpid()}.tmp'
+                with open(partial, 'wb') as file:
+                    np.savez(file, indptr=indptr, features=features, gains=gains)
+                os.replace(partial, path)
+            indptr, features, gains = truncate_features(indptr, features, gains, self.feature_depth,
+                                                        first_order_limit, second_order_limit)
+
+        self.clients = list(clients)
+        self.client_rows = {c: row for row, c in enumerate(self.clients)}
+        self.indptr, self.features, self.gains = indptr, features, gains
+
+    def extract(self, clients, parallel, positives_indptr, positives_items, bounds, random_seed,
+                first_order_limit, second_order_limit):
+        """
+        Extract the features of the given chunks of clients.
+        :return: indptr over the clients, feature codes and information gains, by decreasing gain for each client
+        """
 
-        def status_message(done: int, running: int):
+        def status_message(done: int):
             max_l = 25
             goal = len(clients)
             status = math.floor(done / goal * max_l)
@@ -265,159 +172,141 @@ class UserFeatureMapper:
                 print(f'✓ DONE: extracted features of {goal} clients\n')
             else:
                 print('\rProgress:' + '|=' + '=' * status + '=>' + '-' * missing + '|' +
-                      f' [{done}/{goal} clients] - {running}/{parallel} processes running', end='')
-
-        # num of parallel processes
-        n_processes = parallel
-        print(f'{n_processes} process')
-
-        # create input chunks
-        def split_in_chunks(l: list, n: int):
-            """
-            Split a list in a finite number of chunks.
-            :param l: list to split
-            :param n: number of chunks
-            :return: a list of lists
-            """
-
-            list_l = len(l)
-            residual = list_l % n
-            chunk_size = int((list_l - residual) / n)
-            chunks = [l[i: i + chunk_size] for i in range(0, list_l - residual, chunk_size)]
-            chunks[0] += l[n * chunk_size:]
-            return chunks
-
-        chunks = split_in_chunks(clients, n_processes)
-
-        processes = dict()
-        output_q = Queue()
-
-        # processes execution control
-        active_processes = set()
-        ended_processes = set()
-        job_done_processes = set()
-
-        # random seed for processes
-        random_seed = np.random.randint(0, 100, n_processes)
-
-        # set and run processes
-        for pid in range(n_processes):
-            signal_input_q = Queue()
-            signal_output_q = Queue()
-            # set process
-            process = Process(
-                target=self.compute_top_feature_worker,
-                args=(chunks[pid],
-                      signal_input_q,
-                      signal_output_q,
-                      output_q,
-                      first_order_limit,
-                      second_order_limit,
-                      random_seed[pid]
-                      )
-            )
-            processes[pid] = {'process': process,
-                              'sig_i': signal_input_q, 'sig_o': signal_output_q,
-                              'last': chunks[pid][-1]}
-
-            # run process
-            process.start()
-
-        # init state: wait for processes to be ready
-        while True:
-
-            # round robin processes listening
-            for pid in processes:
-                queue: Queue = processes[pid]['sig_o']
-
-                if queue.empty() is False:
-                    message = queue.get()
-
-                    # process is ready to start its job
-                    if message == 'ready':
-                        active_processes.add(pid)
-
-            # if all processes are ready
-            if len(active_processes) == n_processes:
-                for pid in processes:
-                    processes[pid]['sig_i'].put('start')
-                break
-
-        # running state: elaborate processes output
-        while True:
-
-            if output_q.empty() is False:
-                # NEW CLIENT FEATURE
-                p_output = output_q.get()
-                self.client_features[p_output[0]] = p_output[1]
-                self.clients_with_feature_extracted.add(p_output[0])
-
-                for pid in processes:
-                    if p_output[0] == processes[pid]['last']:
-                        job_done_processes.add(pid)
-
-            for pid in job_done_processes:
-                if processes[pid]['sig_o'].empty() is False:
-                    message = processes[pid]['sig_o'].get()
-                    if message == 'done':
-                        # print('done' + str(pid) + '\n')
-                        active_processes.remove(pid)
-                        # job_done_processes.remove(pid)
-                        ended_processes.add(pid)
-
-            # progress bar
-            status_message(len(self.client_features), len(active_processes))
-
-            # no more active processes, all job were done
-            if len(active_processes) == 0:
-                status_message(len(self.client_features), len(active_processes))
-                # print('FINITO')
-                break
-
-        # end state: killing processes
-        for pid in processes:
-            processes[pid]['sig_i'].put('kill')
-
-        time.sleep(1)
-
-    def compute_top_feature_worker(self, client_list: list,
-                                   signal_input: Queue, signal_output: Queue, output_q: Queue,
-                                   first_order_limit, second_order_limit, random_seed):
-
-        random.seed(random_seed)
-
-        signal_output.put('ready')
-
-        # init state
-        while True:
-            # look for new input
-            if signal_input.empty() is False:
-                message = signal_input.get()
-
-                if message == 'start':
-                    break
-
-        # working state
-        for client in client_list:
-            features = self.limited_second_order_selection(client, first_order_limit, second_order_limit)
-            output_q.put((client, features))
-
-        signal_output.put('done')
-
-        # job done state
-        while True:
-            time.sleep(1)
-            # look for kill signal
-            if signal_input.empty() is False:
-                message = signal_input.get()
-                if message == 'kill':
-                    break
+                      f' [{done}/{goal} clients] - {parallel} processes', end='')
+
+        print(f'{parallel} process')
+
+        tasks = [(positives_indptr[start:stop + 1] - positives_indptr[start],
+                  positives_items[positives_indptr[start]:positives_indptr[stop]],
+                  first_order_limit, second_order_limit, random_seed[chunk])
+                 for chunk, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+        matrix = self.item_features.matrix.astype(np.float64)
+        shared = {'data': share(matrix.data), 'indices': share(matrix.indices), 'indptr': share(matrix.indptr),
+                  'feature_depth': share(self.feature_depth)}
+
+        results = []
+        if parallel > 1:
+            with Pool(parallel, initializer=attach_worker, initargs=(shared, matrix.shape)) as pool:
+                for result in pool.imap(extract_chunk, tasks):
+                    results.append(result)
+                    status_message(sum(len(r[0]) - 1 for r in results))
+        else:
+            attach_worker(shared, matrix.shape)
+            for task in tasks:
+                results.append(extract_chunk(task))
+                status_message(sum(len(r[0]) - 1 for r in results))
+
+        lengths = np.concatenate([np.diff(r[0]) for r in results]) if results else np.zeros(0, dtype=np.int64)
+        indptr = np.zeros(len(clients) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(lengths)
+        features = np.concatenate([r[1] for r in results]) if results else np.zeros(0, dtype=np.int64)
+        gains = np.concatenate([r[2] for r in results]) if results else np.zeros(0)
+        return indptr, features, gains
 
     def __getitem__(self, item):
         try:
-            return self.client_features[item]
+            row = self.client_rows[item]
         except KeyError as e:
             print(f"You asked the features of client {item}, but its features have not been extracted.")
+            return None
+        item_features = self.item_features.features
+        return OrderedDict(zip([item_features[f] for f in self.features[self.indptr[row]:self.indptr[row + 1]]],
+                               self.gains[self.indptr[row]:self.indptr[row + 1]].tolist()))
 
     def __iter__(self):
-        return iter(self.client_features.items())
+        return ((c, self[c]) for c in self.clients)
+
+
+def feature_counter(item_features, positives_indptr, positives_items):
+    """
+    Positive and negative feature counts of a chunk of clients.
+    :param item_features: (items x features) csr matrix
+    :param positives_indptr: indptr of the positive items of each client
+    :param positives_items: positive items
+    :return: (clients x features) positive and negative counts, number of positive items of each client
+    """
+    n_clients = len(positives_indptr) - 1
+    n_items = item_features.shape[0]
+    sampler = Sampler(np.split(positives_items, positives_indptr[1:-1]) if n_clients else [], n_items)
+    n_positive = np.diff(sampler.indptr)
+    owner = np.repeat(np.arange(n_clients), n_positive)
+
+    # a negative item for each positive item, picked negative items are counted once
+    negative = sampler.negative(owner)
+    kept = negative >= 0
+    negative_keys = np.unique(owner[kept] * n_items + negative[kept])
+
+    positive = csr_matrix((np.ones(len(owner)), (owner, sampler.items)), shape=(n_clients, n_items))
+    negative = csr_matrix((np.ones(len(negative_keys)), (negative_keys // n_items, negative_keys % n_items)),
+                          shape=(n_clients, n_items))
+    return positive.dot(item_features), negative.dot(item_features), n_positive
+
+
+def select_features(pos, neg, n_positive, feature_depth, limit_first, limit_second):
+    """
+    Information gain of the positive features of a chunk of clients and top-limit selection for each order.
+    :return: indptr over the clients, feature codes and information gains, by decreasing gain for each client
+    """
+    pos = pos.tocoo()
+    owner, feature = pos.row.astype(np.int64), pos.col.astype(np.int64)
+
+    # negative counts of the positive features
+    neg_count = np.asarray(neg[owner, feature]).ravel()
+
+    gain = UserFeatureMapper.features_entropy(pos.data, neg_count, n_positive[owner])
+    depth = feature_depth[feature]
+    kept = (gain > 0) & (depth > 0)
+    owner, feature, gain = owner[kept], feature[kept], gain[kept]
+
+    return rank_features(owner, feature, gain, feature_depth, len(n_positive), limit_first, limit_second)
+
+
+def truncate_features(indptr, features, gains, feature_depth, limit_first, limit_second):
+    """
+    Reduce extracted features to the top ones of each order (limit -1: all, 0: none).
+    :return: indptr over the clients, feature codes and information gains, by decreasing gain for each client
+    """
+    owner = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return rank_features(owner, features, gains, feature_depth, len(indptr) - 1, limit_first, limit_second)
+
+
+def rank_features(owner, feature, gain, feature_depth, n_clients, limit_first, limit_second):
+    """
+    Top-limit selection of the features of each client and order, ties kept in their given order.
+    :return: indptr over the clients, feature codes and information gains, by decreasing gain for each client
+    """
+    depth = feature_depth[feature]
+
+    # rank of each feature among the features of the same client and order
+    order = np.lexsort((-gain, depth, owner))
+    owner, feature, gain, depth = owner[order], feature[order], gain[order], depth[order]
+    group = np.r_[True, (owner[1:] != owner[:-1]) | (depth[1:] != depth[:-1])] if len(owner) else owner.astype(bool)
+    starts = np.flatnonzero(group)
+    rank = np.arange(len(owner)) - np.repeat(starts, np.diff(np.r_[starts, len(owner)]))
+    limit = np.where(depth == 1, limit_first, limit_second)
+    kept = (limit == -1) | (rank < limit)
+    owner, feature, gain = owner[kept], feature[kept], gain[kept]
+
+    order = np.lexsort((-gain, owner))
+    indptr = np.zeros(n_clients + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(owner, minlength=n_clients))
+    return indptr, feature[order], gain[order]
+
+
+_worker = dict()
+
+
+def attach_worker(shared, shape):
+    """ pool initializer: item features are read from the shared memory blocks """
+    arrays = attach(shared)
+    _worker['item_features'] = csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=shape,
+                                          copy=False)
+    _worker['feature_depth'] = arrays['feature_depth']
+
+
+def extract_chunk(task):
+    positives_indptr, positives_items, first_order_limit, second_order_limit, random_seed = task
+    np.random.seed(random_seed)
+    return select_features(*feature_counter(_worker['item_features'], positives_indptr, positives_items),
+                           _worker['feature_depth'], first_order_limit, second_order_limit)
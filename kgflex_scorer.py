@@ -0,0 +1,193 @@
+"""
+Standalone top-k scoring of a KGFlex model exported with save_weights, without the Elliot experiment machinery.
+
+Usage:
+    python kgflex_scorer.py CHECKPOINT_FOLDER [--host 127.0.0.1] [--port 8080]
+
+HTTP front end:
+    GET  /topk?user=U&k=10&exclude=I1,I2      top-k of a user, without the excluded items
+    POST /topk {"users": [...], "k": 10, "exclude": [[...], ...]}      batched request
+    GET  /stats                               number of requests and p50/p99 latency
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# checkpoint layout written by external/models/kgflex/Checkpoint.py
+CHECKPOINT_FORMAT = 1
+
+
+class Scorer:
+    """ class Scorer: top-k items of the users of an exported KGFlex model, read through memory mapping """
+
+    def __init__(self, path, latency_window=100000):
+        """
+        :param path: checkpoint folder
+        :param latency_window: number of latest requests in the latency counters
+        """
+        with open(os.path.join(path, 'manifest.json')) as file:
+            manifest = json.load(file)
+        if manifest['format'] != CHECKPOINT_FORMAT:
+            raise ValueError(f'unsupported checkpoint format {manifest["format"]}')
+        arrays = {name[:-len('.npy')]: np.load(os.path.join(path, name), mmap_mode='r')
+                  for name in os.listdir(path) if name.endswith('.npy')}
+
+        self.feature_vecs = arrays['feature_vecs']
+        self.feature_bias = arrays['feature_bias']
+        self.indptr = arrays['indptr']
+        self.features = arrays['features']
+        self.weights = arrays['weights']
+        self.vecs = arrays['vecs']
+        # postings of every feature, the items of a user are reached through its features only
+        mask = csr_matrix((np.asarray(arrays['mask_data'], dtype=self.feature_vecs.dtype), arrays['mask_indices'],
+                           arrays['mask_indptr']), shape=tuple(manifest['mask_shape']))
+        self.postings = mask.tocsc()
+        self.n_items = mask.shape[0]
+
+        # public ids, private ids when the checkpoint has none
+        self.users = manifest.get('users', arrays['clients'].tolist())
+        self.items = manifest.get('items', list(range(self.n_items)))
+        self.user_rows = {str(u): row for row, u in enumerate(self.users)}
+        self.item_rows = {str(i): row for row, i in enumerate(self.items)}
+
+        self.latencies = deque(maxlen=latency_window)
+        self.n_requests = 0
+        self.n_users = 0
+        self.lock = threading.Lock()
+
+    def feature_scores(self, rows):
+        """
+        Weighted score of the features of the given store rows.
+        :return: owner (position in rows), feature and score of each user feature
+        """
+        lengths = self.indptr[rows + 1] - self.indptr[rows]
+        owner = np.repeat(np.arange(len(rows)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        slots = np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(self.indptr[rows], lengths)
+        features = self.features[slots]
+        scores = self.weights[slots] * ((self.vecs[slots] * self.feature_vecs[features]).sum(axis=1) +
+                                        self.feature_bias[features])
+        return owner, features, scores
+
+    def top_k(self, users, k=10, exclude=None):
+        """
+        Top-k items of a batch of users.
+        :param users: public user ids
+        :param k: number of items
+        :param exclude: list with the public ids of the items to exclude for each user
+        :return: list with the top-k public item ids and scores of each user, by decreasing score
+        """
+        start = time.perf_counter()
+        rows = np.array([self.user_rows[str(u)] for u in users], dtype=np.int64)
+        k = min(k, self.n_items)
+
+        owner, features, scores = self.feature_scores(rows)
+        unique_features, slot_feature = np.unique(features, return_inverse=True)
+        user_feature_scores = csr_matrix((scores, (slot_feature, owner)), shape=(len(unique_features), len(rows)))
+        result = (self.postings[:, unique_features] @ user_feature_scores).T.toarray()
+
+        if exclude is not None:
+            for position, items in enumerate(exclude):
+                result[position, [self.item_rows[str(i)] for i in items]] = -np.inf
+
+        unordered_top_k = np.argpartition(result, -k, axis=1)[:, -k:]
+        top_k = np.take_along_axis(unordered_top_k,
+                                   np.argsort(np.take_along_axis(result, unordered_top_k, axis=1), axis=1)[:, ::-1],
+                                   axis=1)
+        top_k_score = np.take_along_axis(result, top_k, axis=1)
+        recommendations = [([self.items[i] for i in items], item_scores.tolist())
+                           for items, item_scores in zip(top_k, top_k_score)]
+
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+            self.n_requests += 1
+            self.n_users += len(users)
+        return recommendations
+
+    def stats(self):
+        """
+        Latency counters.
+        :return: dict requests, users, p50 and p99 latency in milliseconds
+        """
+        with self.lock:
+            latencies = np.array(self.latencies)
+            stats = {'requests': self.n_requests, 'users': self.n_users}
+        stats['p50_ms'] = float(np.percentile(latencies, 50) * 1000) if len(latencies) else 0.0
+        stats['p99_ms'] = float(np.percentile(latencies, 99) * 1000) if len(latencies) else 0.0
+        return stats
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def handler(scorer):
+    """ request handler class serving the given scorer """
+
+    class ScorerHandler(BaseHTTPRequestHandler):
+
+        def reply(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def answer(self, users, k, exclude):
+            try:
+                recommendations = scorer.top_k(users, k, exclude)
+            except KeyError as e:
+                return self.reply(404, {'error': f'unknown id {e}'})
+            self.reply(200, {'results': [{'user': u, 'items': items, 'scores': scores}
+                                         for u, (items, scores) in zip(users, recommendations)]})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == '/stats':
+                return self.reply(200, scorer.stats())
+            if url.path != '/topk' or 'user' not in query:
+                return self.reply(404, {'error': 'use /topk?user=U&k=K&exclude=I1,I2 or /stats'})
+            exclude = query['exclude'][0].split(',') if 'exclude' in query else []
+            self.answer([query['user'][0]], int(query.get('k', ['10'])[0]), [exclude])
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/topk':
+                return self.reply(404, {'error': 'use POST /topk'})
+            request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            self.answer(request['users'], int(request.get('k', 10)), request.get('exclude'))
+
+        def log_message(self, *args):
+            pass
+
+    return ScorerHandler
+
+
+def serve(scorer, host='127.0.0.1', port=8080):
+    """
+    HTTP front end of the scorer.
+    :return: server, call serve_forever to start it
+    """
+    return ThreadingHTTPServer((host, port), handler(scorer))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='KGFlex top-k scoring service')
+    parser.add_argument('checkpoint', help='folder of a KGFlex checkpoint')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args()
+
+    server = serve(Scorer(args.checkpoint), args.host, args.port)
+    print(f'serving {args.checkpoint} on http://{args.host}:{server.server_address[1]}')
+    server.serve_forever()
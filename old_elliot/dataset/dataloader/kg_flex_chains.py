@@ -92,6 +92,9 @@ class KGFlexLoader:
                                                                                                  predicates_path,
                                                                                                  features_path)
 
+            self.side_information_data.graph = self.load_graph(
+                getattr(config.data_config.side_information, "graph", None))
+
             self.train_dataframe = self.check_timestamp(self.train_dataframe)
 
             self.logger.info(f"{path_train_data} - Loaded")
@@ -132,6 +135,8 @@ class KGFlexLoader:
             self.dataframe, self.side_information_data.feature_map, self.side_information_data.predicate_mapping = self.load_dataset_dataframe(path_dataset,
                                                                                                  predicates_path,
                                                                                                  features_path)
+            self.side_information_data.graph = self.load_graph(
+                getattr(config.data_config.side_information, "graph", None))
             self.dataframe = self.check_timestamp(self.dataframe)
 
             self.logger.info(('{0} - Loaded'.format(path_dataset)))
@@ -227,6 +232,12 @@ class KGFlexLoader:
 
         return dataset, item_features, predicate_mapping
 
+    def load_graph(self, graph_path):
+        # knowledge graph triples after the first hop of the items, expanded by KGFlex with kg_depth above 2
+        if graph_path is None:
+            return None
+        return self.import_as_tsv(graph_path, names=['subject', 'predicate', 'object'], data_name='knowledge graph')
+
     def import_as_tsv(self, path: str, names=None, index: str = None, data_name: str = ''):
         if names is None:
             names = ['userId', 'itemId', 'rating', 'timestamp']
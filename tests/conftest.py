@@ -0,0 +1,46 @@
+"""
+KGFlex models of the tests: the Elliot data object of the KGFlex loader, built on a small synthetic dataset.
+"""
+import os
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_dataset
+from old_elliot.dataset.dataloader.kg_flex_chains import KGFlexDataObject
+from external.models.kgflex.KGFlex import KGFlex
+
+
+@pytest.fixture(scope='session')
+def dataset():
+    return make_dataset(60, 120, 30, 200, seed=7)
+
+
+@pytest.fixture
+def kgflex(dataset, tmp_path):
+    """
+    Factory of KGFlex models of the dataset, computed in float64 so that different engines can be compared.
+    Every model of a test writes in the same output folders, so that a model saved by one is restored by another.
+    :return: function of the KGFlex parameters (meta parameters in a dict) returning the model
+    """
+    train = pd.DataFrame([(u, i, 1.0) for u, items in dataset['i_train'].items() for i in items],
+                         columns=['userId', 'itemId', 'rating'])
+    test = pd.DataFrame([(u, i, 1.0) for u, items in dataset['i_test'].items() for i in items],
+                        columns=['userId', 'itemId', 'rating'])
+    evaluation = SimpleNamespace(cutoffs=[10], simple_metrics=['nDCG'], relevance_threshold=0, paired_ttest=False)
+    config = SimpleNamespace(config_test=True, top_k=10, evaluation=evaluation,
+                             path_output_rec_weight=os.path.join(str(tmp_path), 'weights', ''),
+                             path_output_rec_performance=os.path.join(str(tmp_path), 'performance', ''),
+                             path_output_rec_result=os.path.join(str(tmp_path), 'recs', ''))
+
+    def build(meta=None, **params):
+        side_information = SimpleNamespace(feature_map=dataset['feature_map'].copy(),
+                                           predicate_mapping=dataset['predicate_mapping'].copy())
+        data = KGFlexDataObject(config, (train, test), side_information)
+        parameters = dict(epochs=3, q=0.5, lr=0.1, embedding=4, parallel_ufm=1, ufm_cache=False, dtype='float64',
+                          seed=7)
+        parameters.update(params)
+        return KGFlex(data, config, SimpleNamespace(meta=SimpleNamespace(**(meta or {})), **parameters))
+
+    return build
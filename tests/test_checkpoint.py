@@ -0,0 +1,20 @@
+"""
+Checkpoints of KGFlex: a restored model recommends as the saved one, and its users keep receiving interactions.
+"""
+import numpy as np
+
+
+def test_restore_and_add_interactions(kgflex, dataset):
+    saved = kgflex(meta={'save_weights': True}, epochs=1)
+    saved.train()
+    restored = kgflex(meta={'restore': True}, epochs=1)
+    restored.train()
+    user = 3
+    np.testing.assert_allclose([s for _, s in restored.recommend(user)], [s for _, s in saved.recommend(user)])
+
+    # enough new items to select the features of the user again, in the arrays read from the checkpoint
+    items = [i for i in dataset['private_items'].values() if i not in dataset['i_train'][user]][:40]
+    assert restored.add_interactions(user, items)['pending']
+    assert restored.refresh_users() == 1
+    recommended = [i for i, _ in restored.recommend(user)]
+    assert not set(recommended) & set(items)
@@ -0,0 +1,56 @@
+"""
+The sparse gradient kernel of Client.train against the dense per-client BPR step it replaces, on fixed samples.
+"""
+import numpy as np
+
+
+def dense_step(lr, mask, features, weights, user_vecs, server_model, positive, negative):
+    """
+    BPR step of the original Client.train, on dense arrays over every model feature.
+    :return: updated user vectors, feature vectors update and feature bias update
+    """
+    n_features = mask.shape[1]
+    index_mask = np.zeros(n_features, dtype=bool)
+    index_mask[features] = True
+    user_weights = np.zeros(n_features)
+    user_weights[features] = weights
+    uv_ = np.zeros((n_features, user_vecs.shape[1]))
+    uv_[features] = user_vecs
+    user_item_features_mask = mask * index_mask
+
+    weighted_features = user_weights * ((uv_ * server_model.feature_vecs).sum(axis=1) + server_model.feature_bias)
+    x_p = user_item_features_mask[positive].dot(weighted_features)
+    x_n = user_item_features_mask[negative].dot(weighted_features)
+
+    # remove items with no prediction (no common features)
+    kept = (x_p != 0) & (x_n != 0)
+    d_loss = 1 / (1 + np.exp(x_p[kept] - x_n[kept]))
+    pos_masked_weights = user_item_features_mask[positive[kept]] * user_weights
+    neg_masked_weights = user_item_features_mask[negative[kept]] * user_weights
+    d_loss_masked_weights = d_loss.dot(pos_masked_weights) - d_loss.dot(neg_masked_weights)
+
+    return uv_ + lr * d_loss_masked_weights[:, None] * server_model.feature_vecs, \
+        lr * d_loss_masked_weights[:, None] * uv_, lr * d_loss_masked_weights
+
+
+def test_sparse_kernel(kgflex, monkeypatch):
+    model = kgflex()
+    mask = model.item_features_mask.toarray()
+    rs = np.random.RandomState(0)
+    for client in model.clients[:20]:
+        unrated = np.setdiff1d(np.arange(mask.shape[0]), client.pos_items)
+        positive = rs.choice(client.pos_items, 30)
+        negative = rs.choice(unrated, 30)
+        monkeypatch.setattr(client, 'sample', lambda: (positive, negative))
+        features = client.model.features.copy()
+        expected_vecs, expected_vecs_update, expected_bias_update = dense_step(
+            0.1, mask, features, client.model.user_weights, client.model.user_vecs, model.server_model, positive,
+            negative)
+
+        touched, vecs_update, bias_update = client.train(0.1, model.server_model)
+        np.testing.assert_allclose(client.model.user_vecs, expected_vecs[features], rtol=0, atol=1e-15)
+        np.testing.assert_allclose(vecs_update, expected_vecs_update[touched], rtol=0, atol=1e-15)
+        np.testing.assert_allclose(bias_update, expected_bias_update[touched], rtol=0, atol=1e-15)
+        # features left out of the updates have no gradient
+        untouched = np.setdiff1d(np.arange(mask.shape[1]), touched)
+        assert not expected_bias_update[untouched].any()
@@ -0,0 +1,23 @@
+"""
+Equivalence of the KGFlex predictors: the inverted feature index recommends the items of the block predictor.
+"""
+import numpy as np
+
+
+def recommendations(kgflex, predictor):
+    # models draw from the global random state, each one is trained right after it is built
+    model = kgflex(predictor=predictor)
+    model.train()
+    return model.get_recommendations(10)[1]
+
+
+def test_index_predictor(kgflex):
+    block_recs, index_recs = recommendations(kgflex, 'block'), recommendations(kgflex, 'index')
+    assert block_recs.keys() == index_recs.keys()
+    for user in block_recs:
+        block_scores = np.array([s for _, s in block_recs[user]])
+        np.testing.assert_allclose([s for _, s in index_recs[user]], block_scores, atol=1e-12)
+        # items tied with the last one may be any of them
+        last = block_scores[-1]
+        assert {i for i, s in index_recs[user] if s > last + 1e-12} == \
+               {i for i, s in block_recs[user] if s > last + 1e-12}
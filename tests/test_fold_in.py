@@ -0,0 +1,17 @@
+"""
+Fold-in of new users in a trained KGFlex model.
+"""
+import pytest
+
+
+def test_fold_in(kgflex, dataset):
+    model = kgflex()
+    model.train()
+    items = list(dataset['i_train'][3])
+    assert model.fold_in('new', items)['items'] == len(items)
+    assert not {i for i, _ in model.recommend('new')} & set(items)
+
+    # known users keep their store row, their new items are streamed
+    for user in (3, 'new'):
+        with pytest.raises(ValueError):
+            model.fold_in(user, items)
@@ -0,0 +1,39 @@
+"""
+Equivalence of the KGFlex round engines: trained with the same seed, the batch engine updates server and clients
+as the serial rounds of train_model do, and so do the worker processes of the parallel engine and the asynchronous
+rounds of a single group in flight.
+"""
+import numpy as np
+import pytest
+
+
+def assert_same_model(expected, actual):
+    np.testing.assert_allclose(actual.server_model.feature_vecs, expected.server_model.feature_vecs, atol=1e-12)
+    np.testing.assert_allclose(actual.server_model.feature_bias, expected.server_model.feature_bias, atol=1e-12)
+    np.testing.assert_allclose(actual.client_store.vecs, expected.client_store.vecs, atol=1e-12)
+
+
+@pytest.fixture
+def serial(kgflex):
+    model = kgflex(round_engine='serial')
+    model.train()
+    return model
+
+
+def test_batch(kgflex, serial):
+    model = kgflex(round_engine='batch')
+    model.train()
+    assert_same_model(serial, model)
+
+
+def test_parallel(kgflex, serial):
+    model = kgflex(round_engine='parallel', round_workers=2)
+    model.train()
+    assert_same_model(serial, model)
+
+
+def test_async(kgflex, serial):
+    # a single buffer of all the selected clients and no stale commit: one group in flight per round
+    model = kgflex(protocol='async', async_buffer=30, max_staleness=0, round_workers=1)
+    model.train()
+    assert_same_model(serial, model)
@@ -0,0 +1,27 @@
+"""
+Negative sampling of KGFlex: every client gets an item it has not rated, or -1 when it rated every item.
+"""
+import numpy as np
+import pytest
+
+from external.models.kgflex.Sampler import Sampler
+
+
+@pytest.mark.parametrize('method', ['uniform', 'popularity'])
+def test_negatives_not_rated(method):
+    np.random.seed(0)
+    sampler = Sampler([[0, 1], [0], [0, 1, 2, 3]], 4, method)
+    sampler.add(1, [2])
+    clients = np.repeat(np.arange(3), 200)
+    negative = sampler.negative(clients)
+    assert set(negative[clients == 0]) <= {2, 3}
+    assert set(negative[clients == 1]) <= {1, 3}
+    assert set(negative[clients == 2]) == {-1}
+
+
+def test_popularity_outside_support():
+    # no client rated the items 2 and 3, which popularity draws never reach
+    np.random.seed(0)
+    sampler = Sampler([[0, 1], [0]], 4, 'popularity')
+    assert set(sampler.negative(np.zeros(200, dtype=np.int64))) == {2, 3}
+    assert set(sampler.negative(np.ones(200, dtype=np.int64))) == {1}